@@ -0,0 +1,182 @@
+import os
+import io
+import sys
+import glob
+import time
+import argparse
+import traceback
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import pandas as pd
+
+SUMMARY_FILE_NAME = 'batch_summary.csv'
+LOG_FILE_NAME = 'analysis_log.txt'
+
+def find_input_files(inputs, pattern='*.csv'):
+    # Folders are expanded with the pattern, files are taken as they are
+    input_files = []
+    for path in inputs:
+        if os.path.isdir(path):
+            input_files.extend(sorted(glob.glob(os.path.join(path, pattern))))
+        else:
+            input_files.append(path)
+    return input_files
+
+def assign_output_folders(input_files, output_root=None):
+    # Every cell gets its own folder: <output_root>/<name> or <input folder>/Graphen/<name>
+    output_folders = []
+    used = set()
+    for input_file in input_files:
+        name = os.path.splitext(os.path.basename(input_file))[0]
+        root = output_root or os.path.join(os.path.dirname(os.path.abspath(input_file)), 'Graphen')
+        folder = os.path.join(root, name)
+        suffix = 2
+        while folder in used:
+            folder = os.path.join(root, f'{name}_{suffix}')
+            suffix += 1
+        used.add(folder)
+        output_folders.append(folder)
+    return output_folders
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+
+def analyze_file(input_file, output_folder, parameters):
+    import CalculateDWithFlexibleAlphaGUI as calculate
+
+    start = time.perf_counter()
+    log = io.StringIO()
+    result = {'File': input_file, 'Output Folder': output_folder, 'Status': 'ok', 'Clusters': 0, 'Error': ''}
+    try:
+        os.makedirs(output_folder, exist_ok=True)
+        with redirect_stdout(log):
+            output_df = calculate.run_analysis(input_file, output_folder=output_folder, **parameters)
+        result['Clusters'] = len(output_df)
+    except Exception as e:
+        result['Status'] = 'error'
+        result['Error'] = f'{type(e).__name__}: {e}'
+        log.write(traceback.format_exc())
+    finally:
+        if os.path.isdir(output_folder):
+            with open(os.path.join(output_folder, LOG_FILE_NAME), 'w', encoding='utf-8') as f:
+                f.write(log.getvalue())
+    result['Seconds'] = round(time.perf_counter() - start, 3)
+    return result
+
+def run_batch(input_files, r_squared_threshold, min_duration, frame_interval, output_root=None, workers=None,
+              summary_path=None, progress=None, mp_context=None, **options):
+    # mp_context: e.g. multiprocessing.get_context('spawn') for callers with threads (GUI), which must not fork
+    parameters = dict(r_squared_threshold=r_squared_threshold, min_duration=min_duration,
+                      frame_interval=frame_interval, **options)
+    output_folders = assign_output_folders(input_files, output_root)
+    workers = workers or os.cpu_count() or 1
+
+    results = [None] * len(input_files)
+    pending = list(range(len(input_files)))
+    done = 0
+
+    def finish(i, result):
+        nonlocal done
+        results[i] = result
+        done += 1
+        print(f"[{done}/{len(input_files)}] {result['Status']}: {result['File']} {result['Error']}".rstrip())
+        if progress:
+            progress('Dateien', done, len(input_files))
+
+    # A worker that dies (out of memory, segfault) breaks the whole pool. The unfinished files
+    # are then run again one at a time in a fresh pool: a file killed for memory often succeeds
+    # alone, and if the pool breaks again the crashing file is the one that was running.
+    while pending:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, mp_context=mp_context)
+        # Filled one by one: submit itself raises BrokenProcessPool once a worker has died, and
+        # the files submitted until then must still be collected below
+        futures = {}
+        try:
+            for i in pending:
+                futures[executor.submit(analyze_file, input_files[i], output_folders[i], parameters)] = i
+            for future in as_completed(futures):
+                if future.exception() is not None:
+                    raise future.exception()
+                finish(futures[future], future.result())
+            pending = []
+        except BrokenProcessPool:
+            for future, i in futures.items():
+                if results[i] is None and future.done() and future.exception() is None:
+                    finish(i, future.result())
+            pending = [i for i in pending if results[i] is None]
+            if workers == 1 and pending:
+                # One file at a time: the first unfinished one crashed the worker
+                i = pending.pop(0)
+                finish(i, {'File': input_files[i], 'Output Folder': output_folders[i], 'Status': 'error',
+                           'Clusters': 0, 'Seconds': None,
+                           'Error': 'BrokenProcessPool: Prozess abgebrochen (z.B. zu wenig Speicher)'})
+            elif pending:
+                print(f"Ein Prozess wurde abgebrochen, {len(pending)} Dateien werden einzeln wiederholt")
+            workers = 1
+        except BaseException:
+            # e.g. a cancelled job: drop the queued files instead of waiting for all of them
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    summary = pd.DataFrame(results, columns=['File', 'Output Folder', 'Status', 'Clusters', 'Seconds', 'Error'])
+
+    if summary_path is None and input_files:
+        summary_root = output_root or os.path.commonpath([os.path.dirname(folder) for folder in output_folders])
+        summary_path = os.path.join(summary_root, SUMMARY_FILE_NAME)
+    if summary_path:
+        os.makedirs(os.path.dirname(os.path.abspath(summary_path)), exist_ok=True)
+        summary.to_csv(summary_path, index=False)
+        print(f"Batch-Zusammenfassung gespeichert: {summary_path}")
+
+    failed = (summary['Status'] != 'ok').sum()
+    print(f"{len(summary) - failed} von {len(summary)} Dateien erfolgreich analysiert, {failed} fehlgeschlagen")
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Diffusionsanalyse für viele MosaicResults-Dateien parallel ausführen.")
+    parser.add_argument('inputs', nargs='+', help="Ordner und/oder MosaicResults-Dateien")
+    parser.add_argument('--pattern', default='*.csv', help="Dateimuster für Ordner (Standard: *.csv)")
+    parser.add_argument('--r-squared-threshold', type=float, default=0.9)
+    parser.add_argument('--min-duration', type=int, default=30)
+    parser.add_argument('--frame-interval', type=int, default=10)
+    parser.add_argument('--output-root', help="Gemeinsamer Ausgabeordner (Standard: <Eingabeordner>/Graphen/<Datei>)")
+    parser.add_argument('--workers', type=int, default=None, help="Anzahl paralleler Prozesse (Standard: alle Kerne)")
+    parser.add_argument('--legacy-csv', action='store_true')
+    parser.add_argument('--weighted-fit', action='store_true')
+    parser.add_argument('--progress', action='store_true', help="Fortschritt als 'PROGRESS <Stufe> <fertig> <gesamt>' ausgeben")
+    parser.add_argument('--msd-plots', choices=['single', 'sheet', 'none'], default='single',
+                        help="MSD-Plots pro Cluster, als Übersichtsseiten oder keine (schneller für große Batches)")
+    parser.add_argument('--cache', nargs='?', const='', default=None, metavar='DIR',
+                        help="Ergebnis-Cache verwenden (Standard-Ordner: ~/.cache/single-cluster-tracking)")
+    parser.add_argument('--chunk-size', type=int, default=None, metavar='ROWS',
+                        help="MosaicResults blockweise mit kompakten Datentypen einlesen")
+    parser.add_argument('--profile', action='store_true', help="cProfile-Profil pro Datei im jeweiligen Ausgabeordner speichern")
+    parser.add_argument('--bootstrap', type=int, default=0, metavar='N',
+                        help="Konfidenzintervalle für D und Alpha aus N Bootstrap-Stichproben")
+    parser.add_argument('--seed', type=int, default=None, help="Startwert des Zufallsgenerators für --bootstrap")
+    parser.add_argument('--results-store', metavar='DIR',
+                        help="Ergebnisse aller Dateien an diesen Ergebnisspeicher anhängen")
+    parser.add_argument('--condition', help="Bedingung aller Dateien im Ergebnisspeicher (Standard: Alle)")
+    args = parser.parse_args()
+
+    input_files = find_input_files(args.inputs, args.pattern)
+    if not input_files:
+        print("Keine Eingabedateien gefunden.")
+        sys.exit(1)
+
+    from CalculateDWithFlexibleAlphaGUI import print_progress
+    summary = run_batch(input_files, args.r_squared_threshold, args.min_duration, args.frame_interval,
+                        output_root=args.output_root, workers=args.workers,
+                        progress=print_progress if args.progress else None,
+                        legacy_csv=args.legacy_csv, weighted_fit=args.weighted_fit, msd_plots=args.msd_plots,
+                        cache_dir=args.cache, chunk_size=args.chunk_size,
+                        profile=args.profile, bootstrap=args.bootstrap, seed=args.seed,
+                        results_store=args.results_store, condition=args.condition)
+    if (summary['Status'] != 'ok').any():
+        sys.exit(2)
+
+if __name__ == "__main__":
+    main()
@@ -1,234 +1,1082 @@
-import os
-import csv
-import sys
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-from scipy.optimize import curve_fit
-from sklearn.metrics import r2_score
-
-def process_tracking_data(input_file_path):
-    print(f"Processing file: {input_file_path}")
-    data = pd.read_csv(input_file_path)
-    tracks_data = {}
-
-    for index, row in data.iterrows():
-        track_id = int(row[1])
-        frame_id = int(row[2])
-        x_coord = float(row[3])
-        y_coord = float(row[4])
-        size_pixel = float(row[6]) 
-
-        if track_id not in tracks_data:
-            tracks_data[track_id] = []
-        tracks_data[track_id].append([frame_id, x_coord, y_coord, size_pixel])
-
-    return tracks_data
-
-def export_to_csv(tracks_data, output_folder, output_file_name):
-    os.makedirs(output_folder, exist_ok=True)
-    
-    csv_file_path = os.path.join(output_folder, output_file_name)
-    with open(csv_file_path, 'w', newline='') as f:
-        writer = csv.writer(f)
-
-        header_row = ['FrameID', 'Time [s]'] + [f'TrackID: {track_id} {param}' for track_id in tracks_data.keys() for param in ['X', 'Y', 'Size']]
-        writer.writerow(header_row)
-
-        max_frames = max(len(data) for data in tracks_data.values())
-        frame_rate = 10
-
-        for i in range(max_frames):
-            time_seconds = i * frame_rate
-            row = [i, time_seconds]
-            for track_data in tracks_data.values():
-                if i < len(track_data):
-                    row.extend([track_data[i][1] * 0.16, track_data[i][2] * 0.16, track_data[i][3] * 0.0256]) # Convert pixels to µm and µm²
-                else:
-                    row.extend(['', '', ''])
-            writer.writerow(row)
-
-    print(f"Exported to {csv_file_path}")
-
-def plot_tracks(tracks_data, output_folder, plot_file_name):
-    os.makedirs(output_folder, exist_ok=True)
-
-    plt.figure(figsize=(10, 6))
-    for track_id, track_data in tracks_data.items():
-        track_data = np.array(track_data)
-        plt.plot(track_data[:, 1] * 0.16, track_data[:, 2] * 0.16, label=f'TrackID {track_id}')
-    
-    plt.xlabel('X Position (µm)')
-    plt.ylabel('Y Position (µm)')
-    plt.title('Particle Tracks')
-    plt.legend()
-    plt.grid(True)
-    plt.savefig(os.path.join(output_folder, plot_file_name))
-    plt.close()
-
-def compute_diffusion_coefficients(data, plot_folder, r_squared_threshold, min_duration, frame_interval):
-    os.makedirs(plot_folder, exist_ok=True)
-
-    track_columns = [col for col in data.columns if col.startswith("TrackID")]
-
-    diffusion_coefficients = []
-    avg_cluster_sizes = []
-    msd_data = []
-    valid_clusters = []
-    alphas = []
-    r_squared_values = []
-
-    for i in range(0, len(track_columns), 3):
-        track_x_col = track_columns[i]
-        track_y_col = track_columns[i+1]
-        track_size_col = track_columns[i+2]
-        track_data = data[["Time [s]", track_x_col, track_y_col, track_size_col]].dropna()
-        times = track_data["Time [s]"].values
-
-        if len(times) <= 1 or (times[-1] - times[0]) < min_duration:
-            print(f"Track {track_x_col} hat nicht genügend Datenpunkte oder Dauer.")
-            continue
-
-        x_positions = track_data[track_x_col].values
-        y_positions = track_data[track_y_col].values
-        sizes_um2 = track_data[track_size_col].values
-
-        lags = np.arange(1, int(len(times) / 4))
-        if len(lags) == 0:
-            print(f"Nicht genügend Datenpunkte für Track {track_x_col}")
-            continue
-
-        msd = np.zeros(len(lags))
-        for j, lag in enumerate(lags):
-            if len(x_positions) <= lag:
-                print(f"Nicht genügend Datenpunkte für Lag {lag} bei Track {track_x_col}")
-                continue
-            dx = x_positions[lag:] - x_positions[:-lag]
-            dy = y_positions[lag:] - y_positions[:-lag]
-            msd[j] = np.mean(dx**2 + dy**2)
-
-        if len(msd) == 0 or np.isnan(msd).all():
-            print(f"Keine gültigen MSD-Daten für Track {track_x_col}")
-            continue
-
-        fit_range = min(int(len(lags) * 0.8), len(lags))
-        if fit_range < 4:
-            print(f"Nicht genügend Datenpunkte für linearen Fit bei Track {track_x_col}")
-            continue
-
-        xdata = np.log10(lags[:fit_range] * frame_interval)
-        ydata = np.log10(msd[:fit_range])
-
-        def log_fit_func(x, alpha, lg4D):
-            return alpha * x + lg4D
-
-        try:
-            popt, _ = curve_fit(log_fit_func, xdata, ydata, p0=[1, 0.1])
-            y_fit = log_fit_func(xdata, *popt)
-            r_squared = r2_score(ydata, y_fit)
-
-            if r_squared >= r_squared_threshold:
-                alpha, lg4D = popt
-                D_log = (10 ** lg4D) / 4
-
-                diffusion_coefficients.append(D_log)
-                avg_cluster_sizes.append(np.mean(sizes_um2))
-                valid_clusters.append(track_x_col.split(":")[1].strip().split()[0])
-                msd_data.append((lags * frame_interval, msd))
-                alphas.append(alpha)
-                r_squared_values.append(r_squared)
-            else:
-                print(f"R²-Wert zu niedrig für Track {track_x_col}: {r_squared:.2f}")
-        except Exception as e:
-            print(f"Fehler beim Fitten von log(MSD) vs. log(LagTime) für Track {track_x_col}: {e}")
-
-    output_df = pd.DataFrame({
-        "Cluster": valid_clusters,
-        "Average Cluster Size": avg_cluster_sizes,
-        "Diffusion Coefficient": diffusion_coefficients,
-        "Alpha": alphas,
-        "R_squared": r_squared_values
-    })
-
-    print(f"Output DataFrame: {output_df}")
-    return output_df, msd_data, valid_clusters
-
-def plot_and_fit_alphas(output_df, plot_folder):
-    os.makedirs(plot_folder, exist_ok=True)
-
-    # Split data by expression level
-    expression_levels = {
-        "HighEx": output_df[output_df['Cluster'].str.contains('HighEx')],
-        "LowEx": output_df[output_df['Cluster'].str.contains('LowEx')]
-    }
-
-    for level, df in expression_levels.items():
-        if df.empty:
-            print(f'Keine Daten für {level}')
-            continue
-
-        plt.figure(figsize=(10, 6))
-        plt.scatter(df["Average Cluster Size"], df["Alpha"], label=f'{level} Alpha')
-        
-        # Fit a line to the data
-        def linear_fit(x, m, c):
-            return m * x + c
-
-        try:
-            popt, _ = curve_fit(linear_fit, df["Average Cluster Size"], df["Alpha"])
-            plt.plot(df["Average Cluster Size"], linear_fit(df["Average Cluster Size"], *popt), color='red', label=f'{level} Fit')
-            plt.xlabel('Average Cluster Size (µm²)')
-            plt.ylabel('Alpha')
-            plt.title(f'Alpha vs. Average Cluster Size for {level}')
-            plt.legend()
-            plt.grid(True)
-            plt.savefig(os.path.join(plot_folder, f'{level}_alpha_fit.png'))
-            plt.close()
-            print(f'Fit parameters for {level}: Slope = {popt[0]}, Intercept = {popt[1]}')
-        except Exception as e:
-            print(f'Fehler beim Fitten der Alpha-Werte für {level}: {e}')
-
-def main():
-    if len(sys.argv) != 6:
-        print("Usage: python CalculateDWithFlexibleAlphaGUI.py <input_file> <r_squared_threshold> <min_duration> <frame_interval> <output_folder>")
-        return
-
-    input_file = sys.argv[1]
-    r_squared_threshold = float(sys.argv[2])
-    min_duration = int(sys.argv[3])
-    frame_interval = int(sys.argv[4])
-    output_folder = sys.argv[5]
-
-    output_file_name = "calculated_output.csv"
-
-    tracks_data = process_tracking_data(input_file)
-    export_to_csv(tracks_data, output_folder, output_file_name)
-    plot_tracks(tracks_data, output_folder, f'{output_file_name}_tracks_plot.png')
-    
-    combined_csv_file = os.path.join(output_folder, output_file_name)
-    data = pd.read_csv(combined_csv_file, encoding='latin-1')
-    
-    plot_folder = os.path.join(output_folder, 'Log(MSD)vsLog(LagTime)')
-    diffusion_output_file = os.path.join(output_folder, 'diffusion_coefficients.csv')
-
-    output_df, msd_data, valid_clusters = compute_diffusion_coefficients(data, plot_folder, r_squared_threshold, min_duration, frame_interval)
-
-    for i, (lags, msd) in enumerate(msd_data):
-        plt.figure(figsize=(10, 6))
-        plt.scatter(np.log10(lags), np.log10(msd), label=f'Cluster {valid_clusters[i]}')
-        plt.xlabel('Log10(Time Lag (s))')
-        plt.ylabel('Log10(MSD (Mean Squared Displacement))')
-        plt.title(f'MSD vs. Time Lag for Cluster {valid_clusters[i]}')
-        plt.legend()
-        plt.grid(True)
-        plot_path = os.path.join(plot_folder, f'MSD_Cluster_{valid_clusters[i]}.png')
-        plt.savefig(plot_path)
-        plt.close()
-
-    output_df.to_csv(diffusion_output_file, index=False)
-    print(f"Diffusion coefficients saved to {diffusion_output_file}")
-
-    plot_and_fit_alphas(output_df, plot_folder)
-
-if __name__ == "__main__":
-    main()
+import os
+import argparse
+import warnings
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+import numpy as np
+from RunReport import RunReport, optional_stage
+
+PIXEL_SIZE = 0.16  # µm per pixel
+PIXEL_AREA = 0.0256  # µm² per pixel
+ROW_INTERVAL = 10  # seconds per row of the exported track table
+
+
+def print_progress(stage, done, total):
+    # Machine-readable progress line, parsed by the GUI log pane
+    print(f"PROGRESS {stage} {done} {total}", flush=True)
+
+class TrackStore:
+    # Columnar storage for all tracks: one contiguous array per column, grouped
+    # by track, plus CSR-style offsets (track i lives in offsets[i]:offsets[i+1]).
+    def __init__(self, track_ids, offsets, frame, x, y, size):
+        self.track_ids = np.asarray(track_ids)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.frame = np.asarray(frame)
+        self.x = np.asarray(x)
+        self.y = np.asarray(y)
+        self.size = np.asarray(size)
+
+    @classmethod
+    def from_columns(cls, track_id, frame, x, y, size):
+        # Tracks keep the order of their first appearance and rows keep file order within a track
+        codes, track_ids = pd.factorize(np.asarray(track_id), sort=False)
+        order = np.argsort(codes, kind='stable')
+        counts = np.bincount(codes, minlength=len(track_ids))
+        offsets = np.zeros(len(track_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(track_ids, offsets, np.asarray(frame)[order], np.asarray(x)[order],
+                   np.asarray(y)[order], np.asarray(size)[order])
+
+    def __len__(self):
+        return len(self.track_ids)
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @property
+    def row_index(self):
+        # Position of every detection within its own track
+        return np.arange(len(self.frame)) - np.repeat(self.offsets[:-1], self.lengths)
+
+    def track(self, i):
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        return self.frame[start:stop], self.x[start:stop], self.y[start:stop], self.size[start:stop]
+
+    def items(self):
+        for i, track_id in enumerate(self.track_ids):
+            yield track_id, self.track(i)
+
+    def to_frame(self):
+        # Long format: one row per detection
+        return pd.DataFrame({
+            'TrackID': np.repeat(self.track_ids, self.lengths),
+            'FrameID': self.frame,
+            'X': self.x,
+            'Y': self.y,
+            'Size': self.size,
+        })
+
+    def save(self, path):
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.npz':
+            np.savez(path, track_ids=self.track_ids, offsets=self.offsets,
+                     frame=self.frame, x=self.x, y=self.y, size=self.size)
+        elif extension == '.parquet':
+            self.to_frame().to_parquet(path, index=False)
+        elif extension == '.feather':
+            self.to_frame().to_feather(path)
+        else:
+            raise ValueError(f"Unbekanntes Format für Zwischendatei: {path} (.npz, .parquet oder .feather)")
+        print(f"Tracks saved to {path}")
+
+    @classmethod
+    def load(cls, path):
+        extension = os.path.splitext(path)[1].lower()
+        if extension == '.npz':
+            with np.load(path) as stored:
+                return cls(stored['track_ids'], stored['offsets'], stored['frame'],
+                           stored['x'], stored['y'], stored['size'])
+        if extension == '.parquet':
+            table = pd.read_parquet(path)
+        elif extension == '.feather':
+            table = pd.read_feather(path)
+        else:
+            raise ValueError(f"Unbekanntes Format für Zwischendatei: {path} (.npz, .parquet oder .feather)")
+        return cls.from_columns(table['TrackID'].to_numpy(), table['FrameID'].to_numpy(),
+                                table['X'].to_numpy(), table['Y'].to_numpy(), table['Size'].to_numpy())
+
+
+# MosaicResults columns by header name; exports without these names fall back to the column positions
+MOSAIC_COLUMNS = {'track_id': 'Trajectory', 'frame': 'Frame', 'x': 'x', 'y': 'y', 'size': 'm0'}
+MOSAIC_POSITIONS = {'track_id': 1, 'frame': 2, 'x': 3, 'y': 4, 'size': 6}
+# Compact dtypes for the streaming ingest
+MOSAIC_DTYPES = {'track_id': np.int32, 'frame': np.int32, 'x': np.float32, 'y': np.float32, 'size': np.float32}
+
+def mosaic_columns(input_file_path):
+    header = pd.read_csv(input_file_path, nrows=0).columns
+    return {field: name if name in header else header[MOSAIC_POSITIONS[field]]
+            for field, name in MOSAIC_COLUMNS.items()}
+
+def _grouped_track_store(columns):
+    # Tracks are usually contiguous in the export, so the offsets follow directly from
+    # the ID changes; otherwise fall back to grouping with a stable sort.
+    track_id = columns['track_id']
+    starts = np.flatnonzero(np.r_[True, track_id[1:] != track_id[:-1]])[:len(track_id)]
+    track_ids = track_id[starts]
+    if len(np.unique(track_ids)) != len(track_ids):
+        return TrackStore.from_columns(track_id, columns['frame'], columns['x'], columns['y'], columns['size'])
+    offsets = np.append(starts, len(track_id)).astype(np.int64)
+    return TrackStore(track_ids, offsets, columns['frame'], columns['x'], columns['y'], columns['size'])
+
+def stream_tracking_data(input_file_path, columns, chunk_size):
+    # Reads only the needed columns in chunks of chunk_size rows. Every track except the
+    # last one of a chunk is complete and is moved into compact arrays right away; the
+    # rows of the last track are carried over into the next chunk.
+    finished = {field: [] for field in MOSAIC_DTYPES}
+    active = None
+    reader = pd.read_csv(input_file_path, usecols=list(columns.values()), chunksize=chunk_size,
+                         dtype={columns[field]: dtype for field, dtype in MOSAIC_DTYPES.items()})
+    for chunk in reader:
+        if not len(chunk):
+            # A file with only the header yields one empty chunk
+            continue
+        block = {field: chunk[column].to_numpy() for field, column in columns.items()}
+        if active is not None:
+            block = {field: np.concatenate([active[field], block[field]]) for field in block}
+        track_id = block['track_id']
+        other = np.flatnonzero(track_id != track_id[-1])
+        split = other[-1] + 1 if len(other) else 0
+        for field in block:
+            finished[field].append(block[field][:split])
+        active = {field: values[split:] for field, values in block.items()}
+
+    if active is not None:
+        for field in active:
+            finished[field].append(active[field])
+    return _grouped_track_store({field: np.concatenate(parts) if parts else np.zeros(0, MOSAIC_DTYPES[field])
+                                 for field, parts in finished.items()})
+
+def process_tracking_data(input_file_path, chunk_size=None):
+    print(f"Processing file: {input_file_path}")
+    columns = mosaic_columns(input_file_path)
+
+    if chunk_size:
+        tracks_data = stream_tracking_data(input_file_path, columns, chunk_size)
+    else:
+        data = pd.read_csv(input_file_path, usecols=list(columns.values()))
+        tracks_data = TrackStore.from_columns(
+            data[columns['track_id']].to_numpy().astype(np.int64),
+            data[columns['frame']].to_numpy().astype(np.int64),
+            data[columns['x']].to_numpy(dtype=np.float64),
+            data[columns['y']].to_numpy(dtype=np.float64),
+            data[columns['size']].to_numpy(dtype=np.float64),
+        )
+
+    print(f"{len(tracks_data)} Tracks mit {len(tracks_data.frame)} Detektionen eingelesen")
+    return tracks_data
+
+def export_to_csv(tracks_data, output_folder, output_file_name):
+    os.makedirs(output_folder, exist_ok=True)
+
+    csv_file_path = os.path.join(output_folder, output_file_name)
+
+    header_row = [f'TrackID: {track_id} {param}' for track_id in tracks_data.track_ids for param in ['X', 'Y', 'Size']]
+    max_frames = int(tracks_data.lengths.max()) if len(tracks_data) else 0
+
+    # Scatter every detection into its (row, track) cell of the wide table
+    wide = np.full((max_frames, 3 * len(tracks_data)), np.nan)
+    rows = tracks_data.row_index
+    columns = 3 * np.repeat(np.arange(len(tracks_data)), tracks_data.lengths)
+    wide[rows, columns] = tracks_data.x * PIXEL_SIZE  # Convert pixels to µm and µm²
+    wide[rows, columns + 1] = tracks_data.y * PIXEL_SIZE
+    wide[rows, columns + 2] = tracks_data.size * PIXEL_AREA
+
+    table = pd.DataFrame(wide, columns=header_row)
+    table.insert(0, 'Time [s]', np.arange(max_frames) * ROW_INTERVAL)
+    table.insert(0, 'FrameID', np.arange(max_frames))
+    table.to_csv(csv_file_path, index=False, na_rep='')
+
+    print(f"Exported to {csv_file_path}")
+
+TRACK_COLOR_PROPERTIES = {'D': 'Diffusion Coefficient', 'alpha': 'Alpha', 'size': 'Average Cluster Size'}
+
+def decimate_tracks(tracks_data, max_points_per_track):
+    # Keeps every k-th point (and the last one) of tracks longer than max_points_per_track
+    lengths = tracks_data.lengths
+    stride = np.maximum(1, -(-lengths // max_points_per_track))
+    rows = tracks_data.row_index
+    keep = (rows % np.repeat(stride, lengths) == 0) | (rows == np.repeat(lengths - 1, lengths))
+    offsets = np.zeros(len(tracks_data) + 1, dtype=np.int64)
+    np.cumsum(np.add.reduceat(keep, tracks_data.offsets[:-1]) if len(tracks_data) else [], out=offsets[1:])
+    return TrackStore(tracks_data.track_ids, offsets, tracks_data.frame[keep], tracks_data.x[keep],
+                      tracks_data.y[keep], tracks_data.size[keep])
+
+def track_property(tracks_data, output_df, name):
+    # Per-track values aligned with tracks_data.track_ids; tracks without a valid fit are NaN
+    column = TRACK_COLOR_PROPERTIES[name]
+    if name == 'size':
+        codes = np.repeat(np.arange(len(tracks_data)), tracks_data.lengths)
+        return np.bincount(codes, weights=tracks_data.size * PIXEL_AREA, minlength=len(tracks_data)) / np.maximum(tracks_data.lengths, 1)
+    values = pd.Series(output_df[column].to_numpy(), index=output_df['Cluster'].astype(str))
+    return values.reindex(tracks_data.track_ids.astype(str)).to_numpy(dtype=np.float64)
+
+def plot_tracks(tracks_data, output_folder, plot_file_name, color_values=None, color_label=None,
+                max_points_per_track=2000, legend_max_tracks=20, rasterize_above=500, window_overlay=None):
+    # All tracks are drawn as one LineCollection, so the cost no longer grows with one artist per track
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.collections import LineCollection
+    from matplotlib.lines import Line2D
+
+    os.makedirs(output_folder, exist_ok=True)
+
+    figure = Figure(figsize=(10, 6))
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot()
+
+    decimated = decimate_tracks(tracks_data, max_points_per_track)
+    coordinates = np.column_stack([decimated.x, decimated.y]) * PIXEL_SIZE
+    segments = np.split(coordinates, decimated.offsets[1:-1]) if len(decimated) else []
+    lines = LineCollection(segments, linewidths=1.0)
+    lines.set_rasterized(len(segments) > rasterize_above)
+
+    if color_values is not None:
+        lines.set_array(np.ma.masked_invalid(np.asarray(color_values, dtype=np.float64)))
+        lines.cmap.set_bad('lightgrey')
+        figure.colorbar(lines, ax=ax, label=color_label)
+    else:
+        lines.set_color([f'C{i % 10}' for i in range(len(segments))])
+    ax.add_collection(lines)
+    ax.autoscale_view()
+
+    if window_overlay is not None and len(window_overlay):
+        # Sliding-window results: window centres coloured by the local D
+        with np.errstate(divide='ignore', invalid='ignore'):
+            local_D = np.log10(window_overlay['Diffusion Coefficient'].to_numpy(dtype=np.float64))
+        points = ax.scatter(window_overlay['Center X (µm)'], window_overlay['Center Y (µm)'],
+                            c=np.ma.masked_invalid(local_D), s=6, cmap='plasma', zorder=3,
+                            rasterized=len(window_overlay) > rasterize_above)
+        figure.colorbar(points, ax=ax, label='Sliding-window log10(D)')
+
+    ax.set_xlabel('X Position (µm)')
+    ax.set_ylabel('Y Position (µm)')
+    ax.set_title('Particle Tracks')
+    if color_values is None and len(segments) <= legend_max_tracks:
+        handles = [Line2D([], [], color=f'C{i % 10}', label=f'TrackID {track_id}')
+                   for i, track_id in enumerate(decimated.track_ids)]
+        ax.legend(handles=handles)
+    else:
+        ax.legend(handles=[Line2D([], [], color='grey')], labels=[f'{len(segments)} Tracks'])
+    ax.grid(True)
+    figure.savefig(os.path.join(output_folder, plot_file_name))
+
+def _padded_positions(tracks_data, track_indices):
+    # Gather the selected tracks into zero-padded (tracks x points) arrays in µm,
+    # centred per track so the FFT formulation does not lose precision.
+    lengths = tracks_data.lengths[track_indices]
+    starts = tracks_data.offsets[track_indices]
+    rows = np.repeat(np.arange(len(track_indices)), lengths)
+    columns = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    source = np.repeat(starts, lengths) + columns
+
+    x = np.zeros((len(track_indices), lengths.max()))
+    y = np.zeros_like(x)
+    x[rows, columns] = tracks_data.x[source] * PIXEL_SIZE
+    y[rows, columns] = tracks_data.y[source] * PIXEL_SIZE
+    x[rows, columns] -= (np.bincount(rows, weights=x[rows, columns]) / lengths)[rows]
+    y[rows, columns] -= (np.bincount(rows, weights=y[rows, columns]) / lengths)[rows]
+    return x, y, lengths
+
+def _msd_fft(x, y, lengths):
+    # MSD(m) = S1(m) - 2 S2(m) with S2 the positional autocorrelation (via FFT) and
+    # S1 the summed squared positions of both ends of every displacement.
+    n_tracks, n_points = x.shape
+    n_fft = 1 << int(np.ceil(np.log2(2 * n_points)))
+    fx = np.fft.rfft(x, n=n_fft, axis=1)
+    fy = np.fft.rfft(y, n=n_fft, axis=1)
+    s2 = np.fft.irfft(fx * fx.conj() + fy * fy.conj(), n=n_fft, axis=1)[:, :n_points]
+
+    prefix = np.zeros((n_tracks, n_points + 1))
+    np.cumsum(x**2 + y**2, axis=1, out=prefix[:, 1:])
+    counts = lengths[:, None] - np.arange(n_points)
+    valid = counts > 0
+    s1 = prefix[:, -1:] - prefix[:, :-1] + np.take_along_axis(prefix, np.clip(counts, 0, n_points), axis=1)
+    return np.where(valid, (s1 - 2 * s2) / np.where(valid, counts, 1), np.nan)
+
+def _msd_direct(x, y, lengths):
+    msd = np.full(x.shape, np.nan)
+    for i, n in enumerate(lengths):
+        msd[i, 0] = 0.0
+        for lag in range(1, n):
+            dx = x[i, lag:n] - x[i, :n - lag]
+            dy = y[i, lag:n] - y[i, :n - lag]
+            msd[i, lag] = np.mean(dx**2 + dy**2)
+    return msd
+
+MSD_ENGINES = {'fft': _msd_fft, 'direct': _msd_direct}
+
+def compute_msd_curves(tracks_data, max_lags, track_indices=None, engine='fft', batch_elements=2**22, progress=None):
+    # Time-averaged MSD (µm²) of many tracks at once. Row i holds lags 1..max_lags[i]
+    # of track track_indices[i]; unused entries are NaN. Tracks are processed in
+    # batches of similar length so the padding stays small.
+    if track_indices is None:
+        track_indices = np.arange(len(tracks_data))
+    track_indices = np.asarray(track_indices, dtype=np.int64)
+    max_lags = np.broadcast_to(np.asarray(max_lags, dtype=np.int64), track_indices.shape)
+    msd_function = MSD_ENGINES[engine]
+
+    msd = np.full((len(track_indices), max(int(max_lags.max(initial=0)), 0)), np.nan)
+    order = np.argsort(tracks_data.lengths[track_indices], kind='stable')
+    start = 0
+    while start < len(order):
+        stop = start + 1
+        while stop < len(order):
+            longest = tracks_data.lengths[track_indices[order[stop]]]
+            if (stop - start + 1) * longest > batch_elements:
+                break
+            stop += 1
+        batch = order[start:stop]
+        x, y, lengths = _padded_positions(tracks_data, track_indices[batch])
+        batch_msd = msd_function(x, y, lengths)
+        n_lags = min(msd.shape[1], batch_msd.shape[1] - 1)
+        keep = np.arange(msd.shape[1])[:n_lags] < max_lags[batch][:, None]
+        msd[batch, :n_lags] = np.where(keep, batch_msd[:, 1:n_lags + 1], np.nan)
+        start = stop
+        if progress:
+            progress('MSD', stop, len(order))
+
+    return msd
+
+def fit_log_msd(lag_times, msd, n_points, weights=None):
+    # Weighted least-squares line log10(MSD) = alpha * log10(t) + lg4D for many
+    # tracks at once, using the first n_points[i] lags of row i. Tracks whose
+    # fit window contains non-positive or missing MSD values get NaN.
+    msd = np.atleast_2d(msd)
+    n_points = np.asarray(n_points)
+    used = np.arange(msd.shape[1]) < n_points[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = np.broadcast_to(np.log10(lag_times), msd.shape)
+        y = np.log10(msd)
+        fit_ok = (np.isfinite(y) | ~used).all(axis=1) & (n_points >= 2)
+
+        w = used & np.isfinite(y)
+        w = w * (1.0 if weights is None else np.broadcast_to(weights, msd.shape))
+        x = np.where(w > 0, x, 0.0)
+        y = np.where(w > 0, y, 0.0)
+
+        sum_w = w.sum(axis=1)
+        mean_x = (w * x).sum(axis=1) / sum_w
+        mean_y = (w * y).sum(axis=1) / sum_w
+        dx = x - mean_x[:, None]
+        dy = y - mean_y[:, None]
+        sxx = (w * dx * dx).sum(axis=1)
+        syy = (w * dy * dy).sum(axis=1)
+        alpha = (w * dx * dy).sum(axis=1) / sxx
+        lg4D = mean_y - alpha * mean_x
+        ss_res = (w * (dy - alpha[:, None] * dx) ** 2).sum(axis=1)
+        r_squared = np.where(syy > 0, 1 - ss_res / syy, np.where(ss_res == 0, 1.0, 0.0))
+
+    alpha[~fit_ok] = np.nan
+    lg4D[~fit_ok] = np.nan
+    r_squared[~fit_ok] = np.nan
+    return alpha, lg4D, (10 ** lg4D) / 4, r_squared
+
+def lag_ranges(lengths, lag_fraction=0.25, fit_fraction=0.8):
+    # Number of MSD lags per track (a quarter of the track length by default)
+    # and how many of them enter the log-log fit
+    n_lags = np.maximum(np.floor(lengths * lag_fraction).astype(np.int64) - 1, 0)
+    fit_range = np.minimum((n_lags * fit_fraction).astype(np.int64), n_lags)
+    return n_lags, fit_range
+
+def compute_msd_table(tracks_data, msd_engine='fft', progress=None, lag_fraction=0.25, fit_fraction=0.8):
+    # MSD curves of every track that is long enough for a fit. Independent of the
+    # R² threshold, the minimum duration and the frame interval, so it can be cached.
+    lengths = tracks_data.lengths
+    n_lags, fit_range = lag_ranges(lengths, lag_fraction, fit_fraction)
+    mean_sizes = np.bincount(np.repeat(np.arange(len(tracks_data)), lengths),
+                             weights=tracks_data.size * PIXEL_AREA, minlength=len(tracks_data)) / np.maximum(lengths, 1)
+
+    fittable = np.flatnonzero((lengths > 1) & (n_lags > 0) & (fit_range >= 4))
+    msd_curves = compute_msd_curves(tracks_data, n_lags[fittable], fittable, engine=msd_engine, progress=progress)
+    return {
+        'track_ids': tracks_data.track_ids,
+        'lengths': lengths,
+        'n_lags': n_lags,
+        'fit_range': fit_range,
+        'mean_sizes': mean_sizes,
+        'fittable': fittable,
+        'msd_curves': msd_curves,
+    }
+
+def fit_msd_table(msd_table, frame_interval, weighted_fit=False):
+    # Log-log fits of all rows of an MSD table in one batched pass
+    fittable = msd_table['fittable']
+    msd_curves = msd_table['msd_curves']
+    lag_numbers = np.arange(1, msd_curves.shape[1] + 1)
+    weights = None
+    if weighted_fit:
+        # Weight every lag by the number of displacements averaged into it
+        weights = np.maximum(msd_table['lengths'][fittable][:, None] - lag_numbers, 0)
+    alpha, lg4D, D, r_squared = fit_log_msd(lag_numbers * frame_interval, msd_curves,
+                                            msd_table['fit_range'][fittable], weights)
+    return {'alpha': alpha, 'lg4D': lg4D, 'D': D, 'r_squared': r_squared}
+
+def _bootstrap_chunk(lag_times, msd_curves, fit_range, weights, n_resamples, seed):
+    # n_resamples refits of every track at once. The fit-window lags of each track are
+    # drawn with replacement; their multiplicities weight the closed-form least-squares
+    # sums, so the logarithms are taken only once for all resamples.
+    rng = np.random.default_rng(seed)
+    n_tracks, n_lags = msd_curves.shape
+    width = int(fit_range.max())
+    draws = (rng.random((n_resamples, n_tracks, width)) * fit_range[:, None]).astype(np.int64)
+    drawn = np.broadcast_to(np.arange(width) < fit_range[:, None], draws.shape)
+    rows = np.arange(n_resamples * n_tracks).reshape(n_resamples, n_tracks, 1)
+    w = np.bincount((rows * n_lags + draws)[drawn], minlength=n_resamples * n_tracks * n_lags)
+    w = w.reshape(n_resamples, n_tracks, n_lags).astype(np.float64)
+    distinct = (w > 0).sum(axis=2)
+    if weights is not None:
+        w *= weights
+
+    # Same validity rule as fit_log_msd: every MSD value in the fit window must be positive
+    used = np.arange(n_lags) < fit_range[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = np.log10(lag_times)
+        y = np.log10(msd_curves)
+    fit_ok = (np.isfinite(y) | ~used).all(axis=1)
+    y = np.where(used & fit_ok[:, None], y, 0.0)
+
+    sum_w = w.sum(axis=2)
+    sum_x = w @ x
+    sum_y = np.einsum('rtk,tk->rt', w, y)
+    sum_xx = w @ (x * x)
+    sum_xy = np.einsum('rtk,tk->rt', w, x * y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        alpha = (sum_w * sum_xy - sum_x * sum_y) / (sum_w * sum_xx - sum_x ** 2)
+        lg4D = (sum_y - alpha * sum_x) / sum_w
+    # A single distinct lag has no slope
+    invalid = ~fit_ok | (distinct < 2)
+    alpha[invalid] = np.nan
+    lg4D[invalid] = np.nan
+    return alpha, (10 ** lg4D) / 4
+
+def bootstrap_msd_table(msd_table, frame_interval, n_resamples=1000, seed=None, weighted_fit=False, workers=1,
+                        ci_level=0.95, batch_elements=2**22, progress=None, mp_context=None):
+    # Percentile confidence intervals of D and alpha for every row of an MSD table.
+    # Resamples are split into fixed chunks with their own seeds (SeedSequence.spawn),
+    # so the result for a given seed does not depend on the number of workers.
+    # mp_context: e.g. multiprocessing.get_context('spawn') for callers with threads (GUI), which must not fork
+    fittable = msd_table['fittable']
+    msd_curves = msd_table['msd_curves']
+    fit_range = msd_table['fit_range'][fittable]
+    lag_numbers = np.arange(1, msd_curves.shape[1] + 1)
+    weights = None
+    if weighted_fit:
+        weights = np.maximum(msd_table['lengths'][fittable][:, None] - lag_numbers, 0)
+    n_tracks = len(fittable)
+    if n_tracks == 0 or n_resamples <= 0:
+        empty = np.full(n_tracks, np.nan)
+        return {'alpha_ci_low': empty, 'alpha_ci_high': empty, 'D_ci_low': empty, 'D_ci_high': empty}
+
+    chunk = max(1, min(n_resamples, batch_elements // msd_curves.size))
+    starts = list(range(0, n_resamples, chunk))
+    seeds = np.random.SeedSequence(seed).spawn(len(starts))
+    chunk_args = [(lag_numbers * frame_interval, msd_curves, fit_range, weights, min(chunk, n_resamples - start), s)
+                  for start, s in zip(starts, seeds)]
+
+    alpha = np.empty((n_resamples, n_tracks))
+    D = np.empty((n_resamples, n_tracks))
+    if workers <= 1:
+        for done, (start, args) in enumerate(zip(starts, chunk_args), 1):
+            alpha_chunk, D_chunk = _bootstrap_chunk(*args)
+            alpha[start:start + len(alpha_chunk)] = alpha_chunk
+            D[start:start + len(D_chunk)] = D_chunk
+            if progress:
+                progress('Bootstrap', done, len(starts))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as executor:
+            futures = {executor.submit(_bootstrap_chunk, *args): start for start, args in zip(starts, chunk_args)}
+            for done, future in enumerate(as_completed(futures), 1):
+                start = futures[future]
+                alpha_chunk, D_chunk = future.result()
+                alpha[start:start + len(alpha_chunk)] = alpha_chunk
+                D[start:start + len(D_chunk)] = D_chunk
+                if progress:
+                    progress('Bootstrap', done, len(starts))
+
+    # Degenerate resamples (NaN) are ignored
+    tail = (1 - ci_level) / 2 * 100
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        alpha_low, alpha_high = np.nanpercentile(alpha, [tail, 100 - tail], axis=0)
+        D_low, D_high = np.nanpercentile(D, [tail, 100 - tail], axis=0)
+    return {'alpha_ci_low': alpha_low, 'alpha_ci_high': alpha_high, 'D_ci_low': D_low, 'D_ci_high': D_high}
+
+# Output columns of the bootstrap intervals and the fit keys they come from
+CI_COLUMNS = {'D CI Low': 'D_ci_low', 'D CI High': 'D_ci_high', 'Alpha CI Low': 'alpha_ci_low',
+              'Alpha CI High': 'alpha_ci_high'}
+
+# Reasons a track is dropped by select_diffusion_results, counted in the run report
+REJECTION_REASONS = ('too_short', 'too_few_lags', 'too_few_fit_points', 'fit_error', 'low_r_squared')
+
+def select_diffusion_results(msd_table, fits, r_squared_threshold, min_duration, frame_interval, report=None):
+    # Applies the duration and R² thresholds to already fitted tracks
+    rejected = dict.fromkeys(REJECTION_REASONS, 0)
+    diffusion_coefficients = []
+    avg_cluster_sizes = []
+    msd_data = []
+    valid_clusters = []
+    alphas = []
+    r_squared_values = []
+    accepted_rows = []
+
+    lengths = msd_table['lengths']
+    durations = (lengths - 1) * ROW_INTERVAL
+    n_lags = msd_table['n_lags']
+    fit_range = msd_table['fit_range']
+    msd_curves = msd_table['msd_curves']
+    lag_numbers = np.arange(1, msd_curves.shape[1] + 1)
+    fit_rows = dict(zip(msd_table['fittable'].tolist(), range(len(msd_table['fittable']))))
+
+    for i, track_id in enumerate(msd_table['track_ids']):
+        track_name = f"TrackID: {track_id}"
+
+        if lengths[i] <= 1 or durations[i] < min_duration:
+            print(f"Track {track_name} hat nicht genügend Datenpunkte oder Dauer.")
+            rejected['too_short'] += 1
+            continue
+        if n_lags[i] == 0:
+            print(f"Nicht genügend Datenpunkte für Track {track_name}")
+            rejected['too_few_lags'] += 1
+            continue
+        if fit_range[i] < 4:
+            print(f"Nicht genügend Datenpunkte für linearen Fit bei Track {track_name}")
+            rejected['too_few_fit_points'] += 1
+            continue
+
+        row = fit_rows[i]
+        if np.isnan(fits['alpha'][row]):
+            print(f"Fehler beim Fitten von log(MSD) vs. log(LagTime) für Track {track_name}: ungültige MSD-Werte im Fitbereich")
+            rejected['fit_error'] += 1
+            continue
+        if fits['r_squared'][row] < r_squared_threshold:
+            print(f"R²-Wert zu niedrig für Track {track_name}: {fits['r_squared'][row]:.2f}")
+            rejected['low_r_squared'] += 1
+            continue
+
+        diffusion_coefficients.append(fits['D'][row])
+        avg_cluster_sizes.append(msd_table['mean_sizes'][i])
+        valid_clusters.append(str(track_id))
+        msd_data.append((lag_numbers[:n_lags[i]] * frame_interval, msd_curves[row, :n_lags[i]]))
+        alphas.append(fits['alpha'][row])
+        r_squared_values.append(fits['r_squared'][row])
+        accepted_rows.append(row)
+
+    output_df = pd.DataFrame({
+        "Cluster": valid_clusters,
+        "Average Cluster Size": avg_cluster_sizes,
+        "Diffusion Coefficient": diffusion_coefficients,
+        "Alpha": alphas,
+        "R_squared": r_squared_values
+    })
+    # Bootstrap intervals, if bootstrap_msd_table was run on these fits
+    for column, key in CI_COLUMNS.items():
+        if key in fits:
+            output_df[column] = np.asarray(fits[key])[np.asarray(accepted_rows, dtype=np.int64)]
+
+    print(f"Output DataFrame: {output_df}")
+    if report:
+        for reason, count in rejected.items():
+            report.count(f'rejected_{reason}', count)
+        report.count('tracks_accepted', len(output_df))
+    return output_df, msd_data, valid_clusters
+
+def compute_diffusion_coefficients(tracks_data, plot_folder, r_squared_threshold, min_duration, frame_interval,
+                                   msd_engine='fft', weighted_fit=False, progress=None,
+                                   bootstrap=0, seed=None, bootstrap_workers=1, mp_context=None):
+    os.makedirs(plot_folder, exist_ok=True)
+
+    msd_table = compute_msd_table(tracks_data, msd_engine, progress)
+    fits = fit_msd_table(msd_table, frame_interval, weighted_fit)
+    if bootstrap:
+        fits.update(bootstrap_msd_table(msd_table, frame_interval, bootstrap, seed, weighted_fit, bootstrap_workers,
+                                        progress=progress, mp_context=mp_context))
+    return select_diffusion_results(msd_table, fits, r_squared_threshold, min_duration, frame_interval)
+
+ENSEMBLE_MSD_FILE_NAME = 'ensemble_msd.csv'
+ENSEMBLE_FIT_FILE_NAME = 'ensemble_fit.csv'
+ENSEMBLE_FIT_COLUMNS = ['Tracks', 'Fit Points', 'Alpha', 'Alpha SE', 'Diffusion Coefficient', 'D SE', 'R_squared']
+
+def accepted_msd_rows(msd_table, fits, r_squared_threshold, min_duration):
+    # Rows of the MSD table that select_diffusion_results keeps, without the per-track loop
+    fittable = msd_table['fittable']
+    durations = (msd_table['lengths'][fittable] - 1) * ROW_INTERVAL
+    with np.errstate(invalid='ignore'):
+        keep = (durations >= min_duration) & ~np.isnan(fits['alpha']) & (fits['r_squared'] >= r_squared_threshold)
+    return np.flatnonzero(keep)
+
+def ensemble_msd(msd_curves, n_lags, frame_interval):
+    # Track average of the time-averaged MSD curves per lag. Lags beyond the n_lags of a
+    # track are masked, so every lag is averaged over the tracks that reach it.
+    lag_numbers = np.arange(1, msd_curves.shape[1] + 1)
+    mask = (lag_numbers > np.asarray(n_lags)[:, None]) | ~np.isfinite(msd_curves)
+    curves = np.ma.masked_array(msd_curves, mask=mask)
+    tracks = curves.count(axis=0)
+    mean = curves.mean(axis=0).filled(np.nan) if len(curves) else np.full(len(lag_numbers), np.nan)
+    sd = curves.std(axis=0, ddof=1).filled(np.nan) if len(curves) > 1 else np.full(len(lag_numbers), np.nan)
+    ensemble = pd.DataFrame({
+        'Lag Time': lag_numbers * frame_interval,
+        'Tracks': tracks,
+        'MSD': mean,
+        'MSD SD': sd,
+        'MSD SEM': sd / np.sqrt(np.maximum(tracks, 1)),
+    })
+    return ensemble[ensemble['Tracks'] > 0].reset_index(drop=True)
+
+def pool_ensemble_msd(ensembles):
+    # Combines ensemble tables (e.g. of several cells) into the table of all their tracks,
+    # using per-lag counts, means and standard deviations
+    data = pd.concat(ensembles, ignore_index=True)
+    tracks = data['Tracks'].to_numpy(dtype=np.float64)
+    mean = data['MSD'].to_numpy()
+    variance = np.nan_to_num(data['MSD SD'].to_numpy() ** 2)
+    sums = pd.DataFrame({
+        'Lag Time': data['Lag Time'],
+        'Tracks': data['Tracks'],
+        'sum': tracks * mean,
+        'sum_squares': (tracks - 1) * variance + tracks * mean ** 2,
+    }).groupby('Lag Time', sort=True).sum()
+
+    tracks = sums['Tracks'].to_numpy(dtype=np.float64)
+    mean = sums['sum'].to_numpy() / tracks
+    with np.errstate(invalid='ignore', divide='ignore'):
+        variance = np.clip(sums['sum_squares'].to_numpy() - tracks * mean ** 2, 0, None) / (tracks - 1)
+    sd = np.where(tracks > 1, np.sqrt(variance), np.nan)
+    return pd.DataFrame({
+        'Lag Time': sums.index.to_numpy(),
+        'Tracks': sums['Tracks'].to_numpy(),
+        'MSD': mean,
+        'MSD SD': sd,
+        'MSD SEM': sd / np.sqrt(tracks),
+    })
+
+def fit_ensemble_msd(ensemble, min_track_fraction=0.5):
+    # Population alpha and D from the ensemble MSD, fitted over the lags that at least
+    # min_track_fraction of the tracks reach. Points are weighted with 1/SE² of log10(MSD);
+    # the standard errors are scaled with the reduced chi² of the fit.
+    lag_times = ensemble['Lag Time'].to_numpy(dtype=np.float64)
+    msd = ensemble['MSD'].to_numpy(dtype=np.float64)
+    sem = ensemble['MSD SEM'].to_numpy(dtype=np.float64)
+    tracks = ensemble['Tracks'].to_numpy()
+    n_tracks = int(tracks.max(initial=0))
+    with np.errstate(invalid='ignore'):
+        use = (tracks >= max(min_track_fraction * n_tracks, 2)) & (msd > 0) & (sem > 0)
+    result = dict.fromkeys(ENSEMBLE_FIT_COLUMNS, np.nan)
+    result.update({'Tracks': n_tracks, 'Fit Points': int(use.sum())})
+    if use.sum() < 3:
+        return result
+
+    x = np.log10(lag_times[use])
+    y = np.log10(msd[use])
+    w = (msd[use] * np.log(10) / sem[use]) ** 2
+    alpha, lg4D, D, r_squared = fit_log_msd(lag_times[use], msd[use][None], np.array([len(x)]), w[None])
+    mean_x = np.sum(w * x) / np.sum(w)
+    sxx = np.sum(w * (x - mean_x) ** 2)
+    reduced_chi2 = np.sum(w * (y - lg4D[0] - alpha[0] * x) ** 2) / (len(x) - 2)
+    lg4D_se = np.sqrt(reduced_chi2 * (1 / np.sum(w) + mean_x ** 2 / sxx))
+    result.update({
+        'Alpha': alpha[0],
+        'Alpha SE': np.sqrt(reduced_chi2 / sxx),
+        'Diffusion Coefficient': D[0],
+        'D SE': D[0] * np.log(10) * lg4D_se,
+        'R_squared': r_squared[0],
+    })
+    return result
+
+def write_ensemble_results(msd_table, fits, r_squared_threshold, min_duration, frame_interval, output_folder):
+    # Ensemble MSD and population fit of all accepted tracks of one cell
+    rows = accepted_msd_rows(msd_table, fits, r_squared_threshold, min_duration)
+    n_lags = msd_table['n_lags'][msd_table['fittable'][rows]]
+    ensemble = ensemble_msd(msd_table['msd_curves'][rows], n_lags, frame_interval)
+    ensemble_fit = fit_ensemble_msd(ensemble)
+    ensemble.to_csv(os.path.join(output_folder, ENSEMBLE_MSD_FILE_NAME), index=False)
+    pd.DataFrame([ensemble_fit], columns=ENSEMBLE_FIT_COLUMNS).to_csv(
+        os.path.join(output_folder, ENSEMBLE_FIT_FILE_NAME), index=False)
+    print(f"Ensemble-MSD ({ensemble_fit['Tracks']} Tracks): Alpha = {ensemble_fit['Alpha']:.3f} ± {ensemble_fit['Alpha SE']:.3f}, "
+          f"D = {ensemble_fit['Diffusion Coefficient']:.3g} ± {ensemble_fit['D SE']:.2g}")
+    return ensemble, ensemble_fit
+
+SLIDING_WINDOW_FILE_NAME = 'sliding_window_diffusion.csv'
+
+def window_starts(lengths, window, step):
+    # Track index and first row (within the track) of every window; shorter tracks get none
+    counts = np.where(lengths >= window, (lengths - window) // step + 1, 0)
+    track = np.repeat(np.arange(len(lengths)), counts)
+    window_index = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return track, window_index, window_index * step
+
+def sliding_window_msd(tracks_data, first_rows, window, n_lags):
+    # MSD (µm²) of lags 1..n_lags in every window of `window` rows starting at the global rows
+    # first_rows. Each lag is one pass over all detections: the squared displacements are
+    # summed with a running sum and every window is a difference of two of its entries.
+    x = tracks_data.x.astype(np.float64) * PIXEL_SIZE
+    y = tracks_data.y.astype(np.float64) * PIXEL_SIZE
+    msd = np.empty((len(first_rows), n_lags))
+    for lag in range(1, n_lags + 1):
+        running = np.zeros(len(x) - lag + 1)
+        np.cumsum((x[lag:] - x[:-lag]) ** 2 + (y[lag:] - y[:-lag]) ** 2, out=running[1:])
+        msd[:, lag - 1] = (running[first_rows + window - lag] - running[first_rows]) / (window - lag)
+    return msd
+
+def window_means(values, first_rows, window):
+    running = np.zeros(len(values) + 1)
+    np.cumsum(values, out=running[1:])
+    return (running[first_rows + window] - running[first_rows]) / window
+
+def sliding_window_diffusion(tracks_data, frame_interval, window=40, step=10, weighted_fit=False,
+                             lag_fraction=0.25, fit_fraction=0.8):
+    # Local alpha and D along every track: windows of `window` rows, moved by `step` rows,
+    # with the same lag and fit ranges as a whole track of that length
+    if window < 2 or step < 1:
+        raise ValueError(f"Ungültige Fenster: Länge {window} (mindestens 2), Schritt {step} (mindestens 1)")
+    n_lags, fit_range = (int(value[0]) for value in lag_ranges(np.array([window]), lag_fraction, fit_fraction))
+    if fit_range < 4:
+        raise ValueError(f"Fenster von {window} Punkten ist zu kurz für einen Fit (mindestens 4 Fitpunkte nötig)")
+    track, window_index, start = window_starts(tracks_data.lengths, window, step)
+    first_rows = tracks_data.offsets[track] + start
+
+    msd = sliding_window_msd(tracks_data, first_rows, window, n_lags)
+    lag_numbers = np.arange(1, n_lags + 1)
+    weights = window - lag_numbers if weighted_fit else None
+    alpha, _, D, r_squared = fit_log_msd(lag_numbers * frame_interval, msd, np.full(len(msd), fit_range), weights)
+    return pd.DataFrame({
+        'Cluster': tracks_data.track_ids[track].astype(str),
+        'Window': window_index,
+        'Start Frame': tracks_data.frame[first_rows],
+        'End Frame': tracks_data.frame[first_rows + window - 1],
+        'Center X (µm)': window_means(tracks_data.x.astype(np.float64), first_rows, window) * PIXEL_SIZE,
+        'Center Y (µm)': window_means(tracks_data.y.astype(np.float64), first_rows, window) * PIXEL_SIZE,
+        'Diffusion Coefficient': D,
+        'Alpha': alpha,
+        'R_squared': r_squared,
+    })
+
+MSD_PLOT_MODES = ('single', 'sheet', 'none')
+
+def _padded_limits(values, margin=0.05):
+    low, high = np.min(values), np.max(values)
+    pad = (high - low) * margin if high > low else 0.5
+    return low - pad, high + pad
+
+def _render_single_msd_plots(plot_folder, clusters, progress=None):
+    # One Agg figure per worker; only the scatter data, labels and limits change per cluster
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    figure = Figure(figsize=(10, 6))
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot()
+    points = ax.scatter([], [])
+    ax.set_xlabel('Log10(Time Lag (s))')
+    ax.set_ylabel('Log10(MSD (Mean Squared Displacement))')
+    ax.grid(True)
+
+    for cluster, lags, msd in clusters:
+        log_lags, log_msd = np.log10(lags), np.log10(msd)
+        points.set_offsets(np.column_stack([log_lags, log_msd]))
+        points.set_label(f'Cluster {cluster}')
+        ax.set_xlim(*_padded_limits(log_lags))
+        ax.set_ylim(*_padded_limits(log_msd[np.isfinite(log_msd)] if np.isfinite(log_msd).any() else [0]))
+        ax.set_title(f'MSD vs. Time Lag for Cluster {cluster}')
+        ax.legend(loc='upper left')
+        figure.savefig(os.path.join(plot_folder, f'MSD_Cluster_{cluster}.png'))
+        if progress:
+            progress()
+    return len(clusters)
+
+def _render_msd_contact_sheets(plot_folder, pages, rows, columns, progress=None):
+    # Many clusters per image; the figure, its axes and their scatter artists are reused for every page
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    figure = Figure(figsize=(3 * columns, 2.4 * rows))
+    FigureCanvasAgg(figure)
+    axes = figure.subplots(rows, columns, squeeze=False).ravel()
+    panels = []
+    for ax in axes:
+        ax.set_title('Cluster', fontsize=9)
+        ax.tick_params(labelsize=7)
+        ax.grid(True)
+        panels.append(ax.scatter([], [], s=8))
+    figure.supxlabel('Log10(Time Lag (s))')
+    figure.supylabel('Log10(MSD (Mean Squared Displacement))')
+    figure.tight_layout()
+
+    for page, clusters in pages:
+        for i, (ax, points) in enumerate(zip(axes, panels)):
+            ax.set_visible(i < len(clusters))
+            if i >= len(clusters):
+                continue
+            cluster, lags, msd = clusters[i]
+            log_lags, log_msd = np.log10(lags), np.log10(msd)
+            points.set_offsets(np.column_stack([log_lags, log_msd]))
+            ax.set_xlim(*_padded_limits(log_lags))
+            ax.set_ylim(*_padded_limits(log_msd[np.isfinite(log_msd)] if np.isfinite(log_msd).any() else [0]))
+            ax.set_title(f'Cluster {cluster}', fontsize=9)
+        figure.savefig(os.path.join(plot_folder, f'MSD_ContactSheet_{page:03d}.png'))
+        if progress:
+            progress()
+    return sum(len(clusters) for _, clusters in pages)
+
+def render_msd_plots(msd_data, valid_clusters, plot_folder, mode='single', workers=1, sheet_rows=5, sheet_columns=5,
+                     progress=None, mp_context=None):
+    # Renders the per-cluster log-log MSD plots headlessly, optionally spread over a process pool
+    # (mp_context as in bootstrap_msd_table)
+    if mode == 'none' or not msd_data:
+        return 0
+    if mode not in MSD_PLOT_MODES:
+        raise ValueError(f"Unbekannter Plotmodus: {mode} ({', '.join(MSD_PLOT_MODES)})")
+    os.makedirs(plot_folder, exist_ok=True)
+
+    clusters = [(cluster, lags, msd) for cluster, (lags, msd) in zip(valid_clusters, msd_data)]
+    if mode == 'single':
+        render, items = _render_single_msd_plots, clusters
+    else:
+        per_page = sheet_rows * sheet_columns
+        items = [(page, clusters[start:start + per_page]) for page, start in enumerate(range(0, len(clusters), per_page), 1)]
+        render = partial(_render_msd_contact_sheets, rows=sheet_rows, columns=sheet_columns)
+
+    done = 0
+    def item_done(count=1):
+        nonlocal done
+        done += count
+        if progress:
+            progress('Plots', done, len(items))
+
+    workers = max(1, min(workers, len(items)))
+    if workers == 1:
+        return render(plot_folder, items, progress=item_done)
+
+    # Several small chunks per worker so progress is reported while rendering
+    chunk_size = max(1, len(items) // (workers * 8))
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as executor:
+        futures = {executor.submit(render, plot_folder, chunk): len(chunk) for chunk in chunks}
+        for future in as_completed(futures):
+            item_done(futures[future])
+        return sum(future.result() for future in futures)
+
+def plot_and_fit_alphas(output_df, plot_folder):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from scipy.optimize import curve_fit
+
+    os.makedirs(plot_folder, exist_ok=True)
+
+    # Split data by expression level
+    expression_levels = {
+        "HighEx": output_df[output_df['Cluster'].str.contains('HighEx')],
+        "LowEx": output_df[output_df['Cluster'].str.contains('LowEx')]
+    }
+
+    plots_written = 0
+    for level, df in expression_levels.items():
+        if df.empty:
+            print(f'Keine Daten für {level}')
+            continue
+
+        figure = Figure(figsize=(10, 6))
+        FigureCanvasAgg(figure)
+        ax = figure.add_subplot()
+        ax.scatter(df["Average Cluster Size"], df["Alpha"], label=f'{level} Alpha')
+        
+        # Fit a line to the data
+        def linear_fit(x, m, c):
+            return m * x + c
+
+        try:
+            popt, _ = curve_fit(linear_fit, df["Average Cluster Size"], df["Alpha"])
+            ax.plot(df["Average Cluster Size"], linear_fit(df["Average Cluster Size"], *popt), color='red', label=f'{level} Fit')
+            ax.set_xlabel('Average Cluster Size (µm²)')
+            ax.set_ylabel('Alpha')
+            ax.set_title(f'Alpha vs. Average Cluster Size for {level}')
+            ax.legend()
+            ax.grid(True)
+            figure.savefig(os.path.join(plot_folder, f'{level}_alpha_fit.png'))
+            plots_written += 1
+            print(f'Fit parameters for {level}: Slope = {popt[0]}, Intercept = {popt[1]}')
+        except Exception as e:
+            print(f'Fehler beim Fitten der Alpha-Werte für {level}: {e}')
+    return plots_written
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Berechnet Diffusionskoeffizienten und Alpha-Werte aus MosaicResults-Tracks.")
+    parser.add_argument('input_file', help="MosaicResults-CSV oder gespeicherte Tracks (.npz/.parquet/.feather)")
+    parser.add_argument('r_squared_threshold', type=float)
+    parser.add_argument('min_duration', type=int)
+    parser.add_argument('frame_interval', type=int)
+    parser.add_argument('output_folder')
+    parser.add_argument('--legacy-csv', action='store_true',
+                        help="Zusätzlich die breite calculated_output.csv schreiben")
+    parser.add_argument('--save-tracks', metavar='PATH',
+                        help="Tracks im Langformat als .npz, .parquet oder .feather speichern")
+    parser.add_argument('--msd-engine', choices=sorted(MSD_ENGINES), default='fft',
+                        help="MSD-Berechnung: 'fft' (alle Tracks gebündelt) oder 'direct' (Schleife über alle Lags)")
+    parser.add_argument('--weighted-fit', action='store_true',
+                        help="Log-Log-Fit mit der Anzahl der Verschiebungen pro Lag gewichten")
+    parser.add_argument('--msd-plots', choices=MSD_PLOT_MODES, default='single',
+                        help="MSD-Plots pro Cluster ('single'), als Übersichtsseiten ('sheet') oder keine ('none')")
+    parser.add_argument('--plot-workers', type=int, default=1, help="Anzahl paralleler Prozesse für die MSD-Plots")
+    parser.add_argument('--track-color', choices=sorted(TRACK_COLOR_PROPERTIES), default=None,
+                        help="Tracks in der Übersicht nach D, Alpha oder Clustergröße einfärben")
+    parser.add_argument('--legend-max-tracks', type=int, default=20,
+                        help="Legende mit einzelnen TrackIDs nur bis zu dieser Anzahl Tracks")
+    parser.add_argument('--progress', action='store_true', help="Fortschritt als 'PROGRESS <Stufe> <fertig> <gesamt>' ausgeben")
+    parser.add_argument('--cache', nargs='?', const='', default=None, metavar='DIR',
+                        help="Tracks, MSD-Kurven und Fits zwischenspeichern (Standard-Ordner: ~/.cache/single-cluster-tracking)")
+    parser.add_argument('--chunk-size', type=int, default=None, metavar='ROWS',
+                        help="MosaicResults blockweise mit kompakten Datentypen einlesen (für sehr große Dateien)")
+    parser.add_argument('--profile', action='store_true',
+                        help="cProfile-Profil des ganzen Laufs als CalculateDWithFlexibleAlphaGUI.prof speichern")
+    parser.add_argument('--bootstrap', type=int, default=0, metavar='N',
+                        help="95%%-Konfidenzintervalle für D und Alpha aus N Bootstrap-Stichproben der MSD-Punkte")
+    parser.add_argument('--seed', type=int, default=None, help="Startwert des Zufallsgenerators für --bootstrap")
+    parser.add_argument('--bootstrap-workers', type=int, default=1, help="Anzahl paralleler Prozesse für --bootstrap")
+    parser.add_argument('--window', type=int, default=0, metavar='ROWS',
+                        help="Lokales D und Alpha in gleitenden Fenstern dieser Länge (Punkte pro Track)")
+    parser.add_argument('--window-step', type=int, default=None, metavar='ROWS',
+                        help="Verschiebung der Fenster (Standard: ein Viertel der Fensterlänge)")
+    parser.add_argument('--window-overlay', action='store_true',
+                        help="Fenstermittelpunkte nach lokalem D eingefärbt in die Track-Übersicht zeichnen")
+    parser.add_argument('--results-store', metavar='DIR',
+                        help="Tracks, MSD-Kurven und Fits zusätzlich an diesen Ergebnisspeicher anhängen")
+    parser.add_argument('--condition', help="Bedingung im Ergebnisspeicher (Standard: Alle)")
+    parser.add_argument('--cell', help="Name der Zelle im Ergebnisspeicher (Standard: Pfad der Eingabedatei ohne Endung)")
+    args = parser.parse_args(argv)
+    if args.window and args.window < 2:
+        parser.error("--window muss mindestens 2 sein (0 schaltet die Fenster aus)")
+    if args.window_step is not None and args.window_step < 1:
+        parser.error("--window-step muss mindestens 1 sein")
+    return args
+
+def load_tracks(input_file, chunk_size=None):
+    if os.path.splitext(input_file)[1].lower() in ('.npz', '.parquet', '.feather'):
+        print(f"Loading tracks: {input_file}")
+        return TrackStore.load(input_file)
+    return process_tracking_data(input_file, chunk_size)
+
+def plot_diffusion_results(tracks_data, output_df, msd_data, valid_clusters, output_folder, msd_plots='single',
+                           plot_workers=1, track_color=None, legend_max_tracks=20, progress=None, report=None,
+                           window_overlay=None, mp_context=None):
+    plot_folder = os.path.join(output_folder, 'Log(MSD)vsLog(LagTime)')
+
+    with optional_stage(report, 'plot_tracks'):
+        color_values = track_property(tracks_data, output_df, track_color) if track_color else None
+        plot_tracks(tracks_data, output_folder, 'calculated_output.csv_tracks_plot.png', color_values,
+                    TRACK_COLOR_PROPERTIES.get(track_color), legend_max_tracks=legend_max_tracks,
+                    window_overlay=window_overlay)
+
+    with optional_stage(report, 'msd_plots'):
+        plots_written = render_msd_plots(msd_data, valid_clusters, plot_folder, msd_plots, plot_workers, progress=progress,
+                                         mp_context=mp_context)
+    print(f"{plots_written} MSD-Plots erstellt ({msd_plots})")
+
+    with optional_stage(report, 'alpha_plots'):
+        alpha_plots = plot_and_fit_alphas(output_df, plot_folder)
+
+    if report:
+        report.count('msd_plots_written', plots_written)
+        report.count('summary_plots_written', 1 + alpha_plots)
+
+def run_analysis(input_file, r_squared_threshold, min_duration, frame_interval, output_folder,
+                 legacy_csv=False, save_tracks=None, msd_engine='fft', weighted_fit=False,
+                 msd_plots='single', plot_workers=1, track_color=None, legend_max_tracks=20, progress=None,
+                 cache_dir=None, chunk_size=None, profile=False, bootstrap=0, seed=None, bootstrap_workers=1,
+                 window=0, window_step=None, window_overlay=False, results_store=None, condition=None, cell=None,
+                 mp_context=None):
+    # mp_context is used for the bootstrap and plot process pools, see bootstrap_msd_table
+    output_file_name = "calculated_output.csv"
+    plot_folder = os.path.join(output_folder, 'Log(MSD)vsLog(LagTime)')
+    diffusion_output_file = os.path.join(output_folder, 'diffusion_coefficients.csv')
+    os.makedirs(plot_folder, exist_ok=True)
+
+    parameters = dict(
+        input_file=input_file, r_squared_threshold=r_squared_threshold, min_duration=min_duration,
+        frame_interval=frame_interval, msd_engine=msd_engine, weighted_fit=weighted_fit, msd_plots=msd_plots,
+        cache_dir=cache_dir, chunk_size=chunk_size, bootstrap=bootstrap, seed=seed, window=window,
+        window_step=window_step)
+    report = RunReport('CalculateDWithFlexibleAlphaGUI', output_folder, profile=profile, parameters=parameters)
+    with report.run():
+        # cache_dir=None disables the cache, '' uses the default cache folder
+        if cache_dir is not None:
+            from ResultCache import ResultCache, cached_diffusion_analysis
+            tracks_data, msd_table, fits, output_df, msd_data, valid_clusters = cached_diffusion_analysis(
+                ResultCache(cache_dir), input_file, r_squared_threshold, min_duration, frame_interval,
+                msd_engine, weighted_fit, progress, chunk_size, report, bootstrap, seed, bootstrap_workers, mp_context)
+        else:
+            with report.stage('ingest'):
+                # Progress before and after reading: a cancelled GUI job stops here at the latest
+                if progress:
+                    progress('Einlesen', 0, 1)
+                tracks_data = load_tracks(input_file, chunk_size)
+                if progress:
+                    progress('Einlesen', 1, 1)
+            with report.stage('msd'):
+                msd_table = compute_msd_table(tracks_data, msd_engine, progress)
+            with report.stage('fit'):
+                fits = fit_msd_table(msd_table, frame_interval, weighted_fit)
+            if bootstrap:
+                with report.stage('bootstrap'):
+                    fits.update(bootstrap_msd_table(msd_table, frame_interval, bootstrap, seed, weighted_fit,
+                                                    bootstrap_workers, progress=progress, mp_context=mp_context))
+            with report.stage('select'):
+                output_df, msd_data, valid_clusters = select_diffusion_results(
+                    msd_table, fits, r_squared_threshold, min_duration, frame_interval, report)
+        report.count('tracks_read', len(tracks_data))
+        report.count('detections_read', len(tracks_data.frame))
+
+        if save_tracks:
+            with report.stage('save_tracks'):
+                tracks_data.save(save_tracks)
+        if legacy_csv:
+            with report.stage('legacy_csv'):
+                export_to_csv(tracks_data, output_folder, output_file_name)
+
+        with report.stage('write_results'):
+            output_df.to_csv(diffusion_output_file, index=False)
+        print(f"Diffusion coefficients saved to {diffusion_output_file}")
+
+        with report.stage('ensemble'):
+            write_ensemble_results(msd_table, fits, r_squared_threshold, min_duration, frame_interval, output_folder)
+
+        if results_store:
+            # Cell name defaults to the input file path without extension: output folders are often
+            # all called Graphen, and file names like MosaicResults.csv repeat across cells
+            from ResultsStore import ResultsStore, DEFAULT_CONDITION, write_diffusion_results
+            with report.stage('results_store'):
+                write_diffusion_results(ResultsStore(results_store), msd_table, fits, r_squared_threshold,
+                                        min_duration, frame_interval, condition or DEFAULT_CONDITION,
+                                        cell or os.path.splitext(os.path.abspath(input_file))[0], parameters)
+
+        window_results = None
+        if window:
+            with report.stage('sliding_window'):
+                window_results = sliding_window_diffusion(tracks_data, frame_interval, window,
+                                                          window_step if window_step is not None else max(window // 4, 1),
+                                                          weighted_fit)
+                window_results.to_csv(os.path.join(output_folder, SLIDING_WINDOW_FILE_NAME), index=False)
+            report.count('windows', len(window_results))
+            print(f"{len(window_results)} Fenster gespeichert: {os.path.join(output_folder, SLIDING_WINDOW_FILE_NAME)}")
+
+        plot_diffusion_results(tracks_data, output_df, msd_data, valid_clusters, output_folder, msd_plots, plot_workers,
+                               track_color, legend_max_tracks, progress, report,
+                               window_results if window_overlay else None, mp_context)
+    return output_df
+
+def main():
+    args = parse_arguments()
+    run_analysis(args.input_file, args.r_squared_threshold, args.min_duration, args.frame_interval, args.output_folder,
+                 legacy_csv=args.legacy_csv, save_tracks=args.save_tracks,
+                 msd_engine=args.msd_engine, weighted_fit=args.weighted_fit,
+                 msd_plots=args.msd_plots, plot_workers=args.plot_workers,
+                 track_color=args.track_color, legend_max_tracks=args.legend_max_tracks,
+                 progress=print_progress if args.progress else None, cache_dir=args.cache,
+                 chunk_size=args.chunk_size, profile=args.profile, bootstrap=args.bootstrap, seed=args.seed,
+                 bootstrap_workers=args.bootstrap_workers, window=args.window, window_step=args.window_step,
+                 window_overlay=args.window_overlay, results_store=args.results_store, condition=args.condition,
+                 cell=args.cell)
+
+if __name__ == "__main__":
+    main()
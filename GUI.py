@@ -1,124 +1,370 @@
-import os
-import subprocess
-from PyQt6.QtWidgets import (
-    QApplication,
-    QMainWindow,
-    QWidget,
-    QVBoxLayout,
-    QLabel,
-    QLineEdit,
-    QPushButton,
-    QFileDialog,
-    QMessageBox,
-    QCheckBox,
-    QFormLayout,
-    QHBoxLayout,
-)
-
-class MainWindow(QMainWindow):
-    def __init__(self):
-        super().__init__()
-
-        self.setWindowTitle("Fluoreszenzmikroskopie Analyse")
-        self.setGeometry(100, 100, 800, 900)
-
-        self.central_widget = QWidget()
-        self.setCentralWidget(self.central_widget)
-
-        layout = QVBoxLayout()
-
-        # Diffusionsanalyse Einstellungen
-        diffusion_group_box = QFormLayout()
-
-        self.diffusion_checkbox = QCheckBox("Diffusionsanalyse durchführen")
-        diffusion_group_box.addRow(self.diffusion_checkbox)
-
-        self.input_calculate_label = QLabel("MosaicResults auswählen:")
-        self.input_calculate_input = QLineEdit()
-        self.input_calculate_button = QPushButton("Datei auswählen")
-        self.input_calculate_button.clicked.connect(self.select_calculate_input_file)
-
-        diffusion_group_box.addRow(self.input_calculate_label, self.input_calculate_input)
-        diffusion_group_box.addWidget(self.input_calculate_button)
-
-        self.r_squared_label = QLabel("R² Schwellenwert:")
-        self.r_squared_input = QLineEdit("0.9")
-        diffusion_group_box.addRow(self.r_squared_label, self.r_squared_input)
-
-        self.min_duration_label = QLabel("Minimale Zeit, die ein Cluster existieren muss (Sekunden):")
-        self.min_duration_input = QLineEdit("30")
-        diffusion_group_box.addRow(self.min_duration_label, self.min_duration_input)
-
-        self.frame_interval_label = QLabel("Frame-Intervall (Sekunden):")
-        self.frame_interval_input = QLineEdit("10")
-        diffusion_group_box.addRow(self.frame_interval_label, self.frame_interval_input)
-
-        # Plots erstellen Checkbox
-        self.plot_checkbox = QCheckBox("Plots erstellen")
-        diffusion_group_box.addRow(self.plot_checkbox)
-
-        layout.addLayout(diffusion_group_box)
-
-        # Start Button
-        self.start_button = QPushButton("Analyse starten")
-        self.start_button.clicked.connect(self.run_analysis)
-        layout.addWidget(self.start_button)
-
-        self.central_widget.setLayout(layout)
-
-    def select_calculate_input_file(self):
-        file_path, _ = QFileDialog.getOpenFileName(self, "MosaicResults auswählen:")
-        if file_path:
-            self.input_calculate_input.setText(file_path)
-
-    def run_analysis(self):
-        calculate_input_file = self.input_calculate_input.text()
-        r_squared_threshold = self.r_squared_input.text()
-        min_duration = self.min_duration_input.text()
-        frame_interval = self.frame_interval_input.text()
-
-        script_dir = os.path.dirname(os.path.realpath(__file__))
-
-        # Prüfe, ob Diffusionsanalyse durchgeführt werden soll
-        if self.diffusion_checkbox.isChecked():
-            if not os.path.isfile(calculate_input_file):
-                QMessageBox.warning(self, "Fehler", "Bitte wählen Sie eine gültige Eingabedatei für die Diffusionsanalyse aus.")
-                return
-            try:
-                output_folder = os.path.join(os.path.dirname(calculate_input_file), "Graphen")
-                os.makedirs(output_folder, exist_ok=True)
-
-                # Skript CalculateDWithFlexibleAlphaGUI.py ausführen
-                result_calculate = subprocess.run(
-                    ["python", os.path.join(script_dir, "CalculateDWithFlexibleAlphaGUI.py"),
-                     calculate_input_file, r_squared_threshold, min_duration, frame_interval, output_folder],
-                    check=True, capture_output=True, text=True
-                )
-                print("CalculateDWithFlexibleAlpha Output:", result_calculate.stdout)
-            except subprocess.CalledProcessError as e:
-                QMessageBox.critical(self, "Fehler", f"Ein Fehler ist aufgetreten: {e.stderr}")
-                print("Fehler:", e.stderr)
-                return
-
-        # Optional: Plots erstellen
-        if self.plot_checkbox.isChecked():
-            try:
-                result_lowhigh = subprocess.run(
-                    ["python", os.path.join(script_dir, "LowvsHighGUI.py"),
-                     output_folder, output_folder],
-                    check=True, capture_output=True, text=True
-                )
-                print("LowvsHigh Output:", result_lowhigh.stdout)
-            except subprocess.CalledProcessError as e:
-                QMessageBox.critical(self, "Fehler", f"Ein Fehler ist aufgetreten: {e.stderr}")
-                print("Fehler:", e.stderr)
-                return
-
-        QMessageBox.information(self, "Erfolg", "Die Analyse wurde erfolgreich abgeschlossen.")
-
-
-if __name__ == "__main__":
-    app = QApplication([])
-    window = MainWindow()
-    window.show()
-    app.exec()
+import os
+import io
+import traceback
+import multiprocessing
+from collections import deque
+from contextlib import redirect_stdout
+from PyQt6.QtCore import QThread, pyqtSignal
+from PyQt6.QtWidgets import (
+    QApplication,
+    QMainWindow,
+    QWidget,
+    QVBoxLayout,
+    QLabel,
+    QLineEdit,
+    QPushButton,
+    QFileDialog,
+    QMessageBox,
+    QCheckBox,
+    QFormLayout,
+    QHBoxLayout,
+    QPlainTextEdit,
+    QProgressBar,
+)
+import Pipeline
+
+class _LineEmitter(io.TextIOBase):
+    # Leitet print-Ausgaben der Pipeline zeilenweise an ein Qt-Signal weiter
+    def __init__(self, emit):
+        super().__init__()
+        self.emit = emit
+        self.buffer = ''
+
+    def write(self, text):
+        self.buffer += text
+        *lines, self.buffer = self.buffer.split('\n')
+        for line in lines:
+            self.emit(line)
+        return len(text)
+
+    def flush(self):
+        if self.buffer:
+            self.emit(self.buffer)
+            self.buffer = ''
+
+class JobWorker(QThread):
+    # Führt die Stufen eines Jobs nacheinander im selben Prozess aus (Pipeline.py)
+    log_line = pyqtSignal(str)
+    progress = pyqtSignal(str, int, int)
+    job_finished = pyqtSignal(str, str, str)  # Name, Status ('ok', 'warning', 'error', 'cancelled'), Meldung
+
+    def __init__(self, name, stages):
+        super().__init__()
+        self.name = name
+        self.stages = stages
+        self.cancelled = False
+
+    def cancel(self):
+        # Wird beim nächsten Fortschrittsschritt bzw. vor der nächsten Stufe wirksam
+        self.cancelled = True
+
+    def report_progress(self, stage, done, total):
+        if self.cancelled:
+            raise Pipeline.JobCancelled()
+        self.progress.emit(stage, done, total)
+
+    def run(self):
+        import matplotlib
+        matplotlib.use('Agg')
+
+        status, message = 'ok', ''
+        stream = _LineEmitter(self.log_line.emit)
+        with redirect_stdout(stream):
+            for label, stage in self.stages:
+                if self.cancelled:
+                    break
+                self.log_line.emit(f"== {label} ==")
+                try:
+                    warning = stage(self.report_progress)
+                except Pipeline.JobCancelled:
+                    break
+                except Exception as e:
+                    self.log_line.emit(traceback.format_exc())
+                    status, message = 'error', f"{label}: {e}"
+                    break
+                if warning:
+                    status, message = 'warning', warning
+            stream.flush()
+
+        if self.cancelled:
+            status, message = 'cancelled', ''
+        self.job_finished.emit(self.name, status, message)
+
+class MainWindow(QMainWindow):
+    def __init__(self):
+        super().__init__()
+
+        self.setWindowTitle("Fluoreszenzmikroskopie Analyse")
+        self.setGeometry(100, 100, 800, 900)
+
+        self.central_widget = QWidget()
+        self.setCentralWidget(self.central_widget)
+
+        layout = QVBoxLayout()
+
+        # Diffusionsanalyse Einstellungen
+        diffusion_group_box = QFormLayout()
+
+        self.diffusion_checkbox = QCheckBox("Diffusionsanalyse durchführen")
+        diffusion_group_box.addRow(self.diffusion_checkbox)
+
+        self.input_calculate_label = QLabel("MosaicResults auswählen:")
+        self.input_calculate_input = QLineEdit()
+        self.input_calculate_button = QPushButton("Datei auswählen")
+        self.input_calculate_button.clicked.connect(self.select_calculate_input_file)
+
+        diffusion_group_box.addRow(self.input_calculate_label, self.input_calculate_input)
+        diffusion_group_box.addWidget(self.input_calculate_button)
+
+        self.r_squared_label = QLabel("R² Schwellenwert:")
+        self.r_squared_input = QLineEdit("0.9")
+        diffusion_group_box.addRow(self.r_squared_label, self.r_squared_input)
+
+        self.min_duration_label = QLabel("Minimale Zeit, die ein Cluster existieren muss (Sekunden):")
+        self.min_duration_input = QLineEdit("30")
+        diffusion_group_box.addRow(self.min_duration_label, self.min_duration_input)
+
+        self.frame_interval_label = QLabel("Frame-Intervall (Sekunden):")
+        self.frame_interval_input = QLineEdit("10")
+        diffusion_group_box.addRow(self.frame_interval_label, self.frame_interval_input)
+
+        # Optional: breite Track-Tabelle (calculated_output.csv) wie bisher schreiben
+        self.legacy_csv_checkbox = QCheckBox("calculated_output.csv (breites Format) exportieren")
+        diffusion_group_box.addRow(self.legacy_csv_checkbox)
+
+        # Ergebnis-Cache: bei geänderten Schwellenwerten werden nur noch die Filter neu angewendet
+        self.cache_checkbox = QCheckBox("Ergebnis-Cache verwenden")
+        self.cache_checkbox.setChecked(False)
+        self.clear_cache_button = QPushButton("Cache leeren")
+        self.clear_cache_button.clicked.connect(self.clear_cache)
+        diffusion_group_box.addRow(self.cache_checkbox, self.clear_cache_button)
+
+        # Plots erstellen Checkbox
+        self.plot_checkbox = QCheckBox("Plots erstellen")
+        diffusion_group_box.addRow(self.plot_checkbox)
+
+        layout.addLayout(diffusion_group_box)
+
+        # Start Button
+        self.start_button = QPushButton("Analyse starten")
+        self.start_button.clicked.connect(self.run_analysis)
+        layout.addWidget(self.start_button)
+
+        # Batch-Analyse über einen Ordner mit MosaicResults
+        batch_group_box = QFormLayout()
+
+        self.batch_folder_label = QLabel("Ordner mit MosaicResults (Batch):")
+        self.batch_folder_input = QLineEdit()
+        self.batch_folder_button = QPushButton("Ordner auswählen")
+        self.batch_folder_button.clicked.connect(self.select_batch_folder)
+        batch_group_box.addRow(self.batch_folder_label, self.batch_folder_input)
+        batch_group_box.addWidget(self.batch_folder_button)
+
+        self.batch_pattern_label = QLabel("Dateimuster:")
+        self.batch_pattern_input = QLineEdit("*.csv")
+        batch_group_box.addRow(self.batch_pattern_label, self.batch_pattern_input)
+
+        self.batch_workers_label = QLabel("Parallele Prozesse:")
+        self.batch_workers_input = QLineEdit(str(os.cpu_count() or 1))
+        batch_group_box.addRow(self.batch_workers_label, self.batch_workers_input)
+
+        layout.addLayout(batch_group_box)
+
+        self.batch_start_button = QPushButton("Batch-Analyse starten")
+        self.batch_start_button.clicked.connect(self.run_batch_analysis)
+        layout.addWidget(self.batch_start_button)
+
+        # Laufende Jobs: Fortschritt, Log und Abbrechen
+        self.job_status_label = QLabel("Keine laufenden Jobs")
+        layout.addWidget(self.job_status_label)
+
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setFormat("%p%")
+        layout.addWidget(self.progress_bar)
+
+        self.log_output = QPlainTextEdit()
+        self.log_output.setReadOnly(True)
+        self.log_output.setMaximumBlockCount(10000)
+        layout.addWidget(self.log_output)
+
+        job_buttons = QHBoxLayout()
+        self.cancel_button = QPushButton("Abbrechen")
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancel_job)
+        job_buttons.addWidget(self.cancel_button)
+        self.clear_queue_button = QPushButton("Warteschlange leeren")
+        self.clear_queue_button.clicked.connect(self.clear_job_queue)
+        job_buttons.addWidget(self.clear_queue_button)
+        layout.addLayout(job_buttons)
+
+        self.central_widget.setLayout(layout)
+
+        self.job_queue = deque()
+        self.current_job = None
+
+    def enqueue_job(self, name, stages):
+        # stages: Liste aus (Bezeichnung, Funktion(progress) -> optionale Warnung)
+        self.job_queue.append((name, stages))
+        self.log_output.appendPlainText(f"Job eingereiht: {name}")
+        self.start_next_job()
+
+    def start_next_job(self):
+        if self.current_job is not None or not self.job_queue:
+            self.update_job_status()
+            return
+        name, stages = self.job_queue.popleft()
+        self.current_job = JobWorker(name, stages)
+        self.current_job.log_line.connect(self.log_output.appendPlainText)
+        self.current_job.progress.connect(self.update_progress)
+        self.current_job.job_finished.connect(self.job_finished)
+        self.progress_bar.setRange(0, 0)
+        self.cancel_button.setEnabled(True)
+        self.current_job.start()
+        self.update_job_status()
+
+    def update_job_status(self):
+        if self.current_job is None:
+            self.job_status_label.setText("Keine laufenden Jobs")
+        else:
+            self.job_status_label.setText(f"Läuft: {self.current_job.name} ({len(self.job_queue)} in der Warteschlange)")
+
+    def update_progress(self, stage, done, total):
+        self.progress_bar.setRange(0, max(total, 1))
+        self.progress_bar.setValue(done)
+        self.progress_bar.setFormat(f"{stage}: %v/%m (%p%)")
+
+    def cancel_job(self):
+        if self.current_job is not None:
+            self.log_output.appendPlainText(f"Breche ab: {self.current_job.name}")
+            self.current_job.cancel()
+
+    def clear_job_queue(self):
+        self.job_queue.clear()
+        self.update_job_status()
+
+    def job_finished(self, name, status, message):
+        self.current_job.wait()
+        self.current_job = None
+        self.cancel_button.setEnabled(False)
+        self.progress_bar.setRange(0, 1)
+        self.progress_bar.setValue(1 if status in ('ok', 'warning') else 0)
+        self.progress_bar.setFormat("%p%")
+
+        if status == 'ok':
+            self.log_output.appendPlainText(f"Fertig: {name}")
+            if not self.job_queue:
+                QMessageBox.information(self, "Erfolg", f"{name} wurde erfolgreich abgeschlossen.")
+        elif status == 'warning':
+            self.log_output.appendPlainText(f"Fertig mit Warnungen: {name}")
+            QMessageBox.warning(self, name, f"Einige Dateien konnten nicht analysiert werden:\n{message}")
+        elif status == 'cancelled':
+            self.log_output.appendPlainText(f"Abgebrochen: {name}")
+        else:
+            self.log_output.appendPlainText(f"Fehler: {name}")
+            QMessageBox.critical(self, "Fehler", f"Ein Fehler ist aufgetreten: {message}")
+        self.start_next_job()
+
+    def closeEvent(self, event):
+        self.job_queue.clear()
+        if self.current_job is not None:
+            self.current_job.cancel()
+            self.current_job.wait()
+        super().closeEvent(event)
+
+    def select_calculate_input_file(self):
+        file_path, _ = QFileDialog.getOpenFileName(self, "MosaicResults auswählen:")
+        if file_path:
+            self.input_calculate_input.setText(file_path)
+
+    def select_batch_folder(self):
+        folder = QFileDialog.getExistingDirectory(self, "Ordner mit MosaicResults auswählen:")
+        if folder:
+            self.batch_folder_input.setText(folder)
+
+    def read_diffusion_parameters(self):
+        try:
+            return (float(self.r_squared_input.text()), int(self.min_duration_input.text()),
+                    int(self.frame_interval_input.text()))
+        except ValueError:
+            QMessageBox.warning(self, "Fehler", "Bitte geben Sie gültige Zahlen für R², minimale Zeit und Frame-Intervall ein.")
+            return None
+
+    def cache_dir(self):
+        # '' = Standard-Cache-Ordner, None = ohne Cache
+        return '' if self.cache_checkbox.isChecked() else None
+
+    def clear_cache(self):
+        removed = Pipeline.clear_cache()
+        self.log_output.appendPlainText(f"{removed} Cache-Einträge gelöscht")
+
+    def run_batch_analysis(self):
+        batch_folder = self.batch_folder_input.text()
+        if not os.path.isdir(batch_folder):
+            QMessageBox.warning(self, "Fehler", "Bitte wählen Sie einen gültigen Ordner für die Batch-Analyse aus.")
+            return
+        parameters = self.read_diffusion_parameters()
+        if parameters is None:
+            return
+        try:
+            workers = int(self.batch_workers_input.text())
+        except ValueError:
+            QMessageBox.warning(self, "Fehler", "Bitte geben Sie eine gültige Anzahl paralleler Prozesse ein.")
+            return
+
+        import BatchAnalysis
+        input_files = BatchAnalysis.find_input_files([batch_folder], self.batch_pattern_input.text())
+        legacy_csv = self.legacy_csv_checkbox.isChecked()
+        cache_dir = self.cache_dir()
+
+        def batch_stage(progress):
+            # Kein fork aus dem laufenden Qt-Prozess (mehrere Threads): Worker-Prozesse neu starten
+            summary = Pipeline.run_batch(input_files, *parameters, workers=workers, progress=progress,
+                                         mp_context=multiprocessing.get_context('spawn'),
+                                         legacy_csv=legacy_csv, cache_dir=cache_dir)
+            # Fehler einzelner Dateien stehen in der Zusammenfassung und brechen den Batch nicht ab
+            failed = summary[summary['Status'] != 'ok']
+            if len(failed):
+                return "\n".join(f"{row.File}: {row.Error}" for row in failed.itertuples())
+
+        self.enqueue_job(f"Batch-Analyse {batch_folder}", [("BatchAnalysis", batch_stage)])
+
+    def run_analysis(self):
+        calculate_input_file = self.input_calculate_input.text()
+        output_folder = os.path.join(os.path.dirname(calculate_input_file), "Graphen")
+        stages = []
+
+        # Prüfe, ob Diffusionsanalyse durchgeführt werden soll
+        if self.diffusion_checkbox.isChecked():
+            if not os.path.isfile(calculate_input_file):
+                QMessageBox.warning(self, "Fehler", "Bitte wählen Sie eine gültige Eingabedatei für die Diffusionsanalyse aus.")
+                return
+            parameters = self.read_diffusion_parameters()
+            if parameters is None:
+                return
+            os.makedirs(output_folder, exist_ok=True)
+            legacy_csv = self.legacy_csv_checkbox.isChecked()
+            cache_dir = self.cache_dir()
+
+            def diffusion_stage(progress):
+                # Wie im Batch: Prozess-Pools (Bootstrap, Plots) nicht per fork aus dem Qt-Prozess starten
+                Pipeline.run_diffusion_analysis(calculate_input_file, *parameters, output_folder,
+                                                legacy_csv=legacy_csv, progress=progress, cache_dir=cache_dir,
+                                                mp_context=multiprocessing.get_context('spawn'))
+
+            stages.append(("CalculateDWithFlexibleAlpha", diffusion_stage))
+
+        # Optional: Plots erstellen
+        if self.plot_checkbox.isChecked():
+            def aggregate_stage(progress):
+                Pipeline.run_aggregate(output_folder, output_folder, progress=progress)
+
+            stages.append(("LowvsHigh", aggregate_stage))
+
+        if stages:
+            self.enqueue_job(f"Analyse {os.path.basename(calculate_input_file)}", stages)
+
+if __name__ == "__main__":
+    app = QApplication([])
+    window = MainWindow()
+    window.show()
+    app.exec()
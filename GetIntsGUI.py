@@ -1,38 +1,124 @@
-import tifffile
-import numpy as np
-import pandas as pd
-import os
-import sys
-
-def extract_intensities(tif_file, output_folder):
-    with tifffile.TiffFile(tif_file) as tif:
-        image = tif.asarray()
-        
-    frame_0 = image[0]
-
-    height, width = frame_0.shape
-    data = []
-
-    for y in range(height):
-        for x in range(width):
-            intensity = frame_0[y, x]
-            data.append({'x': x, 'y': y, 'Intensity': intensity})
-
-    df = pd.DataFrame(data)
-
-    os.makedirs(output_folder, exist_ok=True)
-
-    output_csv_path = os.path.join(output_folder, 'Int.csv')
-    df.to_csv(output_csv_path, index=False)
-
-    print("CSV-Datei wurde erfolgreich erstellt:", output_csv_path)
-
-if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python GetInts.py <tif_file> <output_folder>")
-        sys.exit(1)
-
-    tif_file = sys.argv[1]
-    output_folder = sys.argv[2]
-
-    extract_intensities(tif_file, output_folder)
+import tifffile
+import numpy as np
+import pandas as pd
+import os
+import sys
+import json
+import argparse
+from RunReport import RunReport
+
+NPY_FILENAME = 'Int.npy'
+METADATA_FILENAME = 'Int.json'
+CSV_FILENAME = 'Int.csv'
+
+def parse_frames(frames, n_frames):
+    # "all", "0", "0,3,7" oder Bereiche wie "10-19" (inklusive)
+    if frames is None:
+        return [0]
+    if isinstance(frames, str):
+        if frames.strip().lower() == 'all':
+            return list(range(n_frames))
+        selected = []
+        for part in frames.split(','):
+            if '-' in part:
+                first, last = part.split('-')
+                selected.extend(range(int(first), int(last) + 1))
+            else:
+                selected.append(int(part))
+        frames = selected
+    frames = [int(frame) for frame in frames]
+    for frame in frames:
+        if not 0 <= frame < n_frames:
+            raise ValueError(f"Frame {frame} existiert nicht (TIF-Datei hat {n_frames} Frames)")
+    return frames
+
+def intensity_table(image, frame=None):
+    # Eine Zeile pro Pixel, gleiche Reihenfolge wie zuvor (zeilenweise, x läuft schneller)
+    height, width = image.shape
+    table = pd.DataFrame({
+        'x': np.tile(np.arange(width), height),
+        'y': np.repeat(np.arange(height), width),
+        'Intensity': image.ravel(),
+    })
+    if frame is not None:
+        table.insert(0, 'Frame', frame)
+    return table
+
+def extract_intensities(tif_file, output_folder, frames=None, write_npy=True, write_csv=False, profile=False):
+    os.makedirs(output_folder, exist_ok=True)
+    output_npy_path = os.path.join(output_folder, NPY_FILENAME)
+    output_csv_path = os.path.join(output_folder, CSV_FILENAME)
+
+    report = RunReport('GetIntsGUI', output_folder, profile=profile, parameters=dict(
+        tif_file=tif_file, frames=frames, write_npy=write_npy, write_csv=write_csv))
+    with report.run():
+        # Seitenweise lesen, damit nie der ganze Stapel im Speicher liegt
+        with report.stage('extract'), tifffile.TiffFile(tif_file) as tif:
+            pages = tif.pages
+            frames = parse_frames(frames, len(pages))
+            first_page = pages[frames[0]]
+            shape = (len(frames),) + tuple(first_page.shape)
+
+            if write_npy:
+                stack = np.lib.format.open_memmap(output_npy_path, mode='w+', dtype=first_page.dtype, shape=shape)
+            else:
+                # Ein altes Int.npy würde von PlotIntsGUI der neuen Int.csv vorgezogen
+                for stale_path in (output_npy_path, os.path.join(output_folder, METADATA_FILENAME)):
+                    if os.path.exists(stale_path):
+                        os.remove(stale_path)
+            if write_csv and os.path.exists(output_csv_path):
+                os.remove(output_csv_path)
+
+            for i, frame in enumerate(frames):
+                image = pages[frame].asarray()
+                if write_npy:
+                    stack[i] = image
+                if write_csv:
+                    table = intensity_table(image, frame if len(frames) > 1 else None)
+                    table.to_csv(output_csv_path, mode='a', header=(i == 0), index=False)
+        report.count('frames_extracted', len(frames))
+        report.count('pixels_per_frame', int(np.prod(shape[1:])))
+
+        if write_npy:
+            stack.flush()
+            del stack
+            metadata = {
+                'source': os.path.abspath(tif_file),
+                'frames': frames,
+                'shape': list(shape),
+                'dtype': str(first_page.dtype),
+            }
+            with open(os.path.join(output_folder, METADATA_FILENAME), 'w') as f:
+                json.dump(metadata, f, indent=2)
+            print("NPY-Datei wurde erfolgreich erstellt:", output_npy_path)
+
+        if write_csv:
+            print("CSV-Datei wurde erfolgreich erstellt:", output_csv_path)
+
+def load_intensity_stack(output_folder):
+    # Memory-mapped (Frames, Höhe, Breite) plus die Metadaten aus Int.json
+    stack = np.load(os.path.join(output_folder, NPY_FILENAME), mmap_mode='r')
+    metadata_path = os.path.join(output_folder, METADATA_FILENAME)
+    metadata = {}
+    if os.path.exists(metadata_path):
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+    return stack, metadata
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extrahiert Pixelintensitäten aus einer TIF-Datei.",
+                                     usage="python GetIntsGUI.py <tif_file> <output_folder> [--frames all|0,2,5-9] [--csv] [--no-npy]")
+    parser.add_argument('tif_file')
+    parser.add_argument('output_folder')
+    parser.add_argument('--frames', default='0', help="Frames, die extrahiert werden (Standard: 0)")
+    parser.add_argument('--csv', action='store_true', help="Zusätzlich Int.csv schreiben")
+    parser.add_argument('--no-npy', action='store_true', help="Kein Int.npy schreiben")
+    parser.add_argument('--profile', action='store_true', help="cProfile-Profil als GetIntsGUI.prof speichern")
+    args = parser.parse_args()
+
+    if args.no_npy and not args.csv:
+        print("Mindestens ein Ausgabeformat (Int.npy oder --csv) muss gewählt werden.")
+        sys.exit(1)
+
+    extract_intensities(args.tif_file, args.output_folder, args.frames, write_npy=not args.no_npy, write_csv=args.csv,
+                        profile=args.profile)
@@ -1,132 +1,391 @@
-import os
-import sys
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-
-def main():
-    if len(sys.argv) != 9:
-        print("Usage: python LowvsHighGUI.py <input_folder> <output_folder> <diffusion_bins> <diffusion_range_min> <diffusion_range_max> <size_bins> <size_range_min> <size_range_max>")
-        return
-
-    input_folder = sys.argv[1]
-    output_folder = sys.argv[2]
-    diffusion_bins = int(sys.argv[3])
-    diffusion_range_min = float(sys.argv[4])
-    diffusion_range_max = float(sys.argv[5])
-    size_bins = int(sys.argv[6])
-    size_range_min = float(sys.argv[7])
-    size_range_max = float(sys.argv[8])
-
-    file_paths = [os.path.join(input_folder, f) for f in os.listdir(input_folder) if f.endswith("diffusion_coefficients.csv")]
-
-    data_frames = [pd.read_csv(file) for file in file_paths]
-
-    average_cluster_sizes = []
-    diffusion_coefficients = []
-    alpha_values = []
-    labels = []
-    cell_counts = {'TAF2 High Expression': 0, 'TAF2 Low Expression ohne Warten': 0, 'TAF5 Low Expression ohne Warten': 0}
-    cluster_counts = {'TAF2 High Expression': 0, 'TAF2 Low Expression ohne Warten': 0, 'TAF5 Low Expression ohne Warten': 0}
-
-    for i, data in enumerate(data_frames):
-        avg_cluster_size = data.iloc[:, 1].values
-        diff_coeff = data['Diffusion Coefficient'].values
-        alpha_val = data['Alpha'].values
-        average_cluster_sizes.extend(avg_cluster_size)
-        diffusion_coefficients.extend(diff_coeff)
-        alpha_values.extend(alpha_val)
-        
-        # Assign conditions and count cells and clusters
-        if i <= 4:
-            condition = 'TAF2 High Expression'
-        elif 5 <= i <= 10:
-            condition = 'TAF2 Low Expression ohne Warten'
-        else:
-            condition = 'TAF5 Low Expression ohne Warten'
-        
-        labels.extend([condition] * len(avg_cluster_size))
-        cell_counts[condition] += 1
-        cluster_counts[condition] += len(avg_cluster_size)
-
-    # Convert to DataFrame for analysis
-    df = pd.DataFrame({
-        'Average Cluster Size': average_cluster_sizes,
-        'Diffusion Coefficient': diffusion_coefficients,
-        'Alpha': alpha_values,
-        'Condition': labels
-    })
-
-    # Check for NaN values and handle them
-    print("Checking for NaN values...")
-    print(df.isna().sum())
-
-    # Drop NaN values
-    df.dropna(inplace=True)
-
-    # Define the palette
-    palette = {
-        'TAF2 High Expression': 'green',
-        'TAF2 Low Expression ohne Warten': 'red',
-        'TAF5 Low Expression ohne Warten': 'purple'
-    }
-
-    # Plot histograms of Diffusion Coefficient for each condition
-    plt.figure(figsize=(14, 8))
-
-    conditions = df['Condition'].unique()
-    for i, condition in enumerate(conditions, 1):
-        plt.subplot(2, 2, i)
-        sns.histplot(df[df['Condition'] == condition]['Diffusion Coefficient'], kde=True, color=palette[condition], bins=diffusion_bins)
-        plt.title(f'Diffusion Coefficient Distribution\n{condition}', fontsize=16)
-        plt.xlabel('Diffusion Coefficient / \u03bcm²/s', fontsize=14)
-        plt.ylabel('Frequency', fontsize=14)
-        plt.xlim(diffusion_range_min, diffusion_range_max)
-        plt.xticks(fontsize=12)
-        plt.yticks(fontsize=12)
-        plt.annotate(f'Cells: {cell_counts[condition]}\nClusters: {cluster_counts[condition]}', 
-                    xy=(0.7, 0.85), xycoords='axes fraction', fontsize=12, bbox=dict(boxstyle="round", fc="w"))
-
-    plt.tight_layout()
-    plt.savefig(os.path.join(output_folder, "DiffusionCoefficient_Histograms.png"))
-    plt.show()
-
-    # Plot histograms of Average Cluster Size for each condition
-    plt.figure(figsize=(14, 8))
-
-    for i, condition in enumerate(conditions, 1):
-        plt.subplot(2, 2, i)
-        sns.histplot(df[df['Condition'] == condition]['Average Cluster Size'], kde=True, color=palette[condition], bins=size_bins)
-        plt.title(f'Average Cluster Size Distribution\n{condition}', fontsize=16)
-        plt.xlabel('Average Cluster Size / \u03bcm²', fontsize=14)
-        plt.ylabel('Frequency', fontsize=14)
-        plt.xlim(size_range_min, size_range_max)
-        plt.xticks(fontsize=12)
-        plt.yticks(fontsize=12)
-        plt.annotate(f'Cells: {cell_counts[condition]}\nClusters: {cluster_counts[condition]}', 
-                    xy=(0.7, 0.85), xycoords='axes fraction', fontsize=12, bbox=dict(boxstyle="round", fc="w"))
-
-    plt.tight_layout()
-    plt.savefig(os.path.join(output_folder, "ClusterSize_Histograms.png"))
-    plt.show()
-
-    # Scatter plot for Diffusion Coefficients vs. Average Cluster Size
-    plt.figure(figsize=(12, 8))
-    sns.scatterplot(data=df, x='Average Cluster Size', y='Diffusion Coefficient', hue='Condition', palette=palette, s=100)
-    plt.title('Diffusion Coefficients vs. Average Cluster Size', fontsize=20)
-    plt.xlabel('Average Cluster Size / \u03bcm²', fontsize=20)
-    plt.ylabel('Diffusion Coefficient / \u03bcm²/s', fontsize=20)
-    plt.xlim(size_range_min, size_range_max)
-    plt.ylim(diffusion_range_min, diffusion_range_max)
-    handles, _ = plt.gca().get_legend_handles_labels()
-    plt.legend(handles=handles, labels=[f'{condition} (N = {cell_counts[condition]} Cells, {cluster_counts[condition]} Clusters)' for condition in conditions], title='Condition', fontsize=12, title_fontsize=14)
-    plt.grid(True)
-    plt.xticks(fontsize=12)
-    plt.yticks(fontsize=12)
-    plt.tight_layout()
-    plt.savefig(os.path.join(output_folder, "Scatterplot_Diffusion_vs_ClusterSize.png"))
-    plt.show()
-
-if __name__ == "__main__":
-    main()
+import os
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from RunReport import RunReport, optional_stage
+from CalculateDWithFlexibleAlphaGUI import (ENSEMBLE_MSD_FILE_NAME, ENSEMBLE_FIT_COLUMNS, ensemble_msd,
+                                            pool_ensemble_msd, fit_ensemble_msd)
+from ResultsStore import ResultsStore
+
+# Define the palette
+palette = {
+    'TAF2 High Expression': 'green',
+    'TAF2 Low Expression ohne Warten': 'red',
+    'TAF5 Low Expression ohne Warten': 'purple'
+}
+
+# Zuordnung Datei -> Bedingung: CSV mit den Spalten File und Condition. Relative Pfade
+# beziehen sich auf den Ordner des Manifests. Liegt conditions.csv im Eingabeordner,
+# wird es automatisch verwendet.
+MANIFEST_FILE_NAME = 'conditions.csv'
+RESULT_SUFFIX = 'diffusion_coefficients.csv'
+RESULT_COLUMNS = ['Average Cluster Size', 'Diffusion Coefficient', 'Alpha']
+SUMMARY_FILE_NAME = 'condition_summary.csv'
+ENSEMBLE_SUMMARY_FILE_NAME = 'condition_ensemble_fit.csv'
+
+def legacy_condition(i):
+    # Bisherige Zuordnung nach Dateiindex
+    if i <= 4:
+        return 'TAF2 High Expression'
+    elif 5 <= i <= 10:
+        return 'TAF2 Low Expression ohne Warten'
+    return 'TAF5 Low Expression ohne Warten'
+
+def find_result_files(input_folder):
+    # Alphabetisch, damit die Zuordnung nicht von der Reihenfolge von os.listdir abhängt
+    return sorted(os.path.join(input_folder, f) for f in os.listdir(input_folder) if f.endswith(RESULT_SUFFIX))
+
+def default_manifest(input_folder):
+    files = find_result_files(input_folder)
+    return pd.DataFrame({'File': files, 'Condition': [legacy_condition(i) for i in range(len(files))]})
+
+def read_manifest(manifest_path):
+    manifest = pd.read_csv(manifest_path, dtype=str)
+    missing = {'File', 'Condition'} - set(manifest.columns)
+    if missing:
+        raise ValueError(f"Manifest {manifest_path} braucht die Spalten File und Condition (fehlt: {', '.join(sorted(missing))})")
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    manifest['File'] = [path if os.path.isabs(path) else os.path.join(base, path) for path in manifest['File']]
+    return manifest[['File', 'Condition']]
+
+def write_manifest(input_folder, manifest_path=None):
+    # Vorlage mit der bisherigen Zuordnung, die anschließend von Hand angepasst wird
+    manifest_path = manifest_path or os.path.join(input_folder, MANIFEST_FILE_NAME)
+    manifest = default_manifest(input_folder)
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    manifest['File'] = [os.path.relpath(os.path.abspath(path), base) for path in manifest['File']]
+    manifest.to_csv(manifest_path, index=False)
+    print(f"Manifest mit {len(manifest)} Dateien gespeichert: {manifest_path}")
+    return manifest_path
+
+def read_result_file(path):
+    return pd.read_csv(path, usecols=RESULT_COLUMNS, dtype={column: np.float64 for column in RESULT_COLUMNS})
+
+def resolve_manifest(input_folder, manifest=None):
+    # None: conditions.csv im Eingabeordner oder die bisherige Zuordnung; Pfad oder DataFrame
+    if manifest is None:
+        manifest_path = os.path.join(input_folder, MANIFEST_FILE_NAME)
+        if os.path.exists(manifest_path):
+            return read_manifest(manifest_path)
+        print(f"Kein {MANIFEST_FILE_NAME} gefunden, Bedingungen werden nach Dateireihenfolge zugeordnet.")
+        return default_manifest(input_folder)
+    if isinstance(manifest, str):
+        return read_manifest(manifest)
+    return manifest
+
+def load_results(input_folder, manifest=None, workers=None):
+    manifest = resolve_manifest(input_folder, manifest)
+
+    # Dateien parallel einlesen, Reihenfolge wie im Manifest
+    with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) + 4)) as executor:
+        tables = list(executor.map(read_result_file, manifest['File']))
+
+    cells = [os.path.basename(path)[:-len(RESULT_SUFFIX)].rstrip('_') or os.path.basename(path) for path in manifest['File']]
+    return combine_results(tables, list(manifest['Condition']), cells)
+
+def combine_results(tables, conditions_per_table, cells):
+    # Eine Tabelle pro Zelle -> gemeinsamer DataFrame mit Condition und Cell
+    conditions = list(dict.fromkeys(conditions_per_table))
+    lengths = [len(table) for table in tables]
+    df = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(columns=RESULT_COLUMNS, dtype=np.float64)
+    df['Condition'] = pd.Categorical(np.repeat(np.asarray(conditions_per_table, dtype=object), lengths),
+                                     categories=conditions)
+    df['Cell'] = np.repeat(np.asarray(cells, dtype=object), lengths)
+
+    # Count cells and clusters per condition
+    cell_counts = {condition: 0 for condition in conditions}
+    cluster_counts = {condition: 0 for condition in conditions}
+    for condition, length in zip(conditions_per_table, lengths):
+        cell_counts[condition] += 1
+        cluster_counts[condition] += length
+
+    # Check for NaN values and handle them
+    print("Checking for NaN values...")
+    print(df.isna().sum())
+
+    # Drop NaN values
+    df.dropna(inplace=True)
+
+    return df, cell_counts, cluster_counts
+
+def ensemble_file(result_path):
+    # Ensemble-MSD derselben Zelle: <Präfix>ensemble_msd.csv neben <Präfix>diffusion_coefficients.csv
+    return result_path[:-len(RESULT_SUFFIX)] + ENSEMBLE_MSD_FILE_NAME
+
+def read_ensemble_file(result_path):
+    path = ensemble_file(result_path)
+    return pd.read_csv(path) if os.path.exists(path) else None
+
+def condition_ensembles(manifest, workers=None):
+    with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) + 4)) as executor:
+        tables = list(executor.map(read_ensemble_file, manifest['File']))
+    return pool_condition_ensembles(tables, list(manifest['Condition']))
+
+def pool_condition_ensembles(tables, conditions_per_table):
+    # Ensemble-MSD pro Bedingung aus den Ensembles der Zellen (so, als wären alle Tracks
+    # gemeinsam gemittelt worden) und der Populations-Fit darauf. None = keine Ensemble-Datei.
+    ensembles, fits = {}, []
+    for condition in dict.fromkeys(conditions_per_table):
+        cells = [table for table, c in zip(tables, conditions_per_table) if c == condition and table is not None]
+        if not cells:
+            print(f"Keine {ENSEMBLE_MSD_FILE_NAME} für {condition} gefunden (Analyse mit aktueller Version wiederholen).")
+            continue
+        ensembles[condition] = pool_ensemble_msd(cells)
+        fits.append({'Condition': condition, 'Cells': len(cells), **fit_ensemble_msd(ensembles[condition])})
+    return ensembles, pd.DataFrame(fits, columns=['Condition', 'Cells'] + ENSEMBLE_FIT_COLUMNS)
+
+def load_store_results(store_path, conditions=None):
+    # Ergebnisspeicher statt einzelner CSV-Dateien: nur die Chunks der gewählten Bedingungen
+    # werden gelesen, Zellen und Bedingungen in der Reihenfolge, in der sie angehängt wurden
+    # Eine Zelle ist ein Paar (Bedingung, Zelle): gleiche Zellnamen in verschiedenen Bedingungen bleiben getrennt
+    store = ResultsStore(store_path)
+    index = store.index(conditions)
+    keys = list(dict.fromkeys(zip(index['Condition'], index['Cell'])))
+    if conditions is not None:
+        keys.sort(key=lambda key: list(conditions).index(key[0]))
+
+    tracks = store.read_tracks(conditions)
+    by_key = dict(list(tracks.groupby(['Condition', 'Cell'], sort=False)))
+    tables = [by_key[key][RESULT_COLUMNS].astype(np.float64) if key in by_key
+              else pd.DataFrame(columns=RESULT_COLUMNS, dtype=np.float64) for key in keys]
+    results = combine_results(tables, [condition for condition, _ in keys], [cell for _, cell in keys])
+
+    # Ensemble-MSD pro Zelle aus den gespeicherten MSD-Kurven, Chunk für Chunk
+    cell_ensembles = {}
+    for condition, cell, frame_interval, _, n_lags, curves in store.read_msd(conditions):
+        cell_ensembles.setdefault((condition, cell), []).append(ensemble_msd(curves, n_lags, frame_interval))
+    ensembles = pool_condition_ensembles([pool_ensemble_msd(cell_ensembles[key]) for key in keys],
+                                         [condition for condition, _ in keys])
+    return results, ensembles
+
+def condition_colors(conditions):
+    return {condition: palette.get(condition, f'C{i % 10}') for i, condition in enumerate(conditions)}
+
+def histogram_with_kde(values, bins='auto', kde_points=200):
+    # Häufigkeiten und KDE (auf Häufigkeiten skaliert, wie bei seaborn histplot(kde=True))
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    counts, edges = np.histogram(values, bins=bins)
+    kde_x, kde_y = None, None
+    if len(values) > 1 and np.ptp(values) > 0:
+        from scipy.stats import gaussian_kde
+        kde_x = np.linspace(edges[0], edges[-1], kde_points)
+        kde_y = gaussian_kde(values)(kde_x) * len(values) * (edges[-1] - edges[0]) / len(counts)
+    return {'counts': counts, 'edges': edges, 'kde_x': kde_x, 'kde_y': kde_y}
+
+def condition_distributions(df, conditions, column, bins='auto'):
+    values = {condition: group.to_numpy() for condition, group in df.groupby('Condition', observed=False)[column]}
+    return {condition: histogram_with_kde(values.get(condition, []), bins) for condition in conditions}
+
+def condition_summary(df, cell_counts, cluster_counts):
+    groups = df.groupby('Condition', observed=False)
+    summary = pd.DataFrame({
+        'Condition': list(cell_counts),
+        'Cells': list(cell_counts.values()),
+        'Clusters': list(cluster_counts.values()),
+    })
+    for column, name in (('Diffusion Coefficient', 'D'), ('Alpha', 'Alpha'), ('Average Cluster Size', 'Size')):
+        summary[f'{name} Median'] = groups[column].median().reindex(summary['Condition']).to_numpy()
+        summary[f'{name} Mean'] = groups[column].mean().reindex(summary['Condition']).to_numpy()
+    return summary
+
+def _histogram_figure(distributions, colors, cell_counts, cluster_counts, title, xlabel, value_range, path):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    conditions = list(distributions)
+    columns = 2
+    rows = max(1, -(-len(conditions) // columns))
+    figure = Figure(figsize=(14, 4 * rows))
+    FigureCanvasAgg(figure)
+    for i, condition in enumerate(conditions, 1):
+        ax = figure.add_subplot(rows, columns, i)
+        histogram = distributions[condition]
+        ax.stairs(histogram['counts'], histogram['edges'], fill=True, color=colors[condition], alpha=0.5)
+        ax.stairs(histogram['counts'], histogram['edges'], color=colors[condition])
+        if histogram['kde_x'] is not None:
+            ax.plot(histogram['kde_x'], histogram['kde_y'], color=colors[condition])
+        ax.set_title(f'{title}\n{condition}', fontsize=16)
+        ax.set_xlabel(xlabel, fontsize=14)
+        ax.set_ylabel('Frequency', fontsize=14)
+        if value_range:
+            ax.set_xlim(*value_range)
+        ax.tick_params(labelsize=12)
+        ax.annotate(f'Cells: {cell_counts[condition]}\nClusters: {cluster_counts[condition]}',
+                    xy=(0.7, 0.85), xycoords='axes fraction', fontsize=12, bbox=dict(boxstyle="round", fc="w"))
+    figure.tight_layout()
+    figure.savefig(path)
+    return path
+
+def _scatter_figure(df, colors, cell_counts, cluster_counts, diffusion_range, size_range, path):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    figure = Figure(figsize=(12, 8))
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot()
+    rasterized = len(df) > 5000
+    for condition, group in df.groupby('Condition', observed=False):
+        ax.scatter(group['Average Cluster Size'], group['Diffusion Coefficient'], s=100, color=colors[condition],
+                   edgecolors='white', rasterized=rasterized,
+                   label=f'{condition} (N = {cell_counts[condition]} Cells, {cluster_counts[condition]} Clusters)')
+    ax.set_title('Diffusion Coefficients vs. Average Cluster Size', fontsize=20)
+    ax.set_xlabel('Average Cluster Size / \u03bcm²', fontsize=20)
+    ax.set_ylabel('Diffusion Coefficient / \u03bcm²/s', fontsize=20)
+    if size_range:
+        ax.set_xlim(*size_range)
+    if diffusion_range:
+        ax.set_ylim(*diffusion_range)
+    ax.legend(title='Condition', fontsize=12, title_fontsize=14)
+    ax.grid(True)
+    ax.tick_params(labelsize=12)
+    figure.tight_layout()
+    figure.savefig(path)
+    return path
+
+def plot_results(df, cell_counts, cluster_counts, output_folder, diffusion_bins='auto', diffusion_range=None,
+                 size_bins='auto', size_range=None):
+    # Histogramme und KDEs werden einmal pro Bedingung berechnet und ohne Bildschirm (Agg) gezeichnet
+    os.makedirs(output_folder, exist_ok=True)
+    conditions = list(cell_counts)
+    colors = condition_colors(conditions)
+
+    diffusion = condition_distributions(df, conditions, 'Diffusion Coefficient', diffusion_bins)
+    sizes = condition_distributions(df, conditions, 'Average Cluster Size', size_bins)
+
+    paths = [
+        _histogram_figure(diffusion, colors, cell_counts, cluster_counts, 'Diffusion Coefficient Distribution',
+                          'Diffusion Coefficient / \u03bcm²/s', diffusion_range,
+                          os.path.join(output_folder, "DiffusionCoefficient_Histograms.png")),
+        _histogram_figure(sizes, colors, cell_counts, cluster_counts, 'Average Cluster Size Distribution',
+                          'Average Cluster Size / \u03bcm²', size_range,
+                          os.path.join(output_folder, "ClusterSize_Histograms.png")),
+        _scatter_figure(df, colors, cell_counts, cluster_counts, diffusion_range, size_range,
+                        os.path.join(output_folder, "Scatterplot_Diffusion_vs_ClusterSize.png")),
+    ]
+    for path in paths:
+        print(f"Plot gespeichert: {path}")
+    return paths
+
+def _ensemble_figure(ensembles, fits, colors, path):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    figure = Figure(figsize=(12, 8))
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot()
+    for condition, ensemble in ensembles.items():
+        fit = fits.set_index('Condition').loc[condition]
+        ax.errorbar(ensemble['Lag Time'], ensemble['MSD'], yerr=ensemble['MSD SEM'], fmt='o', markersize=4,
+                    color=colors[condition], alpha=0.7,
+                    label=f"{condition}: α = {fit['Alpha']:.3f} ± {fit['Alpha SE']:.3f}, "
+                          f"D = {fit['Diffusion Coefficient']:.2g} ± {fit['D SE']:.1g} μm²/s")
+        if np.isfinite(fit['Alpha']):
+            # Fitgerade über die Lags, die mindestens die Hälfte der Tracks erreichen
+            fitted = ensemble[ensemble['Tracks'] >= max(fit['Tracks'] / 2, 2)]['Lag Time']
+            ax.plot(fitted, 4 * fit['Diffusion Coefficient'] * fitted ** fit['Alpha'], color=colors[condition])
+    ax.set_xscale('log')
+    ax.set_yscale('log')
+    ax.set_title('Ensemble MSD per Condition', fontsize=20)
+    ax.set_xlabel('Time Lag / s', fontsize=20)
+    ax.set_ylabel('MSD / μm²', fontsize=20)
+    ax.legend(title='Condition', fontsize=12, title_fontsize=14)
+    ax.grid(True, which='both', alpha=0.3)
+    ax.tick_params(labelsize=12)
+    figure.tight_layout()
+    figure.savefig(path)
+    return path
+
+def run_aggregate(input_folder, output_folder, diffusion_bins='auto', diffusion_range=None, size_bins='auto',
+                  size_range=None, manifest=None, workers=None, profile=False, conditions=None, progress=None):
+    report = RunReport('LowvsHighGUI', output_folder, profile=profile, parameters=dict(
+        input_folder=input_folder, manifest=manifest if isinstance(manifest, str) else None,
+        diffusion_bins=diffusion_bins, diffusion_range=diffusion_range, size_bins=size_bins, size_range=size_range))
+    with report.run():
+        with report.stage('load'):
+            if progress:
+                progress('LowvsHigh', 0, 4)
+            if ResultsStore.is_store(input_folder):
+                (df, cell_counts, cluster_counts), ensembles = load_store_results(input_folder, conditions)
+            else:
+                manifest = resolve_manifest(input_folder, manifest)
+                df, cell_counts, cluster_counts = load_results(input_folder, manifest, workers)
+                ensembles = condition_ensembles(manifest, workers)
+        report.count('files_read', sum(cell_counts.values()))
+        report.count('conditions', len(cell_counts))
+        report.count('clusters', len(df))
+
+        write_aggregate(df, cell_counts, cluster_counts, ensembles, output_folder, diffusion_bins, diffusion_range,
+                        size_bins, size_range, report, progress)
+    return df, cell_counts, cluster_counts
+
+def write_aggregate(df, cell_counts, cluster_counts, ensembles, output_folder, diffusion_bins='auto',
+                    diffusion_range=None, size_bins='auto', size_range=None, report=None, progress=None):
+    # Zusammenfassung, Plots und Ensemble-Vergleich aus bereits eingelesenen Daten
+    # (ensembles wie von pool_condition_ensembles geliefert). progress wird zwischen den
+    # Schritten aufgerufen, so kann die GUI den Job dort abbrechen.
+    if progress:
+        progress('LowvsHigh', 1, 4)
+    with optional_stage(report, 'summary'):
+        summary_path = os.path.join(output_folder, SUMMARY_FILE_NAME)
+        os.makedirs(output_folder, exist_ok=True)
+        condition_summary(df, cell_counts, cluster_counts).to_csv(summary_path, index=False)
+    print(f"Zusammenfassung pro Bedingung gespeichert: {summary_path}")
+
+    if progress:
+        progress('LowvsHigh', 2, 4)
+    with optional_stage(report, 'plot'):
+        paths = plot_results(df, cell_counts, cluster_counts, output_folder, diffusion_bins, diffusion_range,
+                             size_bins, size_range)
+
+    if progress:
+        progress('LowvsHigh', 3, 4)
+    with optional_stage(report, 'ensemble'):
+        condition_msd, ensemble_fits = ensembles
+        if condition_msd:
+            ensemble_fits.to_csv(os.path.join(output_folder, ENSEMBLE_SUMMARY_FILE_NAME), index=False)
+            path = _ensemble_figure(condition_msd, ensemble_fits, condition_colors(list(cell_counts)),
+                                    os.path.join(output_folder, "EnsembleMSD_Conditions.png"))
+            print(f"Plot gespeichert: {path}")
+            paths.append(path)
+    if report:
+        report.count('plots_written', len(paths))
+    if progress:
+        progress('LowvsHigh', 4, 4)
+    return paths
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Diffusionskoeffizienten und Clustergrößen pro Bedingung auswerten.",
+        usage="python LowvsHighGUI.py <input_folder> <output_folder> [<diffusion_bins> <diffusion_range_min> <diffusion_range_max> <size_bins> <size_range_min> <size_range_max>] [--manifest conditions.csv]")
+    parser.add_argument('input_folder')
+    parser.add_argument('output_folder')
+    parser.add_argument('ranges', nargs='*', help="Bins und Achsenbereiche (optional, alle sechs Werte)")
+    parser.add_argument('--manifest', help=f"CSV mit den Spalten File und Condition (Standard: <input_folder>/{MANIFEST_FILE_NAME})")
+    parser.add_argument('--write-manifest', action='store_true',
+                        help=f"{MANIFEST_FILE_NAME} mit der bisherigen Zuordnung im Eingabeordner anlegen und beenden")
+    parser.add_argument('--workers', type=int, default=None, help="Parallele Threads zum Einlesen")
+    parser.add_argument('--condition', action='append', default=None,
+                        help="Nur diese Bedingung aus einem Ergebnisspeicher auswerten (mehrfach möglich)")
+    parser.add_argument('--profile', action='store_true', help="cProfile-Profil als LowvsHighGUI.prof speichern")
+    args = parser.parse_args()
+
+    if args.write_manifest:
+        write_manifest(args.input_folder, args.manifest)
+        return
+    if len(args.ranges) not in (0, 6):
+        parser.error("Bins und Achsenbereiche müssen alle sechs angegeben werden")
+
+    diffusion_bins, diffusion_range, size_bins, size_range = 'auto', None, 'auto', None
+    if args.ranges:
+        diffusion_bins = int(args.ranges[0])
+        diffusion_range = (float(args.ranges[1]), float(args.ranges[2]))
+        size_bins = int(args.ranges[3])
+        size_range = (float(args.ranges[4]), float(args.ranges[5]))
+
+    run_aggregate(args.input_folder, args.output_folder, diffusion_bins, diffusion_range, size_bins, size_range,
+                  args.manifest, args.workers, args.profile, args.condition)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import sys
+import argparse
+import itertools
+import warnings
+import numpy as np
+import pandas as pd
+import CalculateDWithFlexibleAlphaGUI as calculate
+
+# Sensitivity of D and alpha to the analysis parameters. The MSD curves are
+# computed once for the longest lag range in the grid; every (lag fraction, fit
+# fraction) pair is one batched fit over all tracks, and R² threshold, minimum
+# duration and frame interval are applied by broadcasting.
+
+SUMMARY_COLUMNS = ['Lag Fraction', 'Fit Fraction', 'Frame Interval', 'R_squared Threshold', 'Min Duration', 'Clusters',
+                   'D Mean', 'D Median', 'D Std', 'Alpha Mean', 'Alpha Median', 'Alpha Std', 'R_squared Mean']
+TRACK_COLUMNS = ['Lag Fraction', 'Fit Fraction', 'Frame Interval', 'R_squared Threshold', 'Min Duration',
+                 'Cluster', 'Average Cluster Size', 'Diffusion Coefficient', 'Alpha', 'R_squared']
+
+def parse_values(text, cast=float):
+    # "0.8,0.9,0.95" -> [0.8, 0.9, 0.95]
+    return [cast(value) for value in text.split(',') if value.strip()]
+
+def _masked_stats(values, kept):
+    # Mean, median and standard deviation over the last axis, using only kept entries
+    masked = np.where(kept, values, np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmean(masked, axis=-1), np.nanmedian(masked, axis=-1), np.nanstd(masked, axis=-1)
+
+def sweep_parameters(tracks_data, r_squared_thresholds, min_durations, frame_intervals,
+                     fit_fractions=(0.8,), lag_fractions=(0.25,), msd_engine='fft', weighted_fit=False,
+                     per_track=False, progress=None):
+    r_squared_thresholds = np.asarray(r_squared_thresholds, dtype=np.float64)
+    min_durations = np.asarray(min_durations)
+    frame_intervals = np.asarray(frame_intervals, dtype=np.float64)
+
+    msd_table = calculate.compute_msd_table(tracks_data, msd_engine, progress, max(lag_fractions), max(fit_fractions))
+    fittable = msd_table['fittable']
+    lengths = msd_table['lengths'][fittable]
+    durations = (lengths - 1) * calculate.ROW_INTERVAL
+    msd_curves = msd_table['msd_curves']
+    lag_numbers = np.arange(1, msd_curves.shape[1] + 1)
+    weights = np.maximum(lengths[:, None] - lag_numbers, 0) if weighted_fit else None
+
+    # Grid axes of the threshold masks: (R² threshold, min duration, frame interval, track)
+    grid_shape = (len(r_squared_thresholds), len(min_durations), len(frame_intervals))
+    r_index, m_index, f_index = (index.ravel() for index in np.indices(grid_shape))
+    long_enough = durations >= min_durations[:, None]
+
+    summaries = []
+    track_tables = []
+    combinations = list(itertools.product(lag_fractions, fit_fractions))
+    for done, (lag_fraction, fit_fraction) in enumerate(combinations, 1):
+        _, fit_range = calculate.lag_ranges(lengths, lag_fraction, fit_fraction)
+        # Fit once with unit frame interval: another interval only shifts the intercept,
+        # lg4D = lg4D(1) - alpha * log10(frame interval), alpha and R² stay the same
+        alpha, lg4D, _, r_squared = calculate.fit_log_msd(lag_numbers, msd_curves, fit_range, weights)
+        fitted = (fit_range >= 4) & ~np.isnan(alpha)
+        D = 10 ** (lg4D - alpha * np.log10(frame_intervals)[:, None]) / 4
+
+        kept = (fitted & (np.nan_to_num(r_squared, nan=-np.inf) >= r_squared_thresholds[:, None, None])
+                & long_enough[None, :, :])
+        kept = np.broadcast_to(kept[:, :, None, :], grid_shape + (len(lengths),))
+
+        D_mean, D_median, D_std = _masked_stats(D[None, None], kept)
+        alpha_mean, alpha_median, alpha_std = _masked_stats(alpha, kept)
+        r_squared_mean, _, _ = _masked_stats(r_squared, kept)
+        summaries.append(pd.DataFrame({
+            'Lag Fraction': lag_fraction,
+            'Fit Fraction': fit_fraction,
+            'Frame Interval': frame_intervals[f_index],
+            'R_squared Threshold': r_squared_thresholds[r_index],
+            'Min Duration': min_durations[m_index],
+            'Clusters': kept.sum(axis=-1).ravel(),
+            'D Mean': D_mean.ravel(),
+            'D Median': D_median.ravel(),
+            'D Std': D_std.ravel(),
+            'Alpha Mean': alpha_mean.ravel(),
+            'Alpha Median': alpha_median.ravel(),
+            'Alpha Std': alpha_std.ravel(),
+            'R_squared Mean': r_squared_mean.ravel(),
+        }, columns=SUMMARY_COLUMNS))
+
+        if per_track:
+            r, m, f, track = np.nonzero(kept)
+            track_tables.append(pd.DataFrame({
+                'Lag Fraction': lag_fraction,
+                'Fit Fraction': fit_fraction,
+                'Frame Interval': frame_intervals[f],
+                'R_squared Threshold': r_squared_thresholds[r],
+                'Min Duration': min_durations[m],
+                'Cluster': msd_table['track_ids'][fittable][track].astype(str),
+                'Average Cluster Size': msd_table['mean_sizes'][fittable][track],
+                'Diffusion Coefficient': D[f, track],
+                'Alpha': alpha[track],
+                'R_squared': r_squared[track],
+            }, columns=TRACK_COLUMNS))
+
+        if progress:
+            progress('Sweep', done, len(combinations))
+
+    summary = pd.concat(summaries, ignore_index=True)
+    if not per_track:
+        return summary
+    return summary, pd.concat(track_tables, ignore_index=True)
+
+def run_sweep(input_file, output_file, r_squared_thresholds, min_durations, frame_intervals,
+              fit_fractions=(0.8,), lag_fractions=(0.25,), msd_engine='fft', weighted_fit=False,
+              per_track_file=None, progress=None):
+    tracks_data = calculate.load_tracks(input_file)
+    results = sweep_parameters(tracks_data, r_squared_thresholds, min_durations, frame_intervals, fit_fractions,
+                               lag_fractions, msd_engine, weighted_fit, per_track=bool(per_track_file), progress=progress)
+    summary = results[0] if per_track_file else results
+    summary.to_csv(output_file, index=False)
+    print(f"Parameter-Sweep ({len(summary)} Parameterkombinationen) gespeichert: {output_file}")
+    if per_track_file:
+        results[1].to_csv(per_track_file, index=False)
+        print(f"Ergebnisse pro Cluster gespeichert: {per_track_file}")
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="D und Alpha für ein Raster von Analyseparametern berechnen (MSD nur einmal pro Track).")
+    parser.add_argument('input_file', help="MosaicResults-CSV oder gespeicherte Tracks (.npz/.parquet/.feather)")
+    parser.add_argument('output_file', help="Zusammenfassung pro Parameterkombination (CSV)")
+    parser.add_argument('--r-squared-thresholds', default='0.9', help="Kommagetrennt, z.B. 0.8,0.9,0.95")
+    parser.add_argument('--min-durations', default='30', help="Kommagetrennt, in Sekunden")
+    parser.add_argument('--frame-intervals', default='10', help="Kommagetrennt, in Sekunden")
+    parser.add_argument('--fit-fractions', default='0.8', help="Anteil der MSD-Lags im Fit (Standard 0.8)")
+    parser.add_argument('--lag-fractions', default='0.25', help="Maximale Lag-Zeit als Anteil der Tracklänge (Standard 0.25)")
+    parser.add_argument('--msd-engine', choices=sorted(calculate.MSD_ENGINES), default='fft')
+    parser.add_argument('--weighted-fit', action='store_true')
+    parser.add_argument('--per-track', metavar='PATH', help="Zusätzlich alle Cluster pro Parameterkombination speichern")
+    parser.add_argument('--progress', action='store_true', help="Fortschritt als 'PROGRESS <Stufe> <fertig> <gesamt>' ausgeben")
+    args = parser.parse_args()
+
+    try:
+        grid = dict(r_squared_thresholds=parse_values(args.r_squared_thresholds),
+                    min_durations=parse_values(args.min_durations, int),
+                    frame_intervals=parse_values(args.frame_intervals),
+                    fit_fractions=parse_values(args.fit_fractions),
+                    lag_fractions=parse_values(args.lag_fractions))
+    except ValueError as e:
+        print(f"Ungültige Parameterliste: {e}")
+        sys.exit(1)
+    if not all(grid.values()):
+        print("Jede Parameterliste braucht mindestens einen Wert.")
+        sys.exit(1)
+
+    run_sweep(args.input_file, args.output_file, msd_engine=args.msd_engine, weighted_fit=args.weighted_fit,
+              per_track_file=args.per_track, progress=calculate.print_progress if args.progress else None, **grid)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from CalculateDWithFlexibleAlphaGUI import TrackStore
+
+# Links per-frame detections (e.g. the Mosaic "All particles" export) into tracks, so the
+# analysis no longer needs pre-linked MosaicResults. Frame by frame, the open track ends are
+# matched to the new detections within a maximum displacement; tracks missing for up to
+# max_gap frames can still be continued (gap closing). The result is a TrackStore, the
+# structure CalculateDWithFlexibleAlphaGUI builds from MosaicResults.
+# Gap closing is off by default: a closed gap leaves the track without rows for the missing
+# frames, while the MSD analysis assumes one row per frame interval, so every closed gap
+# would shorten the lag times of the following displacements and bias D and alpha.
+
+DETECTION_COLUMNS = {'frame': 'Frame', 'x': 'x', 'y': 'y', 'size': 'm0'}
+MOSAIC_OUTPUT_COLUMNS = ['', 'Trajectory', 'Frame', 'x', 'y', 'z', 'm0']
+
+def read_detections(input_file_path):
+    header = pd.read_csv(input_file_path, nrows=0).columns
+    missing = [column for column in DETECTION_COLUMNS.values() if column not in header]
+    if missing:
+        raise ValueError(f"Spalten fehlen in {input_file_path}: {', '.join(missing)} (erwartet: Frame, x, y, m0)")
+    data = pd.read_csv(input_file_path, usecols=list(DETECTION_COLUMNS.values()))
+    print(f"{len(data)} Detektionen in {data['Frame'].nunique()} Frames eingelesen")
+    return {field: data[column].to_numpy() for field, column in DETECTION_COLUMNS.items()}
+
+def assign(rows, columns, costs):
+    # One-to-one assignment on the sparse candidate pairs (rows[i], columns[i]) with costs[i].
+    # Every connected component of the candidate graph is solved on its own: most are a
+    # single pair and are taken directly, only competing candidates go through
+    # linear_sum_assignment. Within a component as many pairs as possible are linked, and
+    # among those the combination with the lowest total cost.
+    if not len(costs):
+        return rows, columns
+    n_rows = rows.max() + 1
+    nodes = n_rows + columns.max() + 1
+    graph = coo_matrix((np.ones(len(costs)), (rows, n_rows + columns)), shape=(nodes, nodes))
+    _, labels = connected_components(graph, directed=False)
+    component = labels[rows]
+    single = np.bincount(component)[component] == 1
+
+    linked_rows, linked_columns = [rows[single]], [columns[single]]
+    competing = np.flatnonzero(~single)
+    competing = competing[np.argsort(component[competing], kind='stable')]
+    for pairs in np.split(competing, np.flatnonzero(np.diff(component[competing])) + 1):
+        if not len(pairs):
+            continue
+        row_ids, row_index = np.unique(rows[pairs], return_inverse=True)
+        column_ids, column_index = np.unique(columns[pairs], return_inverse=True)
+        # Missing pairs cost more than all candidate pairs together, so they are only used
+        # where no candidate is left and are dropped afterwards
+        no_link = costs[pairs].sum() + 1.0
+        matrix = np.full((len(row_ids), len(column_ids)), no_link)
+        matrix[row_index, column_index] = costs[pairs]
+        row_choice, column_choice = linear_sum_assignment(matrix)
+        keep = matrix[row_choice, column_choice] < no_link
+        linked_rows.append(row_ids[row_choice[keep]])
+        linked_columns.append(column_ids[column_choice[keep]])
+    return np.concatenate(linked_rows), np.concatenate(linked_columns)
+
+def link_detections(frame, x, y, size, max_distance=3.0, max_gap=0, min_length=1):
+    # max_distance in pixels per frame. A track last seen `elapsed` frames ago may move up to
+    # max_distance * sqrt(elapsed) (diffusive spread); the cost of a link is the squared
+    # displacement divided by elapsed, so direct links and closed gaps compete fairly.
+    order = np.argsort(frame, kind='stable')
+    frame, x, y, size = (np.asarray(values)[order] for values in (frame, x, y, size))
+    frames, starts = np.unique(frame, return_index=True)
+    stops = np.append(starts[1:], len(frame))
+    search_radius = max_distance * np.sqrt(max_gap + 1)
+
+    track_of = np.empty(len(frame), dtype=np.int64)
+    end_row = np.zeros(0, dtype=np.int64)  # last detection of every open track
+    end_track = np.zeros(0, dtype=np.int64)
+    n_tracks = 0
+    for current, start, stop in zip(frames, starts, stops):
+        # Tracks not seen for more than max_gap frames are closed
+        elapsed = current - frame[end_row]
+        still_open = elapsed <= max_gap + 1
+        end_row, end_track, elapsed = end_row[still_open], end_track[still_open], elapsed[still_open]
+
+        linked_ends = linked_detections = np.zeros(0, dtype=np.int64)
+        if len(end_row):
+            ends = cKDTree(np.column_stack([x[end_row], y[end_row]]))
+            detections = cKDTree(np.column_stack([x[start:stop], y[start:stop]]))
+            pairs = ends.sparse_distance_matrix(detections, search_radius, output_type='ndarray')
+            pair_elapsed = elapsed[pairs['i']]
+            candidate = pairs['v'] <= max_distance * np.sqrt(pair_elapsed)
+            pairs, pair_elapsed = pairs[candidate], pair_elapsed[candidate]
+            linked_ends, linked_detections = assign(pairs['i'].astype(np.int64), pairs['j'].astype(np.int64),
+                                                    pairs['v'] ** 2 / pair_elapsed)
+
+        # Linked detections continue their track, all others start a new one
+        new = np.ones(stop - start, dtype=bool)
+        new[linked_detections] = False
+        new_rows = start + np.flatnonzero(new)
+        new_tracks = n_tracks + np.arange(len(new_rows))
+        n_tracks += len(new_rows)
+        track_of[start + linked_detections] = end_track[linked_ends]
+        track_of[new_rows] = new_tracks
+
+        end_row = end_row.copy()
+        end_row[linked_ends] = start + linked_detections
+        end_row = np.concatenate([end_row, new_rows])
+        end_track = np.concatenate([end_track, new_tracks])
+
+    keep = np.bincount(track_of, minlength=n_tracks)[track_of] >= min_length
+    # Trajectory numbers start at 1 as in MosaicResults; rows within a track are in frame order
+    tracks_data = TrackStore.from_columns(track_of[keep] + 1, frame[keep], x[keep], y[keep], size[keep])
+    print(f"{len(tracks_data)} Tracks mit {len(tracks_data.frame)} Detektionen verknüpft")
+    return tracks_data
+
+def write_mosaic_csv(tracks_data, output_file_path):
+    # Same column layout as MosaicResults, so the file can replace the external tracker's export
+    pd.DataFrame({
+        '': np.arange(1, len(tracks_data.frame) + 1),
+        'Trajectory': np.repeat(tracks_data.track_ids, tracks_data.lengths),
+        'Frame': tracks_data.frame,
+        'x': tracks_data.x,
+        'y': tracks_data.y,
+        'z': 0.0,
+        'm0': tracks_data.size,
+    }, columns=MOSAIC_OUTPUT_COLUMNS).to_csv(output_file_path, index=False)
+    print(f"Tracks saved to {output_file_path}")
+
+def link_file(input_file_path, output_file_path=None, max_distance=3.0, max_gap=0, min_length=1):
+    detections = read_detections(input_file_path)
+    tracks_data = link_detections(detections['frame'], detections['x'], detections['y'], detections['size'],
+                                  max_distance, max_gap, min_length)
+    if output_file_path:
+        if os.path.splitext(output_file_path)[1].lower() == '.csv':
+            write_mosaic_csv(tracks_data, output_file_path)
+        else:
+            tracks_data.save(output_file_path)
+    return tracks_data
+
+def main():
+    parser = argparse.ArgumentParser(description="Detektionen pro Frame zu Tracks verknüpfen.")
+    parser.add_argument('input_file', help="CSV mit den Spalten Frame, x, y und m0 (eine Zeile pro Detektion)")
+    parser.add_argument('output_file', help="Tracks als .csv (MosaicResults-Format), .npz, .parquet oder .feather")
+    parser.add_argument('--max-distance', type=float, default=3.0,
+                        help="Maximale Verschiebung pro Frame in Pixeln")
+    parser.add_argument('--max-gap', type=int, default=0,
+                        help="So viele Frames darf ein Partikel fehlen und trotzdem weiterverfolgt werden "
+                             "(Standard 0; fehlende Frames verfälschen die MSD-Auswertung)")
+    parser.add_argument('--min-length', type=int, default=1, help="Kürzere Tracks werden verworfen")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input_file):
+        print(f"Datei nicht gefunden: {args.input_file}")
+        sys.exit(1)
+    link_file(args.input_file, args.output_file, args.max_distance, args.max_gap, args.min_length)
+
+if __name__ == "__main__":
+    main()
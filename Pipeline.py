@@ -0,0 +1,101 @@
+# In-process API for the analysis pipeline, used by GUI.py and batch callers.
+# Importing this module is cheap: pandas, scipy, matplotlib and tifffile
+# are only loaded by the stage that needs them. The scripts keep their command
+# lines and call the same functions from their __main__ blocks.
+
+class JobCancelled(Exception):
+    pass
+
+def spawn_context():
+    # Callers of this API often run it in a thread (GUI), and forking a multithreaded process is
+    # unsafe: process pools started through it use spawn unless the caller passes mp_context
+    import multiprocessing
+
+    return multiprocessing.get_context('spawn')
+
+# Ingest
+
+def ingest(input_file, save_tracks=None, chunk_size=None):
+    import CalculateDWithFlexibleAlphaGUI as calculate
+
+    tracks_data = calculate.load_tracks(input_file, chunk_size)
+    if save_tracks:
+        tracks_data.save(save_tracks)
+    return tracks_data
+
+def link(detections_file, save_tracks=None, max_distance=3.0, max_gap=0, min_length=1):
+    import ParticleLinker
+
+    return ParticleLinker.link_file(detections_file, save_tracks, max_distance, max_gap, min_length)
+
+# MSD / Fit
+
+def msd_fit(tracks_data, r_squared_threshold, min_duration, frame_interval, plot_folder,
+            msd_engine='fft', weighted_fit=False, progress=None, bootstrap=0, seed=None, bootstrap_workers=1,
+            mp_context=None):
+    import CalculateDWithFlexibleAlphaGUI as calculate
+
+    return calculate.compute_diffusion_coefficients(tracks_data, plot_folder, r_squared_threshold, min_duration,
+                                                    frame_interval, msd_engine, weighted_fit, progress,
+                                                    bootstrap, seed, bootstrap_workers, mp_context or spawn_context())
+
+def run_diffusion_analysis(input_file, r_squared_threshold, min_duration, frame_interval, output_folder, **options):
+    import CalculateDWithFlexibleAlphaGUI as calculate
+
+    options.setdefault('mp_context', spawn_context())
+    return calculate.run_analysis(input_file, r_squared_threshold, min_duration, frame_interval, output_folder, **options)
+
+def run_batch(input_files, r_squared_threshold, min_duration, frame_interval, **options):
+    import BatchAnalysis
+
+    options.setdefault('mp_context', spawn_context())
+    return BatchAnalysis.run_batch(input_files, r_squared_threshold, min_duration, frame_interval, **options)
+
+def sweep(tracks_data, r_squared_thresholds, min_durations, frame_intervals, **options):
+    import ParameterSweep
+
+    return ParameterSweep.sweep_parameters(tracks_data, r_squared_thresholds, min_durations, frame_intervals, **options)
+
+def clear_cache(input_file=None, cache_dir=None):
+    import ResultCache
+
+    return ResultCache.ResultCache(cache_dir).clear(input_file)
+
+# Aggregate
+
+def aggregate(input_folder, manifest=None, workers=None):
+    import LowvsHighGUI
+
+    return LowvsHighGUI.load_results(input_folder, manifest, workers)
+
+def extract_intensities(tif_file, output_folder, frames=None, write_npy=True, write_csv=False):
+    import GetIntsGUI
+
+    return GetIntsGUI.extract_intensities(tif_file, output_folder, frames, write_npy, write_csv)
+
+def analyze_concentrations(base_path, classified_image_file, laser_power, gain, bleaching_step_height,
+                           chunk_size=None, workers=1, components=False, tracks_file=None, link_distance=3.0):
+    import PlotIntsGUI
+
+    return PlotIntsGUI.analyze_concentration_per_cluster_and_background(
+        base_path, classified_image_file, laser_power, gain, bleaching_step_height, chunk_size, workers, show=False,
+        components=components, tracks_file=tracks_file, link_distance=link_distance)
+
+# Plot
+
+def plot_diffusion(tracks_data, output_df, msd_data, valid_clusters, output_folder, **options):
+    import CalculateDWithFlexibleAlphaGUI as calculate
+
+    options.setdefault('mp_context', spawn_context())
+    calculate.plot_diffusion_results(tracks_data, output_df, msd_data, valid_clusters, output_folder, **options)
+
+def plot_aggregate(results, output_folder, **options):
+    import LowvsHighGUI
+
+    df, cell_counts, cluster_counts = results
+    return LowvsHighGUI.plot_results(df, cell_counts, cluster_counts, output_folder, **options)
+
+def run_aggregate(input_folder, output_folder, **options):
+    import LowvsHighGUI
+
+    return LowvsHighGUI.run_aggregate(input_folder, output_folder, **options)
@@ -1,124 +1,307 @@
-import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-import os
-import sys
-import tifffile as tiff
-
-def analyze_concentration_per_cluster_and_background(base_path, classified_image_file, laser_power, gain, bleaching_step_height):
-    # Dateinamen
-    csv_filename = 'Int.csv'
-
-    # Parameter für die Konzentrationsberechnung
-    pixellength = 0.16  # µm
-    cell_height = 1  # µm
-    factor = 10 / laser_power * 50 / gain  # Umrechnungsfaktor
-    avogadro_number = 6.022e23
-
-    # Dateien laden
-    csv_file_path = os.path.join(base_path, csv_filename)
-
-    # Lesen der CSV-Datei
-    data = pd.read_csv(csv_file_path)
-
-    # Lesen des Classified Image
-    classified_image_stack = tiff.imread(classified_image_file)
-
-    # Initialisieren von Listen für die Durchschnittskonzentrationen
-    average_cluster_concentrations = []
-    average_cellular_background_concentrations = []
-
-    # Anzahl der Frames und Abmessungen der Bilder
-    num_frames = classified_image_stack.shape[0]
-
-    # Iteration über alle Frames im Bildstapel
-    for frame_index, frame in enumerate(classified_image_stack):
-        # Definieren der Klassifizierung der Pixel:
-        # 0 für Cluster, 1 für zellulären Hintergrund, 2 für nicht zellulären Hintergrund
-        cluster_mask = (frame == 0)
-        cellular_background_mask = (frame == 1)
-        non_cellular_background_mask = (frame == 2)
-
-        # Sicherstellen, dass x und y innerhalb der Grenzen liegen
-        height, width = frame.shape
-        valid_data = data[(data['x'] < width) & (data['y'] < height)]
-
-        # Verwenden der `x` und `y` Koordinaten, um die relevanten Pixel zu extrahieren
-        cluster_pixels = cluster_mask[valid_data['y'], valid_data['x']]
-        cellular_background_pixels = cellular_background_mask[valid_data['y'], valid_data['x']]
-        non_cellular_background_pixels = non_cellular_background_mask[valid_data['y'], valid_data['x']]
-
-        cluster_intensities = valid_data.loc[cluster_pixels, 'Intensity']
-        cellular_background_intensities = valid_data.loc[cellular_background_pixels, 'Intensity']
-        non_cellular_background_intensities = valid_data.loc[non_cellular_background_pixels, 'Intensity']
-
-        # Überprüfen, ob es Clusterintensitäten gibt
-        if len(cluster_intensities) == 0:
-            continue  # Überspringen, wenn keine Cluster vorhanden sind
-
-        # Berechnung der Teilchenzahl pro Pixel
-        cluster_particles_per_pixel = cluster_intensities / bleaching_step_height
-        cellular_background_particles_per_pixel = cellular_background_intensities / bleaching_step_height
-        non_cellular_background_particles_per_pixel = non_cellular_background_intensities / bleaching_step_height
-
-        # Volumen eines Pixels in µm^3
-        pixel_volume = (pixellength ** 2) * cell_height
-
-        # Berechnung der Teilchen pro µm^3
-        cluster_particles_per_um3 = cluster_particles_per_pixel / pixel_volume * factor
-        cellular_background_particles_per_um3 = cellular_background_particles_per_pixel / pixel_volume * factor
-        non_cellular_background_particles_per_um3 = non_cellular_background_particles_per_pixel / pixel_volume * factor
-
-        # Konzentration in Mol pro Liter
-        cluster_concentration_m_per_l = cluster_particles_per_um3 / avogadro_number * 1e15
-        cellular_background_concentration_m_per_l = cellular_background_particles_per_um3 / avogadro_number * 1e15
-        non_cellular_background_concentration_m_per_l = non_cellular_background_particles_per_um3 / avogadro_number * 1e15
-
-        # Berechnung der Konzentration in Nanomolar (nM) mit Umrechnungsfaktor
-        cluster_concentration_nM = cluster_concentration_m_per_l * 1e9
-        cellular_background_concentration_nM = cellular_background_concentration_m_per_l * 1e9
-        non_cellular_background_concentration_nM = non_cellular_background_concentration_m_per_l * 1e9
-
-        # Korrektur durch nichtzellulären Hintergrund
-        corrected_cluster_concentration_nM = cluster_concentration_nM - np.mean(non_cellular_background_concentration_nM)
-        corrected_cellular_background_concentration_nM = cellular_background_concentration_nM - np.mean(non_cellular_background_concentration_nM)
-
-        # Durchschnittliche Konzentrationen berechnen
-        average_corrected_cluster_concentration = np.mean(corrected_cluster_concentration_nM)
-        average_corrected_cellular_background_concentration = np.mean(corrected_cellular_background_concentration_nM)
-
-        # Speichern der Durchschnittskonzentrationen für diesen Frame
-        average_cluster_concentrations.append(average_corrected_cluster_concentration)
-        average_cellular_background_concentrations.append(average_corrected_cellular_background_concentration)
-
-        print(f"Frame {frame_index}: Avg Corrected Cluster Concentration = {average_corrected_cluster_concentration:.2f} nM, Avg Corrected Background Concentration = {average_corrected_cellular_background_concentration:.2f} nM")
-
-    # Plotten der Durchschnittskonzentrationen gegen die Frame-Nummer
-    plt.figure(figsize=(12, 6))
-    plt.plot(range(len(average_cluster_concentrations)), average_cluster_concentrations, marker='o', linestyle='-', label='Average Corrected Cluster Concentration', color='b')
-    plt.plot(range(len(average_cellular_background_concentrations)), average_cellular_background_concentrations, marker='x', linestyle='--', label='Average Corrected Cellular Background Concentration', color='g')
-    plt.title('Corrected Average Concentrations Over Time')
-    plt.xlabel('Frame Index')
-    plt.ylabel('Concentration (nM)')
-    plt.grid(True)
-    plt.legend()
-    plt.tight_layout()
-
-    # Speichern des Plots
-    output_folder = os.path.join(base_path, 'Plots')
-    os.makedirs(output_folder, exist_ok=True)
-    plt.savefig(os.path.join(output_folder, 'corrected_average_concentrations_over_time.png'))
-    plt.show()
-
-if __name__ == "__main__":
-    if len(sys.argv) != 6:
-        print("Usage: python PlotInts.py <base_path> <classified_image_file> <laser_power> <gain> <bleaching_step_height>")
-        sys.exit(1)
-
-    base_path = sys.argv[1]
-    classified_image_file = sys.argv[2]
-    laser_power = float(sys.argv[3])
-    gain = float(sys.argv[4])
-    bleaching_step_height = float(sys.argv[5])
-
-    analyze_concentration_per_cluster_and_background(base_path, classified_image_file, laser_power, gain, bleaching_step_height)
+import numpy as np
+import pandas as pd
+import os
+import argparse
+import tifffile as tiff
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from GetIntsGUI import NPY_FILENAME, load_intensity_stack
+from RunReport import RunReport
+
+# Klassifizierung der Pixel: 0 für Cluster, 1 für zellulären Hintergrund, 2 für nicht zellulären Hintergrund.
+# Alle anderen Werte (und Pixel ohne Intensität) landen in der Restklasse.
+CLUSTER = 0
+CELLULAR_BACKGROUND = 1
+NON_CELLULAR_BACKGROUND = 2
+OTHER = 3
+N_CLASSES = 4
+PIXEL_LENGTH = 0.16  # µm
+COMPONENTS_FILENAME = 'cluster_components.csv'
+DEFAULT_CHUNK_SIZE = 16  # Frames pro Block, wenn keine --chunk-size angegeben ist
+
+def load_intensity_image(base_path, csv_filename='Int.csv'):
+    # Bevorzugt das binäre Int.npy (erster extrahierter Frame), sonst Int.csv.
+    # Pixel, die in der CSV fehlen, sind NaN.
+    if os.path.exists(os.path.join(base_path, NPY_FILENAME)):
+        stack, _ = load_intensity_stack(base_path)
+        return np.asarray(stack[0], dtype=np.float64)
+
+    data = pd.read_csv(os.path.join(base_path, csv_filename))
+    if 'Frame' in data.columns:
+        # Mehrere Frames extrahiert: wie beim Int.npy nur der erste (die CSV ist in Extraktionsreihenfolge)
+        data = data[data['Frame'] == data['Frame'].iloc[0]]
+    x = data['x'].to_numpy()
+    y = data['y'].to_numpy()
+    image = np.full((y.max() + 1, x.max() + 1), np.nan)
+    image[y, x] = data['Intensity'].to_numpy(dtype=np.float64)
+    return image
+
+def concentration_factor(laser_power, gain, bleaching_step_height):
+    # Umrechnung Intensität -> nM, konstant für alle Pixel
+    pixellength = PIXEL_LENGTH
+    cell_height = 1  # µm
+    factor = 10 / laser_power * 50 / gain  # Umrechnungsfaktor
+    avogadro_number = 6.022e23
+
+    # Volumen eines Pixels in µm^3
+    pixel_volume = (pixellength ** 2) * cell_height
+
+    # Teilchen pro Pixel -> Teilchen pro µm^3 -> mol/l -> nM
+    return 1 / bleaching_step_height / pixel_volume * factor / avogadro_number * 1e15 * 1e9
+
+def class_sums(intensity_image, frames):
+    # Summe der Intensitäten und Pixelanzahl pro (Frame, Klasse), ein bincount pro Frame.
+    # Zwischenarrays haben nur Framegröße (Klassen als uint8), unabhängig von der Stapellänge.
+    frames = np.asarray(frames)
+    if frames.ndim == 2:
+        frames = frames[None]
+    height = min(frames.shape[1], intensity_image.shape[0])
+    width = min(frames.shape[2], intensity_image.shape[1])
+    intensity = intensity_image[:height, :width]
+    has_intensity = np.isfinite(intensity)
+    weights = np.where(has_intensity, intensity, 0.0).ravel()
+
+    sums = np.zeros((len(frames), N_CLASSES))
+    counts = np.zeros((len(frames), N_CLASSES), dtype=np.intp)
+    classes = np.empty((height, width), dtype=np.uint8)
+    for i, labels in enumerate(frames[:, :height, :width]):
+        classes.fill(OTHER)
+        for pixel_class in (CLUSTER, CELLULAR_BACKGROUND, NON_CELLULAR_BACKGROUND):
+            classes[labels == pixel_class] = pixel_class
+        classes[~has_intensity] = OTHER
+        sums[i] = np.bincount(classes.ravel(), weights=weights, minlength=N_CLASSES)
+        counts[i] = np.bincount(classes.ravel(), minlength=N_CLASSES)
+    return sums, counts
+
+def cluster_components(intensity_image, frames, first_frame=0):
+    # Zusammenhängende Clusterbereiche (Klasse 0) in jedem Frame eines Blocks (die Stapel
+    # werden blockweise übergeben, siehe class_sums_streaming). Der Block wird in einem Aufruf
+    # gelabelt (die Struktur verbindet keine Nachbarframes); Fläche, Intensitätssumme und
+    # Schwerpunkt kommen aus bincounts über die Clusterpixel allein, ohne Kopien in Blockgröße.
+    from scipy import ndimage
+
+    frames = np.asarray(frames)
+    if frames.ndim == 2:
+        frames = frames[None]
+    height = min(frames.shape[1], intensity_image.shape[0])
+    width = min(frames.shape[2], intensity_image.shape[1])
+    structure = np.zeros((3, 3, 3), dtype=bool)
+    structure[1] = ndimage.generate_binary_structure(2, 1)
+    labels, n_components = ndimage.label(frames[:, :height, :width] == CLUSTER, structure=structure)
+
+    position = np.flatnonzero(labels)
+    label = labels.ravel()[position] - 1
+    frame_index, pixel = np.divmod(position, height * width)
+    row, column = np.divmod(pixel, width)
+    intensity = np.ascontiguousarray(intensity_image[:height, :width]).ravel()[pixel]
+    has_intensity = np.isfinite(intensity)
+
+    def label_sum(values):
+        return np.bincount(label, weights=values, minlength=n_components)
+
+    pixels = np.bincount(label, minlength=n_components)
+    frame = (label_sum(frame_index) / pixels).round().astype(np.int64) + first_frame
+    # Labels laufen zeilenweise durch den Block, also innerhalb eines Frames aufsteigend
+    frame_starts = np.flatnonzero(np.r_[True, frame[1:] != frame[:-1]])
+    component = np.arange(n_components) - np.repeat(frame_starts, np.diff(np.r_[frame_starts, n_components])) + 1
+    return pd.DataFrame({
+        'Frame': frame,
+        'Component': component,
+        'Pixels': pixels,
+        'Area (µm²)': pixels * PIXEL_LENGTH ** 2,
+        'Centroid X': label_sum(column) / pixels,
+        'Centroid Y': label_sum(row) / pixels,
+        'Intensity Pixels': label_sum(has_intensity).astype(np.int64),
+        'Summed Intensity': label_sum(np.where(has_intensity, intensity, 0.0)),
+    })
+
+def component_concentrations(components, table, conversion_factor):
+    # nM pro Komponente, korrigiert um den nichtzellulären Hintergrund des jeweiligen Frames
+    with np.errstate(divide='ignore', invalid='ignore'):
+        concentration = components['Summed Intensity'] / components['Intensity Pixels'] * conversion_factor
+    background = table.set_index('Frame')['Non-Cellular Background Concentration (nM)']
+    components['Concentration (nM)'] = concentration
+    components['Corrected Concentration (nM)'] = concentration - background.reindex(components['Frame']).to_numpy()
+    return components
+
+def link_components_to_tracks(components, tracks_file, max_distance=3.0):
+    # Ordnet jeder Komponente die TrackID der nächsten Detektion im selben Frame zu (Abstand in
+    # Pixeln). Frames werden als dritte Koordinate im Abstand > max_distance eingetragen,
+    # sodass ein einziger KD-Baum für alle Frames reicht.
+    from scipy.spatial import cKDTree
+    from CalculateDWithFlexibleAlphaGUI import load_tracks
+
+    tracks = load_tracks(tracks_file)
+    if len(tracks.frame) == 0 or len(components) == 0:
+        # Keine Detektionen oder keine Komponenten: nichts zuzuordnen
+        components['TrackID'] = pd.Series(pd.NA, index=components.index, dtype='Int64')
+        components['Track Distance (px)'] = np.nan
+        return components
+    frame_spacing = 2 * max_distance + 1
+    tree = cKDTree(np.column_stack([tracks.x, tracks.y, tracks.frame * frame_spacing]))
+    points = np.column_stack([components['Centroid X'], components['Centroid Y'], components['Frame'] * frame_spacing])
+    distance, index = tree.query(points, distance_upper_bound=max_distance)
+    matched = np.isfinite(distance)
+    track_ids = np.repeat(tracks.track_ids, tracks.lengths)
+    nearest = pd.Series(track_ids[np.minimum(index, len(track_ids) - 1)], index=components.index, dtype='Int64')
+    components['TrackID'] = nearest.where(matched)
+    components['Track Distance (px)'] = np.where(matched, distance, np.nan)
+    return components
+
+def iter_classified_chunks(classified_image_file, chunk_size):
+    # Liefert (erster Frame, Frames) in Blöcken von höchstens chunk_size Frames.
+    # Unkomprimierte Stapel werden memory-mapped, alle anderen seitenweise gelesen.
+    try:
+        stack = tiff.memmap(classified_image_file, mode='r')
+    except ValueError:
+        stack = None
+
+    if stack is not None:
+        if stack.ndim == 2:
+            stack = stack[None]
+        for start in range(0, len(stack), chunk_size):
+            yield start, np.asarray(stack[start:start + chunk_size])
+        return
+
+    with tiff.TiffFile(classified_image_file) as tif:
+        pages = tif.pages
+        for start in range(0, len(pages), chunk_size):
+            stop = min(start + chunk_size, len(pages))
+            yield start, np.stack([pages[i].asarray() for i in range(start, stop)])
+
+def _chunk_sums(intensity_image, chunk, first_frame, components):
+    sums, counts = class_sums(intensity_image, chunk)
+    return sums, counts, cluster_components(intensity_image, chunk, first_frame) if components else None
+
+def class_sums_streaming(intensity_image, classified_image_file, chunk_size=DEFAULT_CHUNK_SIZE, workers=1,
+                         components=False):
+    # Wie class_sums (und cluster_components), aber blockweise: höchstens `workers` Blöcke
+    # sind gleichzeitig im Speicher
+    results = []
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for start, chunk in iter_classified_chunks(classified_image_file, chunk_size):
+            pending.append(executor.submit(_chunk_sums, intensity_image, chunk, start, components))
+            if len(pending) >= workers:
+                results.append(pending.popleft().result())
+        while pending:
+            results.append(pending.popleft().result())
+
+    if not results:
+        return np.zeros((0, N_CLASSES)), np.zeros((0, N_CLASSES), dtype=np.intp), None
+    sums, counts, component_tables = zip(*results)
+    return np.concatenate(sums), np.concatenate(counts), pd.concat(component_tables) if components else None
+
+def concentration_table(sums, counts, conversion_factor, first_frame=0):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_concentrations = sums / counts * conversion_factor
+
+    # Korrektur durch nichtzellulären Hintergrund
+    non_cellular = mean_concentrations[:, NON_CELLULAR_BACKGROUND]
+    return pd.DataFrame({
+        'Frame': np.arange(first_frame, first_frame + len(sums)),
+        'Cluster Pixels': counts[:, CLUSTER],
+        'Cellular Background Pixels': counts[:, CELLULAR_BACKGROUND],
+        'Non-Cellular Background Pixels': counts[:, NON_CELLULAR_BACKGROUND],
+        'Cluster Concentration (nM)': mean_concentrations[:, CLUSTER],
+        'Cellular Background Concentration (nM)': mean_concentrations[:, CELLULAR_BACKGROUND],
+        'Non-Cellular Background Concentration (nM)': non_cellular,
+        'Corrected Cluster Concentration (nM)': mean_concentrations[:, CLUSTER] - non_cellular,
+        'Corrected Cellular Background Concentration (nM)': mean_concentrations[:, CELLULAR_BACKGROUND] - non_cellular,
+    })
+
+def analyze_concentration_per_cluster_and_background(base_path, classified_image_file, laser_power, gain, bleaching_step_height,
+                                                      chunk_size=None, workers=1, show=True, profile=False,
+                                                      components=False, tracks_file=None, link_distance=3.0):
+    output_folder = os.path.join(base_path, 'Plots')
+    report = RunReport('PlotIntsGUI', output_folder, profile=profile, parameters=dict(
+        classified_image_file=classified_image_file, laser_power=laser_power, gain=gain,
+        bleaching_step_height=bleaching_step_height, chunk_size=chunk_size, workers=workers,
+        components=components, tracks_file=tracks_file, link_distance=link_distance))
+    with report.run():
+        # Lesen der Intensitäten (Int.npy oder Int.csv)
+        with report.stage('load_intensities'):
+            intensity_image = load_intensity_image(base_path)
+
+        # Summen und Pixelanzahlen pro Frame und Klasse, Umrechnung in nM einmal am Ende.
+        # Das Classified Image wird immer blockweise gestreamt (ohne chunk_size in Blöcken von
+        # DEFAULT_CHUNK_SIZE Frames), der Speicherbedarf hängt also nicht von der Stapellänge ab.
+        # Mit components zusätzlich eine Zeile pro zusammenhängendem Cluster und Frame.
+        conversion_factor = concentration_factor(laser_power, gain, bleaching_step_height)
+        with report.stage('class_sums'):
+            sums, counts, component_table = class_sums_streaming(intensity_image, classified_image_file,
+                                                                 chunk_size or DEFAULT_CHUNK_SIZE, workers, components)
+            table = concentration_table(sums, counts, conversion_factor)
+
+        if components:
+            with report.stage('components'):
+                component_table = component_concentrations(component_table.reset_index(drop=True), table,
+                                                           conversion_factor)
+                if tracks_file:
+                    component_table = link_components_to_tracks(component_table, tracks_file, link_distance)
+                    report.count('components_linked', component_table['TrackID'].notna().sum())
+                os.makedirs(output_folder, exist_ok=True)
+                components_path = os.path.join(output_folder, COMPONENTS_FILENAME)
+                component_table.to_csv(components_path, index=False)
+            report.count('components', len(component_table))
+            print(f"{len(component_table)} Cluster-Komponenten gespeichert: {components_path}")
+
+        # Frames ohne Cluster werden übersprungen
+        frames_with_clusters = table[table['Cluster Pixels'] > 0]
+        report.count('frames', len(table))
+        report.count('frames_with_clusters', len(frames_with_clusters))
+        average_cluster_concentrations = frames_with_clusters['Corrected Cluster Concentration (nM)'].tolist()
+        average_cellular_background_concentrations = frames_with_clusters['Corrected Cellular Background Concentration (nM)'].tolist()
+
+        for frame_index, cluster_concentration, background_concentration in zip(
+                frames_with_clusters['Frame'], average_cluster_concentrations, average_cellular_background_concentrations):
+            print(f"Frame {frame_index}: Avg Corrected Cluster Concentration = {cluster_concentration:.2f} nM, Avg Corrected Background Concentration = {background_concentration:.2f} nM")
+
+        # Plotten der Durchschnittskonzentrationen gegen die Frame-Nummer
+        with report.stage('plot'):
+            import matplotlib.pyplot as plt
+            plt.figure(figsize=(12, 6))
+            plt.plot(range(len(average_cluster_concentrations)), average_cluster_concentrations, marker='o', linestyle='-', label='Average Corrected Cluster Concentration', color='b')
+            plt.plot(range(len(average_cellular_background_concentrations)), average_cellular_background_concentrations, marker='x', linestyle='--', label='Average Corrected Cellular Background Concentration', color='g')
+            plt.title('Corrected Average Concentrations Over Time')
+            plt.xlabel('Frame Index')
+            plt.ylabel('Concentration (nM)')
+            plt.grid(True)
+            plt.legend()
+            plt.tight_layout()
+
+            # Speichern des Plots und der Tabelle
+            os.makedirs(output_folder, exist_ok=True)
+            table.to_csv(os.path.join(output_folder, 'concentrations_per_frame.csv'), index=False)
+            plt.savefig(os.path.join(output_folder, 'corrected_average_concentrations_over_time.png'))
+        report.count('plots_written', 1)
+        if show:
+            plt.show()
+        plt.close()
+
+    return table
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analysiert Cluster- und Hintergrundkonzentrationen pro Frame.",
+                                     usage="python PlotInts.py <base_path> <classified_image_file> <laser_power> <gain> <bleaching_step_height> [--chunk-size N] [--workers N]")
+    parser.add_argument('base_path')
+    parser.add_argument('classified_image_file')
+    parser.add_argument('laser_power', type=float)
+    parser.add_argument('gain', type=float)
+    parser.add_argument('bleaching_step_height', type=float)
+    parser.add_argument('--chunk-size', type=int, default=None,
+                        help=f"Classified Image in Blöcken von N Frames streamen (Standard: {DEFAULT_CHUNK_SIZE})")
+    parser.add_argument('--workers', type=int, default=1, help="Anzahl paralleler Threads im Streaming-Modus")
+    parser.add_argument('--profile', action='store_true', help="cProfile-Profil als Plots/PlotIntsGUI.prof speichern")
+    parser.add_argument('--components', action='store_true',
+                        help=f"Konzentration pro zusammenhängendem Cluster und Frame in Plots/{COMPONENTS_FILENAME} speichern")
+    parser.add_argument('--tracks', metavar='FILE',
+                        help="MosaicResults oder gespeicherte Tracks: Komponenten über den Schwerpunkt den TrackIDs zuordnen")
+    parser.add_argument('--link-distance', type=float, default=3.0,
+                        help="Maximaler Abstand (Pixel) zwischen Schwerpunkt und Detektion für --tracks")
+    args = parser.parse_args()
+
+    analyze_concentration_per_cluster_and_background(args.base_path, args.classified_image_file, args.laser_power, args.gain,
+                                                      args.bleaching_step_height, args.chunk_size, args.workers,
+                                                      profile=args.profile, components=args.components or bool(args.tracks),
+                                                      tracks_file=args.tracks, link_distance=args.link_distance)
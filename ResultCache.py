@@ -0,0 +1,188 @@
+import os
+import json
+import hashlib
+import zipfile
+import argparse
+import numpy as np
+
+# On-disk cache for the diffusion analysis. Entries are .npz files named
+# <input hash>-<stage>-<parameter hash>.npz:
+#   tracks  ingested TrackStore                      (input file only)
+#   msd     per-track MSD curves                     (+ MSD engine)
+#   fit     alpha / D / R² for every cached MSD row  (+ frame interval, weighting)
+# R² threshold and minimum duration are applied on top of the cached fits, so
+# changing them never recomputes anything.
+
+DEFAULT_CACHE_DIR = os.environ.get('SCT_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'single-cluster-tracking'))
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+CACHE_VERSION = 1
+
+def file_hash(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class ResultCache:
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(**parameters):
+        parameters['version'] = CACHE_VERSION
+        return hashlib.sha256(json.dumps(parameters, sort_keys=True).encode()).hexdigest()[:32]
+
+    def path(self, input_hash, stage, key):
+        return os.path.join(self.cache_dir, f'{input_hash[:32]}-{stage}-{key}.npz')
+
+    def load(self, input_hash, stage, key):
+        path = self.path(input_hash, stage, key)
+        try:
+            with np.load(path, allow_pickle=False) as stored:
+                arrays = {name: stored[name] for name in stored.files}
+            os.utime(path)  # mark as recently used for eviction
+            return arrays
+        except (OSError, ValueError, zipfile.BadZipFile):
+            return None
+
+    def store(self, input_hash, stage, key, arrays):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(input_hash, stage, key)
+        temporary_path = f'{path}.{os.getpid()}.tmp.npz'
+        np.savez(temporary_path, **arrays)
+        os.replace(temporary_path, path)
+        self.evict()
+
+    def entries(self):
+        # (path, size, last use) of every entry, least recently used first
+        if not os.path.isdir(self.cache_dir):
+            return []
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.npz') or '.tmp.' in name:
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self, input_file=None):
+        prefix = file_hash(input_file)[:32] if input_file else ''
+        removed = 0
+        for path, _, _ in self.entries():
+            if os.path.basename(path).startswith(prefix):
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+def cached_diffusion_analysis(cache, input_file, r_squared_threshold, min_duration, frame_interval,
+                              msd_engine='fft', weighted_fit=False, progress=None, chunk_size=None, report=None,
+                              bootstrap=0, seed=None, bootstrap_workers=1, mp_context=None):
+    # Same results as load_tracks + compute_diffusion_coefficients, reusing every cached stage.
+    # The MSD table and fits are returned as well for the ensemble stage.
+    import CalculateDWithFlexibleAlphaGUI as calculate
+    from RunReport import optional_stage
+
+    with optional_stage(report, 'cache_lookup'):
+        input_hash = file_hash(input_file)
+
+    # The streaming ingest stores compact dtypes, so it gets its own entry
+    tracks_key = cache.key(stage='tracks', compact=bool(chunk_size))
+    stored = cache.load(input_hash, 'tracks', tracks_key)
+    if stored is None:
+        with optional_stage(report, 'ingest'):
+            if progress:
+                progress('Einlesen', 0, 1)
+            tracks_data = calculate.load_tracks(input_file, chunk_size)
+            if progress:
+                progress('Einlesen', 1, 1)
+        cache.store(input_hash, 'tracks', tracks_key, {
+            'track_ids': tracks_data.track_ids, 'offsets': tracks_data.offsets, 'frame': tracks_data.frame,
+            'x': tracks_data.x, 'y': tracks_data.y, 'size': tracks_data.size})
+    else:
+        print(f"Cache: Tracks für {input_file} geladen")
+        tracks_data = calculate.TrackStore(**stored)
+        if report:
+            report.count('cache_hits')
+
+    msd_key = cache.key(stage='msd', tracks=tracks_key, engine=msd_engine)
+    msd_table = cache.load(input_hash, 'msd', msd_key)
+    if msd_table is None:
+        with optional_stage(report, 'msd'):
+            msd_table = calculate.compute_msd_table(tracks_data, msd_engine, progress)
+        cache.store(input_hash, 'msd', msd_key, msd_table)
+    else:
+        print("Cache: MSD-Kurven geladen")
+        if report:
+            report.count('cache_hits')
+
+    fit_key = cache.key(stage='fit', msd=msd_key, frame_interval=frame_interval, weighted_fit=weighted_fit)
+    fits = cache.load(input_hash, 'fit', fit_key)
+    if fits is None:
+        with optional_stage(report, 'fit'):
+            fits = calculate.fit_msd_table(msd_table, frame_interval, weighted_fit)
+        cache.store(input_hash, 'fit', fit_key, fits)
+    else:
+        print("Cache: Fits geladen")
+        if report:
+            report.count('cache_hits')
+
+    # Bootstrap intervals are only reproducible with a fixed seed, so unseeded runs are not cached
+    if bootstrap:
+        bootstrap_key = cache.key(stage='bootstrap', fit=fit_key, n=bootstrap, seed=seed)
+        intervals = cache.load(input_hash, 'bootstrap', bootstrap_key) if seed is not None else None
+        if intervals is None:
+            with optional_stage(report, 'bootstrap'):
+                intervals = calculate.bootstrap_msd_table(msd_table, frame_interval, bootstrap, seed, weighted_fit,
+                                                          bootstrap_workers, progress=progress, mp_context=mp_context)
+            if seed is not None:
+                cache.store(input_hash, 'bootstrap', bootstrap_key, intervals)
+        else:
+            print("Cache: Bootstrap-Intervalle geladen")
+            if report:
+                report.count('cache_hits')
+        fits = {**fits, **intervals}
+
+    with optional_stage(report, 'select'):
+        output_df, msd_data, valid_clusters = calculate.select_diffusion_results(
+            msd_table, fits, r_squared_threshold, min_duration, frame_interval, report)
+    return tracks_data, msd_table, fits, output_df, msd_data, valid_clusters
+
+def main():
+    parser = argparse.ArgumentParser(description="Ergebnis-Cache der Diffusionsanalyse verwalten.")
+    parser.add_argument('command', choices=['info', 'clear'])
+    parser.add_argument('--input', help="Nur Einträge dieser Eingabedatei löschen")
+    parser.add_argument('--cache-dir', default=None, help=f"Cache-Ordner (Standard: {DEFAULT_CACHE_DIR})")
+    args = parser.parse_args()
+
+    cache = ResultCache(args.cache_dir)
+    if args.command == 'clear':
+        removed = cache.clear(args.input)
+        print(f"{removed} Cache-Einträge gelöscht ({cache.cache_dir})")
+    else:
+        entries = cache.entries()
+        total = sum(size for _, size, _ in entries)
+        print(f"{cache.cache_dir}: {len(entries)} Einträge, {total / 1024 ** 2:.1f} MB (Maximum {cache.max_bytes / 1024 ** 2:.0f} MB)")
+
+if __name__ == "__main__":
+    main()
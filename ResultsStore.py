@@ -0,0 +1,242 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+# Appendable results store for one experiment, a folder with
+#   index.csv        one line per chunk: Chunk, Run, Condition, Cell, Tracks, Accepted
+#   chunks/*.npz     per-track metadata, fit parameters, acceptance and the MSD curves
+#                    (flat, with per-track offsets) of up to chunk_tracks tracks of one cell
+#   runs/<Run>.json  condition, cell and analysis parameters of every run
+# Writers only create new files and append single lines to the index, so several batch
+# processes can add cells to the same store. Analysing a cell again adds a new run; readers
+# use the latest run of every condition and cell. Readers select chunks from the index by condition and
+# cell, so only the needed chunks are loaded.
+
+INDEX_FILE_NAME = 'index.csv'
+INDEX_COLUMNS = ['Chunk', 'Run', 'Condition', 'Cell', 'Tracks', 'Accepted']
+DEFAULT_CONDITION = 'Alle'
+DEFAULT_CHUNK_TRACKS = 10000
+STORE_VERSION = 1
+
+# Per-track arrays of a chunk and their column names when read as a table
+TRACK_COLUMNS = {
+    'track_ids': 'Cluster',
+    'lengths': 'Length',
+    'mean_sizes': 'Average Cluster Size',
+    'D': 'Diffusion Coefficient',
+    'alpha': 'Alpha',
+    'r_squared': 'R_squared',
+    'fit_range': 'Fit Points',
+    'accepted': 'Accepted',
+    # only present after --bootstrap
+    'D_ci_low': 'D CI Low',
+    'D_ci_high': 'D CI High',
+    'alpha_ci_low': 'Alpha CI Low',
+    'alpha_ci_high': 'Alpha CI High',
+}
+
+class ResultsStore:
+    def __init__(self, path):
+        self.path = path
+        self.chunk_counts = {}
+
+    @staticmethod
+    def is_store(path):
+        return os.path.isfile(os.path.join(path, INDEX_FILE_NAME))
+
+    def create(self):
+        os.makedirs(os.path.join(self.path, 'chunks'), exist_ok=True)
+        os.makedirs(os.path.join(self.path, 'runs'), exist_ok=True)
+        try:
+            with open(os.path.join(self.path, INDEX_FILE_NAME), 'x', encoding='utf-8') as f:
+                f.write(','.join(INDEX_COLUMNS) + '\n')
+        except FileExistsError:
+            pass
+
+    def begin_run(self, condition, cell, parameters=None):
+        self.create()
+        run = time.time_ns()
+        _write_atomic(os.path.join(self.path, 'runs', f'{run}.json'), json.dumps({
+            'Run': run, 'Condition': condition, 'Cell': cell, 'Version': STORE_VERSION,
+            'Created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'Parameters': parameters or {},
+        }, indent=2, default=str))
+        return run
+
+    def append(self, run, condition, cell, arrays):
+        # One chunk: written completely before its index line, so readers never see half a chunk
+        chunk_number = self.chunk_counts.get(run, 0)
+        self.chunk_counts[run] = chunk_number + 1
+        chunk = f'{run}-{chunk_number:05d}.npz'
+        path = os.path.join(self.path, 'chunks', chunk)
+        temporary_path = f'{path}.{os.getpid()}.tmp.npz'
+        np.savez(temporary_path, **arrays)
+        os.replace(temporary_path, path)
+        line = pd.DataFrame([[chunk, run, condition, cell, len(arrays['track_ids']), int(arrays['accepted'].sum())]],
+                            columns=INDEX_COLUMNS).to_csv(header=False, index=False)
+        # A single append of one short line is not interleaved with other writers
+        with open(os.path.join(self.path, INDEX_FILE_NAME), 'a', encoding='utf-8') as f:
+            f.write(line)
+
+    def index(self, conditions=None, cells=None, latest=True):
+        index = pd.read_csv(os.path.join(self.path, INDEX_FILE_NAME), keep_default_na=False,
+                            dtype={'Chunk': str, 'Run': np.int64, 'Condition': str, 'Cell': str})
+        if latest:
+            index = index[_latest(index)]
+        if conditions is not None:
+            index = index[index['Condition'].isin(list(conditions))]
+        if cells is not None:
+            index = index[index['Cell'].isin(list(cells))]
+        return index.reset_index(drop=True)
+
+    def load_chunk(self, chunk, names=None):
+        with np.load(os.path.join(self.path, 'chunks', chunk), allow_pickle=False) as stored:
+            return {name: stored[name] for name in stored.files if names is None or name in names}
+
+    def read_tracks(self, conditions=None, cells=None, accepted_only=True):
+        # Track table (without MSD curves) of the selected cells
+        tables = []
+        for entry in self.index(conditions, cells).itertuples():
+            arrays = self.load_chunk(entry.Chunk, TRACK_COLUMNS)
+            table = pd.DataFrame({column: arrays[name] for name, column in TRACK_COLUMNS.items() if name in arrays})
+            if accepted_only:
+                table = table[table['Accepted']]
+            tables.append(table.assign(Condition=entry.Condition, Cell=entry.Cell))
+        if not tables:
+            return pd.DataFrame(columns=['Cluster', 'Average Cluster Size', 'Diffusion Coefficient', 'Alpha',
+                                         'R_squared', 'Condition', 'Cell'])
+        return pd.concat(tables, ignore_index=True)
+
+    def read_msd(self, conditions=None, cells=None, accepted_only=True):
+        # One chunk at a time: (condition, cell, frame interval, track IDs, n_lags, MSD curves
+        # padded with NaN to the longest curve of the chunk)
+        for entry in self.index(conditions, cells).itertuples():
+            arrays = self.load_chunk(entry.Chunk)
+            n_lags = np.diff(arrays['msd_offsets'])
+            selected = arrays['accepted'] if accepted_only else np.ones(len(n_lags), dtype=bool)
+            lag_numbers = np.arange(n_lags[selected].max() if selected.any() else 0)
+            curves = np.full((int(selected.sum()), len(lag_numbers)), np.nan)
+            mask = lag_numbers < n_lags[selected][:, None]
+            curves[mask] = arrays['msd'][(arrays['msd_offsets'][:-1][selected][:, None] + lag_numbers)[mask]]
+            yield (entry.Condition, entry.Cell, float(arrays['frame_interval']), arrays['track_ids'][selected],
+                   n_lags[selected], curves)
+
+    def msd_table(self, conditions=None, cells=None, accepted_only=True):
+        # Long format: one row per track and lag
+        tables = []
+        for condition, cell, frame_interval, track_ids, n_lags, curves in self.read_msd(conditions, cells, accepted_only):
+            mask = np.arange(curves.shape[1]) < n_lags[:, None]
+            tables.append(pd.DataFrame({
+                'Condition': condition,
+                'Cell': cell,
+                'Cluster': np.repeat(track_ids, n_lags),
+                'Lag Time': (np.nonzero(mask)[1] + 1) * frame_interval,
+                'MSD': curves[mask],
+            }))
+        return pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(
+            columns=['Condition', 'Cell', 'Cluster', 'Lag Time', 'MSD'])
+
+    def runs(self):
+        records = []
+        runs_folder = os.path.join(self.path, 'runs')
+        for name in sorted(os.listdir(runs_folder)) if os.path.isdir(runs_folder) else []:
+            with open(os.path.join(runs_folder, name), encoding='utf-8') as f:
+                run = json.load(f)
+            records.append({'Run': run['Run'], 'Condition': run['Condition'], 'Cell': run['Cell'],
+                            'Created': run['Created'], **run['Parameters']})
+        return pd.DataFrame(records)
+
+    def compact(self):
+        # Deletes the chunks and run files of superseded runs; only while no one writes to the store
+        index = self.index(latest=False)
+        current = _latest(index)
+        for chunk in index.loc[~current, 'Chunk']:
+            os.remove(os.path.join(self.path, 'chunks', chunk))
+        for run in set(index.loc[~current, 'Run']) - set(index.loc[current, 'Run']):
+            run_path = os.path.join(self.path, 'runs', f'{run}.json')
+            if os.path.exists(run_path):
+                os.remove(run_path)
+        _write_atomic(os.path.join(self.path, INDEX_FILE_NAME), index[current].to_csv(index=False))
+        return int((~current).sum())
+
+def _latest(index):
+    # Chunks of the newest run per condition and cell; equal cell names in different conditions stay separate
+    return index['Run'] == index.groupby(['Condition', 'Cell'])['Run'].transform('max')
+
+def _write_atomic(path, text):
+    temporary_path = f'{path}.{os.getpid()}.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(temporary_path, path)
+
+def write_diffusion_results(store, msd_table, fits, r_squared_threshold, min_duration, frame_interval,
+                            condition=DEFAULT_CONDITION, cell='', parameters=None, chunk_tracks=DEFAULT_CHUNK_TRACKS):
+    # All tracks of one analysed cell, chunk by chunk: only one chunk of flat MSD curves is
+    # built at a time. Tracks without a fit keep NaN fit values and no MSD curve.
+    from CalculateDWithFlexibleAlphaGUI import accepted_msd_rows
+
+    run = store.begin_run(condition, cell, parameters)
+    fittable = msd_table['fittable']
+    msd_curves = msd_table['msd_curves']
+    n_tracks = len(msd_table['track_ids'])
+    fit_row = np.full(n_tracks, -1, dtype=np.int64)
+    fit_row[fittable] = np.arange(len(fittable))
+    accepted = np.zeros(n_tracks, dtype=bool)
+    accepted[fittable[accepted_msd_rows(msd_table, fits, r_squared_threshold, min_duration)]] = True
+
+    for start in range(0, max(n_tracks, 1), chunk_tracks):
+        tracks = slice(start, min(start + chunk_tracks, n_tracks))
+        rows = fit_row[tracks]
+        has_fit = rows >= 0
+        n_lags = np.where(has_fit, msd_table['n_lags'][tracks], 0)
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(n_lags, out=offsets[1:])
+        curves = msd_curves[rows[has_fit]]
+        arrays = {
+            'track_ids': np.asarray(msd_table['track_ids'][tracks]).astype(str),
+            'lengths': msd_table['lengths'][tracks],
+            'mean_sizes': msd_table['mean_sizes'][tracks],
+            'fit_range': np.where(has_fit, msd_table['fit_range'][tracks], 0),
+            'accepted': accepted[tracks],
+            'msd_offsets': offsets,
+            'msd': curves[np.arange(curves.shape[1]) < n_lags[has_fit][:, None]],
+            'frame_interval': np.float64(frame_interval),
+        }
+        for name in ('D', 'alpha', 'r_squared', 'D_ci_low', 'D_ci_high', 'alpha_ci_low', 'alpha_ci_high'):
+            if name in fits:
+                values = np.full(len(rows), np.nan)
+                values[has_fit] = fits[name][rows[has_fit]]
+                arrays[name] = values
+        store.append(run, condition, cell, arrays)
+    print(f"{n_tracks} Tracks ({int(accepted.sum())} gültig) in {store.path} gespeichert ({condition} / {cell})")
+    return run
+
+def main():
+    parser = argparse.ArgumentParser(description="Inhalt eines Ergebnisspeichers anzeigen oder exportieren.")
+    parser.add_argument('store', help="Ordner des Ergebnisspeichers")
+    parser.add_argument('--condition', action='append', default=None, help="Nur diese Bedingung (mehrfach möglich)")
+    parser.add_argument('--cell', action='append', default=None, help="Nur diese Zelle (mehrfach möglich)")
+    parser.add_argument('--all-tracks', action='store_true', help="Auch verworfene Tracks ausgeben")
+    parser.add_argument('--export-tracks', metavar='CSV', help="Tracktabelle als CSV speichern")
+    parser.add_argument('--export-msd', metavar='CSV', help="MSD-Kurven (eine Zeile pro Track und Lag) als CSV speichern")
+    parser.add_argument('--compact', action='store_true', help="Ergebnisse überholter Läufe löschen")
+    args = parser.parse_args()
+
+    store = ResultsStore(args.store)
+    if not ResultsStore.is_store(args.store):
+        parser.error(f"Kein Ergebnisspeicher: {args.store}")
+    if args.compact:
+        print(f"{store.compact()} überholte Chunks gelöscht")
+    index = store.index(args.condition, args.cell)
+    print(index.groupby(['Condition', 'Cell'], sort=False)[['Tracks', 'Accepted']].sum().to_string())
+    if args.export_tracks:
+        store.read_tracks(args.condition, args.cell, not args.all_tracks).to_csv(args.export_tracks, index=False)
+        print(f"Tracks gespeichert: {args.export_tracks}")
+    if args.export_msd:
+        store.msd_table(args.condition, args.cell, not args.all_tracks).to_csv(args.export_msd, index=False)
+        print(f"MSD-Kurven gespeichert: {args.export_msd}")
+
+if __name__ == "__main__":
+    main()
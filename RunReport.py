@@ -0,0 +1,178 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS
+    resource = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: reports are merged without a lock
+    fcntl = None
+
+# Stage timings and counters of one analysis run. Every script adds its own
+# section to run_report.json in its output folder, so CalculateD and LowvsHigh
+# writing into the same folder keep both reports.
+
+REPORT_FILE_NAME = 'run_report.json'
+LOCK_FILE_NAME = '.run_report.lock'
+
+def peak_rss_mb():
+    # High-water mark of the resident set size of this process so far
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024, 1)
+
+def current_rss_mb():
+    # Resident set size right now (Linux only, None elsewhere)
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(pages * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2, 1)
+
+class RssSampler:
+    # Polls the current RSS in a background thread while stages are open; every open stage
+    # keeps its own maximum, so nested stages and stages after a large one are measured apart
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.open = []
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        peak = {'mb': current_rss_mb()}
+        if peak['mb'] is None:
+            return peak
+        with self.lock:
+            self.open.append(peak)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        return peak
+
+    def stop(self, peak):
+        rss = current_rss_mb()
+        with self.lock:
+            if peak in self.open:
+                self.open.remove(peak)
+        if rss is None or peak['mb'] is None:
+            return None
+        return max(peak['mb'], rss)
+
+    def _run(self):
+        while True:
+            with self.lock:
+                if not self.open:
+                    self.thread = None
+                    return
+                rss = current_rss_mb()
+                for peak in self.open:
+                    peak['mb'] = max(peak['mb'], rss)
+            time.sleep(self.interval)
+
+def cpu_seconds():
+    # User + system time of this process and of finished child processes (plot pools)
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+class RunReport:
+    def __init__(self, script, output_folder, parameters=None, profile=False):
+        self.script = script
+        self.output_folder = output_folder
+        self.parameters = parameters or {}
+        self.stages = []
+        self.counters = {}
+        self.profiler = cProfile.Profile() if profile else None
+        self.rss = RssSampler()
+
+    @contextmanager
+    def stage(self, name):
+        wall, cpu = time.perf_counter(), cpu_seconds()
+        process_peak, rss = peak_rss_mb(), self.rss.start()
+        entry = {'stage': name, 'rss_start_mb': rss['mb']}
+        try:
+            yield
+        except BaseException as e:
+            entry['error'] = f'{type(e).__name__}: {e}'
+            raise
+        finally:
+            entry['wall_seconds'] = round(time.perf_counter() - wall, 4)
+            entry['cpu_seconds'] = round(cpu_seconds() - cpu, 4)
+            # Peak RSS of this stage: the sampled maximum, or the process high-water mark if
+            # that was raised during the stage (catches short spikes between two samples)
+            stage_peak = self.rss.stop(rss)
+            if process_peak is not None and peak_rss_mb() > process_peak:
+                stage_peak = max(stage_peak or 0, peak_rss_mb())
+            entry['peak_rss_mb'] = stage_peak
+            self.stages.append(entry)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    @contextmanager
+    def run(self):
+        # Whole run: total time, optional cProfile dump, report written even if a stage fails
+        try:
+            with self.stage('total'):
+                if self.profiler:
+                    self.profiler.enable()
+                try:
+                    yield self
+                finally:
+                    if self.profiler:
+                        self.profiler.disable()
+        finally:
+            self.write()
+
+    def to_dict(self):
+        return {
+            'finished': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'parameters': self.parameters,
+            'stages': self.stages,
+            'counters': self.counters,
+        }
+
+    def write(self):
+        # Several scripts may finish into the same folder at once (batch, watcher): the merge runs
+        # under a lock, and the file is replaced atomically so readers never see half a report
+        os.makedirs(self.output_folder, exist_ok=True)
+        path = os.path.join(self.output_folder, REPORT_FILE_NAME)
+        with open(os.path.join(self.output_folder, LOCK_FILE_NAME), 'a') as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            report = {}
+            if os.path.exists(path):
+                try:
+                    with open(path, encoding='utf-8') as f:
+                        report = json.load(f)
+                except (OSError, ValueError):
+                    report = {}
+            report[self.script] = self.to_dict()
+            temporary_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(temporary_path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, default=str)
+            os.replace(temporary_path, path)
+
+        if self.profiler:
+            profile_path = os.path.join(self.output_folder, f'{self.script}.prof')
+            self.profiler.dump_stats(profile_path)
+            print(f"Profil gespeichert: {profile_path} (auswerten mit python -m pstats)")
+        return path
+
+@contextmanager
+def optional_stage(report, name):
+    # report.stage(name) for callers that may run without a report
+    if report is None:
+        yield
+    else:
+        with report.stage(name):
+            yield
@@ -0,0 +1,331 @@
+import os
+import sys
+import json
+import time
+import signal
+import fnmatch
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+# Long-running watcher for a folder the microscope writes into. New or changed files are
+# detected by polling (works on network mounts without file system events), processed on a
+# bounded process pool and recorded in a state file, so a restarted watcher skips them.
+# MosaicResults CSVs run through CalculateDWithFlexibleAlphaGUI, intensity TIFFs through
+# GetIntsGUI and classified TIFFs (name contains "classified") through PlotIntsGUI, the latter
+# only with the instrument calibration (laser power, gain, bleaching step height) given. The
+# combined LowvsHighGUI aggregate is updated with every finished cell.
+
+STATE_FILE_NAME = 'watch_state.json'
+AGGREGATE_FOLDER_NAME = 'Aggregate'
+DEFAULT_CONDITION = 'Alle'
+MANIFEST_FILE_NAME = 'conditions.csv'  # as in LowvsHighGUI, never analysed as MosaicResults
+
+def file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def file_kind(path):
+    name = os.path.basename(path).lower()
+    if name.endswith('.csv'):
+        return 'diffusion'
+    if name.endswith(('.tif', '.tiff')):
+        return 'concentration' if 'classified' in name else 'intensity'
+    return None
+
+def cell_name(watch_folder, path):
+    # Relative path without extension; classified stacks share the name of their intensity stack
+    relative = os.path.splitext(os.path.relpath(path, watch_folder))[0]
+    folder, name = os.path.split(relative)
+    if file_kind(path) == 'concentration':
+        index = name.lower().find('classified')
+        name = (name[:index] + name[index + len('classified'):]).strip(' _-') or name
+    return os.path.join(folder, name)
+
+def scan(watch_folder, output_root, patterns):
+    # All input files below watch_folder, except the watcher's own output and condition manifests
+    output_root = os.path.abspath(output_root)
+    found = []
+    for folder, subfolders, files in os.walk(watch_folder):
+        subfolders[:] = sorted(d for d in subfolders if os.path.abspath(os.path.join(folder, d)) != output_root)
+        for name in sorted(files):
+            path = os.path.join(folder, name)
+            if name == MANIFEST_FILE_NAME:
+                continue
+            if file_kind(path) and any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+                found.append(path)
+    return found
+
+def load_state(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def save_state(state, path):
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(temporary_path, path)
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+
+def process_file(kind, path, output_folder, parameters):
+    # Runs in a worker process; errors are returned, not raised, so one bad file does not stop the watcher
+    import io
+    from contextlib import redirect_stdout
+
+    start = time.perf_counter()
+    result = {'Kind': kind, 'File': path, 'Output Folder': output_folder, 'Status': 'ok', 'Error': ''}
+    try:
+        if kind == 'diffusion':
+            import BatchAnalysis
+            batch_result = BatchAnalysis.analyze_file(path, output_folder, parameters['diffusion'])
+            result.update(Status=batch_result['Status'], Error=batch_result['Error'])
+        else:
+            with redirect_stdout(io.StringIO()):
+                if kind == 'intensity':
+                    import GetIntsGUI
+                    GetIntsGUI.extract_intensities(path, output_folder)
+                else:
+                    import PlotIntsGUI
+                    PlotIntsGUI.analyze_concentration_per_cluster_and_background(
+                        output_folder, path, show=False, **parameters['concentration'])
+    except Exception as e:
+        result['Status'] = 'error'
+        result['Error'] = f'{type(e).__name__}: {e}'
+        traceback.print_exc()
+    result['Seconds'] = round(time.perf_counter() - start, 3)
+    return result
+
+class IncrementalAggregate:
+    # LowvsHighGUI results of all finished cells, kept in memory. A finished cell reads only
+    # its own result files; summary and plots are then rewritten from the in-memory tables.
+    def __init__(self, output_folder, conditions=None):
+        self.output_folder = output_folder
+        self.conditions = conditions or {}
+        self.cells = {}
+
+    def condition(self, cell):
+        # Manifest entry, else the first subfolder below the watch folder
+        if cell in self.conditions:
+            return self.conditions[cell]
+        parts = cell.replace('\\', '/').split('/')
+        return parts[0] if len(parts) > 1 else DEFAULT_CONDITION
+
+    def add(self, cell, result_folder):
+        import pandas as pd
+        import LowvsHighGUI
+        from CalculateDWithFlexibleAlphaGUI import ENSEMBLE_MSD_FILE_NAME
+
+        result_path = os.path.join(result_folder, LowvsHighGUI.RESULT_SUFFIX)
+        if not os.path.exists(result_path):
+            return False
+        ensemble_path = os.path.join(result_folder, ENSEMBLE_MSD_FILE_NAME)
+        self.cells[cell] = (self.condition(cell), LowvsHighGUI.read_result_file(result_path),
+                            pd.read_csv(ensemble_path) if os.path.exists(ensemble_path) else None)
+        return True
+
+    def write(self):
+        import io
+        from contextlib import redirect_stdout
+        import LowvsHighGUI
+
+        if not self.cells:
+            return
+        cells = sorted(self.cells)
+        conditions = [self.cells[cell][0] for cell in cells]
+        with redirect_stdout(io.StringIO()):
+            df, cell_counts, cluster_counts = LowvsHighGUI.combine_results(
+                [self.cells[cell][1] for cell in cells], conditions, cells)
+            ensembles = LowvsHighGUI.pool_condition_ensembles([self.cells[cell][2] for cell in cells], conditions)
+            LowvsHighGUI.write_aggregate(df, cell_counts, cluster_counts, ensembles, self.output_folder)
+        print(f"Aggregat aktualisiert: {len(cells)} Zellen, {len(cell_counts)} Bedingungen -> {self.output_folder}")
+
+def read_conditions(manifest_path, watch_folder):
+    # Manifest with the columns File and Condition; File relative to the watch folder
+    import pandas as pd
+
+    manifest = pd.read_csv(manifest_path, dtype=str)
+    return {cell_name(watch_folder, os.path.join(watch_folder, path)): condition
+            for path, condition in zip(manifest['File'], manifest['Condition'])}
+
+def watch(watch_folder, output_root=None, diffusion_parameters=None, concentration_parameters=None, workers=None,
+          interval=10.0, patterns=('*.csv', '*.tif', '*.tiff'), manifest=None, once=False, mp_context=None):
+    # Poll loop. A file is queued once its size and modification time are unchanged between two
+    # polls (the microscope may still be writing it) and differ from the last processed version.
+    # mp_context as in BatchAnalysis.run_batch.
+    output_root = output_root or os.path.join(watch_folder, 'Graphen')
+    os.makedirs(output_root, exist_ok=True)
+    state_path = os.path.join(output_root, STATE_FILE_NAME)
+    state = load_state(state_path)
+    workers = workers or os.cpu_count() or 1
+    parameters = {'diffusion': diffusion_parameters or {}, 'concentration': concentration_parameters or {}}
+    # Concentrations in nM need the calibration of the instrument; there are no sensible defaults
+    calibrated = all(parameters['concentration'].get(name) is not None
+                     for name in ('laser_power', 'gain', 'bleaching_step_height'))
+
+    conditions = read_conditions(manifest, watch_folder) if manifest else {}
+    aggregate = IncrementalAggregate(os.path.join(output_root, AGGREGATE_FOLDER_NAME), conditions)
+    for path, entry in state.items():
+        if entry['Kind'] == 'diffusion' and entry['Status'] == 'ok':
+            aggregate.add(cell_name(watch_folder, path), entry['Output Folder'])
+    aggregate.write()
+
+    seen = {}
+    running = {}
+    waiting_reported = set()
+
+    def new_executor():
+        return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, mp_context=mp_context)
+
+    def finish(future):
+        # Records a finished job in the state; returns (aggregate changed, pool broken)
+        path, signature, cell = running.pop(future)
+        broken = False
+        try:
+            result = future.result()
+        except BrokenProcessPool:
+            result = {'Kind': file_kind(path), 'File': path, 'Output Folder': os.path.join(output_root, cell),
+                      'Status': 'error', 'Error': 'BrokenProcessPool: Prozess abgebrochen (z.B. zu wenig Speicher)',
+                      'Seconds': 0.0}
+            broken = True
+        state[path] = {'Signature': signature, **result}
+        save_state(state, state_path)
+        if result['Status'] != 'ok':
+            print(f"Fehler bei {path}: {result['Error']}", flush=True)
+            return False, broken
+        print(f"Fertig ({result['Seconds']:.1f} s): {path}", flush=True)
+        return result['Kind'] == 'diffusion' and aggregate.add(cell, result['Output Folder']), broken
+
+    def replace_executor(executor):
+        # A worker died (out of memory, crash): the pool is unusable and all of its jobs fail.
+        # After shutdown every job is resolved; record them and keep watching on a new pool.
+        print("Ein Prozess wurde abgebrochen, starte neue Prozesse", flush=True)
+        executor.shutdown(wait=True, cancel_futures=True)
+        updated = False
+        for future in list(running):
+            updated = finish(future)[0] or updated
+        if updated:
+            aggregate.write()
+        return new_executor()
+
+    executor = new_executor()
+    print(f"Überwache {watch_folder} (alle {interval:g} s, {workers} Prozesse, Ausgabe: {output_root})", flush=True)
+    try:
+        while True:
+            # Collect new or changed files that have been stable for one poll
+            ready = []
+            unstable = 0
+            busy = {task[0] for task in running.values()}
+            for path in scan(watch_folder, output_root, patterns):
+                try:
+                    signature = file_signature(path)
+                except OSError:
+                    continue
+                if path in busy or state.get(path, {}).get('Signature') == signature:
+                    continue
+                if seen.get(path) != signature:
+                    seen[path] = signature
+                    unstable += 1
+                    continue
+                ready.append((path, signature))
+
+            # Bounded pool: at most `workers` jobs run, the rest waits for the next poll
+            blocked = 0
+            for path, signature in ready:
+                if len(running) >= workers:
+                    break
+                kind = file_kind(path)
+                cell = cell_name(watch_folder, path)
+                output_folder = os.path.join(output_root, cell)
+                if kind == 'concentration' and not calibrated:
+                    if path not in waiting_reported:
+                        print(f"Überspringe {path}: Konzentrationen brauchen --laser-power, --gain und "
+                              f"--bleaching-step-height", flush=True)
+                        waiting_reported.add(path)
+                    blocked += 1
+                    continue
+                if kind == 'concentration' and not os.path.exists(os.path.join(output_folder, 'Int.json')):
+                    # The intensity stack of this cell has not been extracted yet
+                    if path not in waiting_reported:
+                        print(f"Warte auf Intensitäten für {path}", flush=True)
+                        waiting_reported.add(path)
+                    blocked += 1
+                    continue
+                print(f"Starte {kind}: {path}", flush=True)
+                try:
+                    future = executor.submit(process_file, kind, path, output_folder, parameters)
+                except BrokenProcessPool:
+                    # The pool broke after the last wait (or while idle)
+                    executor = replace_executor(executor)
+                    future = executor.submit(process_file, kind, path, output_folder, parameters)
+                running[future] = (path, signature, cell)
+
+            if running:
+                done, _ = wait(list(running), timeout=interval, return_when=FIRST_COMPLETED)
+                updated = broken = False
+                for future in done:
+                    changed, failed = finish(future)
+                    updated, broken = updated or changed, broken or failed
+                if updated:
+                    aggregate.write()
+                if broken:
+                    executor = replace_executor(executor)
+                continue
+            # --once: stop when nothing runs, nothing is still being written and only files
+            # waiting for a missing intensity stack or calibration are left
+            if once and not unstable and len(ready) == blocked:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("Beende Überwachung...")
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        save_state(state, state_path)
+    return state
+
+def _stop(signum, frame):
+    raise KeyboardInterrupt
+
+def main():
+    parser = argparse.ArgumentParser(description="Ordner überwachen und neue MosaicResults/TIF-Stapel automatisch auswerten.")
+    parser.add_argument('watch_folder')
+    parser.add_argument('--output-root', help="Ausgabeordner (Standard: <watch_folder>/Graphen)")
+    parser.add_argument('--interval', type=float, default=10.0, help="Sekunden zwischen zwei Durchläufen")
+    parser.add_argument('--workers', type=int, default=None, help="Anzahl paralleler Prozesse (Standard: alle Kerne)")
+    parser.add_argument('--pattern', action='append', default=None,
+                        help="Dateimuster (mehrfach möglich, Standard: *.csv, *.tif, *.tiff)")
+    parser.add_argument('--manifest', help="CSV mit File und Condition (Pfade relativ zum überwachten Ordner)")
+    parser.add_argument('--once', action='store_true', help="Vorhandene Dateien auswerten und beenden")
+    parser.add_argument('--r-squared-threshold', type=float, default=0.9)
+    parser.add_argument('--min-duration', type=int, default=30)
+    parser.add_argument('--frame-interval', type=int, default=10)
+    parser.add_argument('--msd-plots', choices=['single', 'sheet', 'none'], default='sheet')
+    parser.add_argument('--laser-power', type=float, default=None,
+                        help="Laserleistung für PlotIntsGUI (ohne die drei Kalibrierwerte werden Classified-Stapel übersprungen)")
+    parser.add_argument('--gain', type=float, default=None, help="Gain für PlotIntsGUI")
+    parser.add_argument('--bleaching-step-height', type=float, default=None, help="Bleaching-Stufenhöhe für PlotIntsGUI")
+    args = parser.parse_args()
+
+    calibration = (args.laser_power, args.gain, args.bleaching_step_height)
+    if any(value is not None for value in calibration) and None in calibration:
+        parser.error("--laser-power, --gain und --bleaching-step-height nur zusammen angeben")
+    if not os.path.isdir(args.watch_folder):
+        print(f"Ordner nicht gefunden: {args.watch_folder}")
+        sys.exit(1)
+    # Stopping the service (SIGTERM) ends the watcher like Ctrl+C: running jobs finish, state is saved
+    signal.signal(signal.SIGTERM, _stop)
+    watch(args.watch_folder, args.output_root,
+          diffusion_parameters=dict(r_squared_threshold=args.r_squared_threshold, min_duration=args.min_duration,
+                                    frame_interval=args.frame_interval, msd_plots=args.msd_plots),
+          concentration_parameters=dict(laser_power=args.laser_power, gain=args.gain,
+                                        bleaching_step_height=args.bleaching_step_height),
+          workers=args.workers, interval=args.interval, patterns=args.pattern or ('*.csv', '*.tif', '*.tiff'),
+          manifest=args.manifest, once=args.once)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import matplotlib
+matplotlib.use('Agg')
+
+import SyntheticData
+import CalculateDWithFlexibleAlphaGUI as calculate
+import GetIntsGUI
+import PlotIntsGUI
+import LowvsHighGUI
+
+# Times every stage of the analysis scripts on synthetic data of growing size and
+# writes the results as JSON. `--compare old.json` prints the ratio to an earlier run.
+
+def time_stage(results, size, stage, function, repeat=1):
+    # Runs function `repeat` times with its output suppressed and records the fastest run
+    timings = []
+    value = None
+    for _ in range(repeat):
+        with redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            value = function()
+            timings.append(time.perf_counter() - start)
+    results.append({'stage': stage, 'size': size, 'seconds': min(timings), 'runs': timings})
+    print(f"{stage:<28} {size:>8} {min(timings):10.4f} s")
+    return value
+
+def benchmark_diffusion(results, folder, size, repeat, track_length, msd_plot_limit=100):
+    tracks = SyntheticData.generate_tracks(size, track_length, seed=size)
+    csv_path = SyntheticData.write_mosaic_csv(tracks, os.path.join(folder, 'MosaicResults.csv'))
+    plot_folder = os.path.join(folder, 'Log(MSD)vsLog(LagTime)')
+    os.makedirs(plot_folder, exist_ok=True)
+
+    tracks_data = time_stage(results, size, 'calculate.ingest', lambda: calculate.load_tracks(csv_path), repeat)
+    time_stage(results, size, 'calculate.ingest_streaming',
+               lambda: calculate.load_tracks(csv_path, chunk_size=100000), repeat)
+    msd_table = time_stage(results, size, 'calculate.msd', lambda: calculate.compute_msd_table(tracks_data), repeat)
+    fits = time_stage(results, size, 'calculate.fit', lambda: calculate.fit_msd_table(msd_table, 10), repeat)
+    output_df, msd_data, valid_clusters = time_stage(
+        results, size, 'calculate.select',
+        lambda: calculate.select_diffusion_results(msd_table, fits, 0.9, 30, 10), repeat)
+    time_stage(results, size, 'calculate.plot_tracks',
+               lambda: calculate.plot_tracks(tracks_data, folder, 'tracks'), repeat)
+    # Rendering scales with the number of clusters, so only the first msd_plot_limit are drawn
+    time_stage(results, size, 'calculate.msd_plots_sheet',
+               lambda: calculate.render_msd_plots(msd_data[:msd_plot_limit], valid_clusters[:msd_plot_limit],
+                                                  plot_folder, mode='sheet'), repeat)
+    time_stage(results, size, 'calculate.alpha_histogram',
+               lambda: calculate.plot_and_fit_alphas(output_df, plot_folder), repeat)
+    return output_df
+
+def benchmark_aggregate(results, folder, output_df, size, repeat, n_cells=15):
+    # LowvsHighGUI expects one diffusion_coefficients.csv per cell in one folder
+    for cell in range(n_cells):
+        output_df.to_csv(os.path.join(folder, f'cell{cell:02d}_diffusion_coefficients.csv'), index=False)
+    loaded = time_stage(results, size, 'lowvshigh.load', lambda: LowvsHighGUI.load_results(folder), repeat)
+    time_stage(results, size, 'lowvshigh.plot', lambda: LowvsHighGUI.plot_results(*loaded, folder), repeat)
+
+def benchmark_intensities(results, folder, n_frames, repeat, image_size):
+    tracks = SyntheticData.generate_tracks(max(n_frames, 10), (max(n_frames // 2, 1), n_frames), image_size=image_size,
+                                           n_frames=n_frames, seed=n_frames)
+    classified_path, intensity_path = SyntheticData.write_tiff_stacks(tracks, folder, n_frames, image_size)
+    time_stage(results, n_frames, 'getints.extract_npy',
+               lambda: GetIntsGUI.extract_intensities(intensity_path, folder, frames='0'), repeat)
+    time_stage(results, n_frames, 'getints.extract_all_npy',
+               lambda: GetIntsGUI.extract_intensities(intensity_path, folder, frames='all'), repeat)
+    time_stage(results, n_frames, 'getints.extract_csv',
+               lambda: GetIntsGUI.extract_intensities(intensity_path, folder, frames='0', write_npy=False,
+                                                      write_csv=True), repeat)
+    with redirect_stdout(io.StringIO()):
+        GetIntsGUI.extract_intensities(intensity_path, folder, frames='0')
+    time_stage(results, n_frames, 'plotints.analyze',
+               lambda: PlotIntsGUI.analyze_concentration_per_cluster_and_background(
+                   folder, classified_path, 10, 50, 100, show=False), repeat)
+    time_stage(results, n_frames, 'plotints.analyze_streaming',
+               lambda: PlotIntsGUI.analyze_concentration_per_cluster_and_background(
+                   folder, classified_path, 10, 50, 100, chunk_size=16, show=False), repeat)
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+def compare(results, reference_path):
+    with open(reference_path) as f:
+        reference = {(entry['stage'], entry['size']): entry['seconds'] for entry in json.load(f)['results']}
+    print(f"\nVergleich mit {reference_path} (neu / alt):")
+    for entry in results:
+        old = reference.get((entry['stage'], entry['size']))
+        if old:
+            print(f"{entry['stage']:<28} {entry['size']:>8} {entry['seconds'] / old:8.2f}x")
+
+def parse_sizes(text):
+    return [int(value) for value in text.split(',') if value.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description="Laufzeiten aller Analyseschritte auf synthetischen Daten messen.")
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON-Datei mit den Ergebnissen")
+    parser.add_argument('--track-counts', default='100,1000,10000', help="Anzahl Tracks pro Größe (kommagetrennt)")
+    parser.add_argument('--track-length', type=int, nargs=2, default=(20, 200), metavar=('MIN', 'MAX'))
+    parser.add_argument('--tiff-frames', default='10,50', help="Frames der TIF-Stapel pro Größe (kommagetrennt)")
+    parser.add_argument('--image-size', type=int, default=512)
+    parser.add_argument('--msd-plot-limit', type=int, default=100, help="Höchstens so viele Cluster in den MSD-Plots")
+    parser.add_argument('--repeat', type=int, default=3, help="Wiederholungen pro Schritt (schnellste zählt)")
+    parser.add_argument('--stages', default='diffusion,aggregate,intensities',
+                        help="Auswahl aus diffusion, aggregate, intensities")
+    parser.add_argument('--compare', metavar='JSON', help="Ergebnisse mit einem früheren Lauf vergleichen")
+    parser.add_argument('--keep-data', metavar='DIR', help="Synthetische Daten in diesem Ordner behalten")
+    args = parser.parse_args()
+
+    stages = set(args.stages.split(','))
+    work_folder = args.keep_data or tempfile.mkdtemp(prefix='sct-benchmark-')
+    results = []
+    try:
+        if stages & {'diffusion', 'aggregate'}:
+            for size in parse_sizes(args.track_counts):
+                folder = os.path.join(work_folder, f'tracks_{size}')
+                os.makedirs(folder, exist_ok=True)
+                output_df = benchmark_diffusion(results, folder, size, args.repeat, tuple(args.track_length),
+                                                args.msd_plot_limit)
+                if 'aggregate' in stages:
+                    benchmark_aggregate(results, folder, output_df, size, args.repeat)
+        if 'intensities' in stages:
+            for n_frames in parse_sizes(args.tiff_frames):
+                folder = os.path.join(work_folder, f'frames_{n_frames}')
+                os.makedirs(folder, exist_ok=True)
+                benchmark_intensities(results, folder, n_frames, args.repeat, args.image_size)
+    finally:
+        if not args.keep_data:
+            shutil.rmtree(work_folder, ignore_errors=True)
+
+    report = {'environment': environment(), 'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Ergebnisse gespeichert: {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
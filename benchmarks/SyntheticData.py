@@ -0,0 +1,138 @@
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from CalculateDWithFlexibleAlphaGUI import PIXEL_SIZE
+
+# Synthetic test data shaped like the real inputs: MosaicResults CSVs with
+# fractional Brownian motion tracks (MSD = 4 D t^alpha), and classified /
+# intensity TIFF stacks for GetIntsGUI and PlotIntsGUI.
+
+MOSAIC_HEADER = ['', 'Trajectory', 'Frame', 'x', 'y', 'z', 'm0', 'm1', 'm2', 'm3', 'm4', 'NPscore']
+
+def fractional_gaussian_noise(n_tracks, n_steps, alpha, rng):
+    # Davies-Harte circulant embedding: (n_tracks, n_steps) increments with unit
+    # variance whose cumulative sum has a mean squared displacement of k^alpha
+    hurst = alpha / 2
+    k = np.arange(n_steps + 1)
+    autocovariance = 0.5 * (np.abs(k + 1) ** (2 * hurst) - 2 * k ** (2 * hurst) + np.abs(k - 1) ** (2 * hurst))
+    circulant = np.concatenate([autocovariance, autocovariance[-2:0:-1]])
+    eigenvalues = np.clip(np.fft.fft(circulant).real, 0, None)
+    m = len(circulant)
+    noise = rng.standard_normal((n_tracks, m)) + 1j * rng.standard_normal((n_tracks, m))
+    return np.fft.fft(np.sqrt(eigenvalues / m) * noise, axis=1).real[:, :n_steps]
+
+def generate_tracks(n_tracks=100, track_length=(20, 120), D=0.01, alpha=1.0, frame_interval=10,
+                    gap_rate=0.0, image_size=512, n_frames=None, seed=0):
+    # Long-format table (Trajectory, Frame, x, y, m0) in pixels. track_length is a
+    # fixed length or an inclusive (min, max) range; gap_rate drops that fraction of
+    # detections inside every track (first and last detection are kept).
+    rng = np.random.default_rng(seed)
+    low, high = (track_length, track_length) if np.isscalar(track_length) else track_length
+    lengths = rng.integers(low, high + 1, n_tracks)
+    n_frames = n_frames or int(lengths.max()) * 2
+    starts = rng.integers(0, max(n_frames - lengths.max(), 0) + 1, n_tracks)
+
+    # Displacements in µm: variance 2 D dt^alpha per axis and step
+    step_scale = np.sqrt(2 * D * frame_interval ** alpha) / PIXEL_SIZE
+    increments = fractional_gaussian_noise(2 * n_tracks, lengths.max() - 1, alpha, rng) * step_scale
+    positions = np.zeros((2 * n_tracks, lengths.max()))
+    np.cumsum(increments, axis=1, out=positions[:, 1:])
+    origins = rng.uniform(0.1 * image_size, 0.9 * image_size, 2 * n_tracks)
+    positions += origins[:, None]
+
+    track_index = np.repeat(np.arange(n_tracks), lengths)
+    step = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    keep = np.ones(len(step), dtype=bool)
+    if gap_rate > 0:
+        inner = (step > 0) & (step < lengths[track_index] - 1)
+        keep &= ~(inner & (rng.random(len(step)) < gap_rate))
+    track_index, step = track_index[keep], step[keep]
+
+    return pd.DataFrame({
+        'Trajectory': track_index + 1,
+        'Frame': starts[track_index] + step,
+        'x': positions[2 * track_index, step],
+        'y': positions[2 * track_index + 1, step],
+        'm0': rng.lognormal(np.log(15), 0.4, n_tracks)[track_index] * rng.uniform(0.8, 1.2, len(step)),
+    })
+
+def write_mosaic_csv(tracks, path):
+    n = len(tracks)
+    table = pd.DataFrame({
+        '': np.arange(n),
+        'Trajectory': tracks['Trajectory'].to_numpy(),
+        'Frame': tracks['Frame'].to_numpy(),
+        'x': tracks['x'].to_numpy(),
+        'y': tracks['y'].to_numpy(),
+        'z': np.zeros(n),
+        'm0': tracks['m0'].to_numpy(),
+        'm1': np.ones(n), 'm2': np.ones(n), 'm3': np.ones(n), 'm4': np.ones(n),
+        'NPscore': np.zeros(n),
+    }, columns=MOSAIC_HEADER)
+    table.to_csv(path, index=False)
+    return path
+
+def classified_stack(tracks, n_frames, image_size=512, cluster_radius=3, seed=0):
+    # Pixel classes as in PlotIntsGUI: 0 cluster, 1 cellular background (one
+    # elliptical cell), 2 non-cellular background
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:image_size, :image_size]
+    centre = image_size / 2
+    cell = ((xx - centre) / (0.45 * image_size)) ** 2 + ((yy - centre) / (0.35 * image_size)) ** 2 <= 1
+    stack = np.where(cell, 1, 2).astype(np.uint8)[None].repeat(n_frames, axis=0)
+
+    offsets = np.arange(-cluster_radius, cluster_radius + 1)
+    dy, dx = (d.ravel() for d in np.meshgrid(offsets, offsets, indexing='ij'))
+    disc = dx ** 2 + dy ** 2 <= cluster_radius ** 2
+    dy, dx = dy[disc], dx[disc]
+    visible = tracks[tracks['Frame'] < n_frames]
+    frame = np.repeat(visible['Frame'].to_numpy(), len(dx))
+    row = np.clip(np.rint(visible['y'].to_numpy())[:, None] + dy, 0, image_size - 1).astype(np.intp).ravel()
+    column = np.clip(np.rint(visible['x'].to_numpy())[:, None] + dx, 0, image_size - 1).astype(np.intp).ravel()
+    stack[frame, row, column] = 0
+
+    intensity = rng.normal(100, 10, (n_frames, image_size, image_size))
+    intensity += np.where(stack == 1, 200, 0) + np.where(stack == 0, 800, 0)
+    return stack, np.clip(intensity, 0, None).astype(np.uint16)
+
+def write_tiff_stacks(tracks, folder, n_frames, image_size=512, compression=None, seed=0):
+    import tifffile
+
+    os.makedirs(folder, exist_ok=True)
+    labels, intensity = classified_stack(tracks, n_frames, image_size, seed=seed)
+    classified_path = os.path.join(folder, 'classified.tif')
+    intensity_path = os.path.join(folder, 'intensity.tif')
+    tifffile.imwrite(classified_path, labels, compression=compression)
+    tifffile.imwrite(intensity_path, intensity, compression=compression)
+    return classified_path, intensity_path
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetische MosaicResults (fraktionale Brownsche Bewegung) und TIF-Stapel erzeugen.")
+    parser.add_argument('output_folder')
+    parser.add_argument('--tracks', type=int, default=100)
+    parser.add_argument('--min-length', type=int, default=20)
+    parser.add_argument('--max-length', type=int, default=120)
+    parser.add_argument('--D', type=float, default=0.01, help="Diffusionskoeffizient in µm²/s^alpha")
+    parser.add_argument('--alpha', type=float, default=1.0, help="Anomalie-Exponent (1 = Brownsche Bewegung)")
+    parser.add_argument('--frame-interval', type=float, default=10)
+    parser.add_argument('--gap-rate', type=float, default=0.0, help="Anteil fehlender Detektionen innerhalb der Tracks")
+    parser.add_argument('--image-size', type=int, default=512)
+    parser.add_argument('--tiff-frames', type=int, default=0, help="Frames der TIF-Stapel (0 = keine TIF-Dateien)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(args.output_folder, exist_ok=True)
+    tracks = generate_tracks(args.tracks, (args.min_length, args.max_length), args.D, args.alpha, args.frame_interval,
+                             args.gap_rate, args.image_size, seed=args.seed)
+    csv_path = write_mosaic_csv(tracks, os.path.join(args.output_folder, 'MosaicResults.csv'))
+    print(f"{args.tracks} Tracks ({len(tracks)} Detektionen) gespeichert: {csv_path}")
+    if args.tiff_frames:
+        paths = write_tiff_stacks(tracks, args.output_folder, args.tiff_frames, args.image_size, seed=args.seed)
+        print("TIF-Stapel gespeichert:", *paths)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+
+import BatchAnalysis
+
+
+def fake_analyze_file(input_file, output_folder, parameters):
+    # Stand-in for analyze_file: the worker dies on crash.csv, all other files succeed
+    if os.path.basename(input_file) == 'crash.csv':
+        os._exit(1)
+    return {'File': input_file, 'Output Folder': output_folder, 'Status': 'ok', 'Clusters': 1, 'Seconds': 0.0,
+            'Error': ''}
+
+
+class FlakyExecutor(ProcessPoolExecutor):
+    # The first pool reports itself broken on its second submit
+    instances = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        FlakyExecutor.instances += 1
+        self.first = FlakyExecutor.instances == 1
+        self.submitted = 0
+
+    def submit(self, *args, **kwargs):
+        self.submitted += 1
+        if self.first and self.submitted == 2:
+            raise BrokenProcessPool('simulated')
+        return super().submit(*args, **kwargs)
+
+
+def make_inputs(folder, names):
+    paths = []
+    for name in names:
+        path = folder / name
+        path.write_text('')
+        paths.append(str(path))
+    return paths
+
+
+def test_dying_worker_marks_only_its_file(tmp_path, monkeypatch):
+    input_files = make_inputs(tmp_path, ['a.csv', 'crash.csv', 'b.csv', 'c.csv'])
+    monkeypatch.setattr(BatchAnalysis, 'analyze_file', fake_analyze_file)
+
+    summary = BatchAnalysis.run_batch(input_files, 0.9, 30, 10, workers=2,
+                                      mp_context=multiprocessing.get_context('fork'))
+
+    status = dict(zip(summary['File'].map(os.path.basename), summary['Status']))
+    assert status == {'a.csv': 'ok', 'crash.csv': 'error', 'b.csv': 'ok', 'c.csv': 'ok'}
+    written = pd.read_csv(tmp_path / 'Graphen' / BatchAnalysis.SUMMARY_FILE_NAME)
+    assert len(written) == 4
+
+
+def test_broken_pool_during_submit_is_retried(tmp_path, monkeypatch):
+    input_files = make_inputs(tmp_path, ['a.csv', 'b.csv', 'c.csv'])
+    monkeypatch.setattr(BatchAnalysis, 'analyze_file', fake_analyze_file)
+    monkeypatch.setattr(BatchAnalysis, 'ProcessPoolExecutor', FlakyExecutor)
+    FlakyExecutor.instances = 0
+
+    summary = BatchAnalysis.run_batch(input_files, 0.9, 30, 10, workers=2,
+                                      mp_context=multiprocessing.get_context('fork'))
+
+    assert list(summary['Status']) == ['ok', 'ok', 'ok']
@@ -0,0 +1,64 @@
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from CalculateDWithFlexibleAlphaGUI import (TrackStore, bootstrap_msd_table, compute_msd_table, load_tracks,
+                                            parse_arguments, sliding_window_diffusion)
+
+MOSAIC_HEADER = ',Trajectory,Frame,x,y,z,m0\n'
+
+
+@pytest.mark.parametrize('chunk_size', [None, 1000])
+def test_header_only_file_gives_no_tracks(tmp_path, chunk_size):
+    input_file = tmp_path / 'MosaicResults.csv'
+    input_file.write_text(MOSAIC_HEADER)
+    tracks_data = load_tracks(str(input_file), chunk_size=chunk_size)
+    assert len(tracks_data) == 0
+    assert len(tracks_data.frame) == 0
+
+
+def test_chunked_reader_matches_default_reader(tmp_path):
+    input_file = tmp_path / 'MosaicResults.csv'
+    rows = [f'{i + 1},{track},{frame},{track + 0.5 * frame},{2.0 * track},0,{10 + track}\n'
+            for i, (track, frame) in enumerate((track, frame) for track in range(1, 6) for frame in range(7))]
+    input_file.write_text(MOSAIC_HEADER + ''.join(rows))
+
+    default = load_tracks(str(input_file))
+    # Chunk boundaries fall inside tracks
+    chunked = load_tracks(str(input_file), chunk_size=4)
+    np.testing.assert_array_equal(chunked.track_ids, default.track_ids)
+    np.testing.assert_array_equal(chunked.offsets, default.offsets)
+    np.testing.assert_allclose(chunked.x, default.x)
+    np.testing.assert_allclose(chunked.size, default.size)
+
+
+def test_bootstrap_in_a_spawn_pool_matches_serial_run():
+    rng = np.random.default_rng(0)
+    n_tracks, length = 6, 60
+    track_id = np.repeat(np.arange(1, n_tracks + 1), length)
+    frame = np.tile(np.arange(length), n_tracks)
+    x = rng.normal(size=(n_tracks, length)).cumsum(axis=1).ravel()
+    y = rng.normal(size=(n_tracks, length)).cumsum(axis=1).ravel()
+    msd_table = compute_msd_table(TrackStore.from_columns(track_id, frame, x, y, np.ones(len(frame))))
+
+    serial = bootstrap_msd_table(msd_table, 10, n_resamples=40, seed=3, batch_elements=1000)
+    pooled = bootstrap_msd_table(msd_table, 10, n_resamples=40, seed=3, batch_elements=1000, workers=2,
+                                 mp_context=multiprocessing.get_context('spawn'))
+    for key in serial:
+        np.testing.assert_array_equal(pooled[key], serial[key])
+
+
+@pytest.mark.parametrize('options', [['--window', '40', '--window-step', '0'], ['--window-step', '-3'],
+                                     ['--window', '1'], ['--window', '-40']])
+def test_invalid_windows_are_rejected_on_the_command_line(options):
+    with pytest.raises(SystemExit):
+        parse_arguments(['MosaicResults.csv', '0.9', '30', '10', 'Graphen'] + options)
+
+
+@pytest.mark.parametrize('window, step', [(40, 0), (40, -1), (1, 10)])
+def test_invalid_windows_are_rejected(window, step):
+    tracks_data = TrackStore.from_columns(np.ones(50, dtype=int), np.arange(50), np.arange(50.0), np.zeros(50),
+                                          np.ones(50))
+    with pytest.raises(ValueError):
+        sliding_window_diffusion(tracks_data, 10, window, step)
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import tifffile
+
+from GetIntsGUI import extract_intensities
+from PlotIntsGUI import link_components_to_tracks, load_intensity_image
+
+MOSAIC_HEADER = ',Trajectory,Frame,x,y,z,m0\n'
+
+
+def write_stack(path, n_frames=3, height=6, width=5):
+    stack = np.arange(n_frames * height * width, dtype=np.uint16).reshape(n_frames, height, width)
+    tifffile.imwrite(path, stack, photometric='minisblack')
+    return stack
+
+
+def test_csv_and_npy_give_the_same_image(tmp_path):
+    tif_file = str(tmp_path / 'Int.tif')
+    stack = write_stack(tif_file)
+    extract_intensities(tif_file, str(tmp_path / 'npy'), frames='0-2')
+    extract_intensities(tif_file, str(tmp_path / 'csv'), frames='0-2', write_npy=False, write_csv=True)
+
+    from_npy = load_intensity_image(str(tmp_path / 'npy'))
+    from_csv = load_intensity_image(str(tmp_path / 'csv'))
+    np.testing.assert_array_equal(from_npy, stack[0])
+    np.testing.assert_array_equal(from_csv, from_npy)
+
+
+def test_csv_uses_the_first_extracted_frame(tmp_path):
+    tif_file = str(tmp_path / 'Int.tif')
+    stack = write_stack(tif_file)
+    extract_intensities(tif_file, str(tmp_path / 'csv'), frames='2,0', write_npy=False, write_csv=True)
+    np.testing.assert_array_equal(load_intensity_image(str(tmp_path / 'csv')), stack[2])
+
+
+def components_at(*centroids):
+    return pd.DataFrame({'Frame': [frame for frame, _, _ in centroids],
+                         'Centroid X': [x for _, x, _ in centroids],
+                         'Centroid Y': [y for _, _, y in centroids]})
+
+
+def test_components_are_linked_to_the_nearest_track(tmp_path):
+    tracks_file = tmp_path / 'MosaicResults.csv'
+    tracks_file.write_text(MOSAIC_HEADER + '1,7,0,10.0,10.0,0,5\n2,7,1,11.0,10.0,0,5\n3,8,1,30.0,30.0,0,5\n')
+    linked = link_components_to_tracks(components_at((1, 11.5, 10.0), (0, 30.0, 30.0)), str(tracks_file))
+    assert linked['TrackID'].tolist() == [7, pd.NA]
+    assert linked['Track Distance (px)'].iloc[0] == 0.5
+
+
+def test_empty_tracks_file_leaves_components_unlinked(tmp_path):
+    tracks_file = tmp_path / 'MosaicResults.csv'
+    tracks_file.write_text(MOSAIC_HEADER)
+    linked = link_components_to_tracks(components_at((0, 1.0, 2.0), (1, 3.0, 4.0)), str(tracks_file))
+    assert str(linked['TrackID'].dtype) == 'Int64'
+    assert linked['TrackID'].isna().all()
+    assert linked['Track Distance (px)'].isna().all()
+
+
+def test_no_components_with_tracks(tmp_path):
+    tracks_file = tmp_path / 'MosaicResults.csv'
+    tracks_file.write_text(MOSAIC_HEADER + '1,7,0,10.0,10.0,0,5\n')
+    linked = link_components_to_tracks(components_at(), str(tracks_file))
+    assert len(linked) == 0 and 'TrackID' in linked
@@ -0,0 +1,30 @@
+import json
+import multiprocessing
+
+from RunReport import REPORT_FILE_NAME, RunReport
+
+
+def write_report(output_folder, script):
+    report = RunReport(script, output_folder, parameters={'script': script})
+    with report.run():
+        with report.stage('work'):
+            report.count('items', 3)
+
+
+def test_stages_and_counters_are_written(tmp_path):
+    write_report(str(tmp_path), 'Script')
+    with open(tmp_path / REPORT_FILE_NAME, encoding='utf-8') as f:
+        section = json.load(f)['Script']
+    assert [stage['stage'] for stage in section['stages']] == ['work', 'total']
+    assert section['counters'] == {'items': 3}
+    assert section['stages'][0]['peak_rss_mb'] is None or section['stages'][0]['peak_rss_mb'] > 0
+
+
+def test_concurrent_writers_keep_every_section(tmp_path):
+    scripts = [f'Script{i}' for i in range(24)]
+    with multiprocessing.get_context('fork').Pool(8) as pool:
+        pool.starmap(write_report, [(str(tmp_path), script) for script in scripts])
+    with open(tmp_path / REPORT_FILE_NAME, encoding='utf-8') as f:
+        report = json.load(f)
+    assert sorted(report) == sorted(scripts)
+    assert not list(tmp_path.glob('*.tmp'))
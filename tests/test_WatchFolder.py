@@ -0,0 +1,26 @@
+import os
+import multiprocessing
+
+import WatchFolder
+
+
+def crash_on_bad_file(kind, path, output_folder, parameters):
+    # Stand-in for process_file: the worker dies on bad.csv, all other files succeed
+    if os.path.basename(path) == 'bad.csv':
+        os._exit(1)
+    return {'Kind': kind, 'File': path, 'Output Folder': output_folder, 'Status': 'ok', 'Error': '', 'Seconds': 0.0}
+
+
+def test_watcher_survives_a_dying_worker(tmp_path, monkeypatch):
+    for name in ('bad.csv', 'cell1.csv', 'cell2.csv'):
+        (tmp_path / name).write_text('Trajectory,Frame,x,y,m0\n')
+    # fork, so the workers see the patched process_file
+    monkeypatch.setattr(WatchFolder, 'process_file', crash_on_bad_file)
+
+    state = WatchFolder.watch(str(tmp_path), workers=1, interval=0.05, once=True,
+                              mp_context=multiprocessing.get_context('fork'))
+
+    status = {os.path.basename(path): entry['Status'] for path, entry in state.items()}
+    assert status == {'bad.csv': 'error', 'cell1.csv': 'ok', 'cell2.csv': 'ok'}
+    assert state[str(tmp_path / 'bad.csv')]['Error'].startswith('BrokenProcessPool')
+    assert os.path.exists(os.path.join(tmp_path, 'Graphen', WatchFolder.STATE_FILE_NAME))